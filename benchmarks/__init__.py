@@ -0,0 +1,4 @@
+"""Benchmarks for the bias pipeline. Run from the repository root, e.g.
+`python -m benchmarks.bench_metrics`. Results are stored in
+benchmarks/results/.
+"""
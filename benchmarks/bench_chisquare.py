@@ -0,0 +1,89 @@
+"""Data point distribution chi-square: scipy.stats.chisquare over every row
+versus bias_util.uniform_chisquare over the visited rows only.
+
+Usage: python -m benchmarks.bench_chisquare [--logs 100] [--output results.json]
+
+Exits with status 1 if any relative difference exceeds TOLERANCE.
+"""
+import argparse
+import sys
+import time
+import warnings
+
+import numpy as np
+from scipy.stats import chisquare
+
+import bias
+import bias_state
+import bias_util
+from benchmarks.common import make_logs, save_results, scorable_logs
+
+NUM_REPEATS = 200
+TOLERANCE = 1e-9
+
+
+def relative_difference(a, b):
+    if np.isnan(a) and np.isnan(b):
+        return 0.0
+    return abs(a - b) / abs(a) if a else abs(b)
+
+
+def bench(filename, num_logs):
+    num_rows = len(bias.DATA_MAP[filename]["data"])
+    state = bias_state.MetricState(filename)
+    for log in scorable_logs(filename, make_logs(filename, num_logs)):
+        state.update(log)
+    total = state.frac_counter
+    expected = 1.0 * total / num_rows
+    dense = np.zeros(num_rows)
+    for row, count in state.counts.items():
+        dense[row] = count
+    visited = list(state.counts.values())
+
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        dense_result = chisquare(dense, f_exp=np.full(num_rows, expected))
+    dense_seconds = (time.perf_counter() - start) / NUM_REPEATS
+
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        sparse_result = bias_util.uniform_chisquare(visited, num_rows, total)
+    sparse_seconds = (time.perf_counter() - start) / NUM_REPEATS
+
+    return {
+        "num_rows": num_rows,
+        "num_visited": len(visited),
+        "dense_seconds": dense_seconds,
+        "sparse_seconds": sparse_seconds,
+        "max_relative_difference": max(
+            relative_difference(dense_result[0], sparse_result[0]),
+            relative_difference(dense_result[1], sparse_result[1]),
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--logs", type=int, default=100, help="interactions per session")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    results = {}
+    for filename in bias.DATA_MAP:
+        result = results[filename] = bench(filename, args.logs)
+        print(
+            f"{filename}: {result['num_visited']} of {result['num_rows']} rows visited: "
+            f"dense {result['dense_seconds'] * 1e6:.1f} us, sparse {result['sparse_seconds'] * 1e6:.1f} us, "
+            f"max relative difference {result['max_relative_difference']:.2g}"
+        )
+    path = save_results("bench_chisquare", results, args.output)
+    print(f"Saved results to {path}")
+    if max(result["max_relative_difference"] for result in results.values()) > TOLERANCE:
+        print(f"Relative difference exceeds {TOLERANCE}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
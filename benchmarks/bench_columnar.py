@@ -0,0 +1,71 @@
+"""Per-event cost of the incremental metric state on the larger datasets.
+"""
+import time
+import warnings
+
+import bias
+import bias_state
+from benchmarks.common import make_logs
+
+DATASETS = ["colleges.csv", "housing.csv"]
+NUM_LOGS = 500
+NUM_REPEATS = 20
+
+
+def bench(filename, num_logs):
+    """Return mean microseconds per event spent in update() and in metrics()."""
+    logs = make_logs(filename, num_logs)
+    state = bias_state.MetricState(filename)
+    update_time = 0
+    metrics_time = 0
+    for log in logs:
+        start = time.perf_counter()
+        state.update(log)
+        mid = time.perf_counter()
+        state.metrics()
+        update_time += mid - start
+        metrics_time += time.perf_counter() - mid
+    return update_time / num_logs * 1e6, metrics_time / num_logs * 1e6
+
+
+def bench_gather(filename, num_logs):
+    """Return microseconds to gather every numerical attribute for a session's
+    interacted data points, from the row dicts and from the columnar store.
+    """
+    dataset = bias.DATA_MAP[filename]
+    index = dataset["index"]
+    ids = []
+    for log in make_logs(filename, num_logs):
+        if isinstance(log["data"]["id"], list):
+            ids.extend(log["data"]["id"])
+        else:
+            ids.append(log["data"]["id"])
+    attrs = [attr for attr in dataset["attributes"] if attr in index.columns]
+
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        for attr in attrs:
+            [dataset["data"][pid][attr] for pid in ids]
+    dict_us = (time.perf_counter() - start) / NUM_REPEATS * 1e6
+
+    rows = index.rows(ids)
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        for attr in attrs:
+            index.columns[attr][rows]
+    columnar_us = (time.perf_counter() - start) / NUM_REPEATS * 1e6
+    return len(ids), dict_us, columnar_us
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    for filename in DATASETS:
+        dataset = bias.DATA_MAP[filename]
+        update_us, metrics_us = bench(filename, NUM_LOGS)
+        print(
+            f"{filename}: {len(dataset['data'])} rows x {len(dataset['attributes'])} attrs, "
+            f"update {update_us:.0f} us/event, metrics {metrics_us:.0f} us/event"
+        )
+        num_points, dict_us, columnar_us = bench_gather(filename, NUM_LOGS)
+        print(f"  gather {num_points} points: row dicts {dict_us:.0f} us, columnar {columnar_us:.0f} us")
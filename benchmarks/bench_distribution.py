@@ -0,0 +1,106 @@
+"""Cost of the connect-time "attribute_distribution" message: building and
+encoding it for every socket versus the packets cached by
+distribution_payload, in full, for a single dataset and compressed.
+
+Usage: python -m benchmarks.bench_distribution [--dataset cars.csv]
+    [--repeats 20] [--output results.json]
+
+Exits with status 1 if a cached packet differs from what
+sio.emit("attribute_distribution", ...) encodes.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import warnings
+import zlib
+
+from socketio import packet
+
+import bias
+import distribution_payload
+from benchmarks.common import save_results
+
+
+def encode_per_socket():
+    """What connect did before: a new dict of every distribution, encoded."""
+    attr_dist = {}
+    for filename in bias.DATA_MAP:
+        attr_dist[filename] = bias.DATA_MAP[filename]["distribution"]
+    return packet.Packet(packet.EVENT, data=["attribute_distribution", attr_dist]).encode()
+
+
+def size(encoded_packet):
+    if isinstance(encoded_packet, list):
+        return sum(len(ep) for ep in encoded_packet)
+    return len(encoded_packet.encode("utf-8"))
+
+
+def timed(repeats, fn):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - start) / repeats, result
+
+
+async def bench(filename, repeats):
+    payloads = distribution_payload.DistributionPayloads(None, bias.DATA_MAP)
+    names = list(bias.DATA_MAP)
+    loop = asyncio.get_event_loop()
+
+    start = time.perf_counter()
+    full = await payloads.packet(names)
+    first_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeats):
+        await payloads.packet(names)
+    cached_seconds = (time.perf_counter() - start) / repeats
+    single = await payloads.packet([filename])
+    compressed = await payloads.packet(names, "deflate")
+    single_compressed = await payloads.packet([filename], "deflate")
+    per_socket_seconds, reference = await loop.run_in_executor(None, timed, repeats, encode_per_socket)
+
+    # the compressed payload inflates to the same distributions
+    header, data = compressed
+    inflated = json.loads(zlib.decompress(data))
+    matches = full == reference and inflated == json.loads(reference[len("2"):])[1]
+    return {
+        "per_socket_seconds": per_socket_seconds,
+        "first_build_seconds": first_seconds,
+        "cached_seconds": cached_seconds,
+        "bytes": {
+            "all": size(full),
+            "all_deflate": size(compressed),
+            filename: size(single),
+            f"{filename}_deflate": size(single_compressed),
+        },
+        "matches": matches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dataset", default="cars.csv", help="dataset a client asks for alone")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    results = asyncio.run(bench(args.dataset, args.repeats))
+    print(
+        f"per socket {results['per_socket_seconds'] * 1e3:.1f} ms, "
+        f"first build {results['first_build_seconds'] * 1e3:.1f} ms, "
+        f"cached {results['cached_seconds'] * 1e6:.1f} us"
+    )
+    print(", ".join(f"{name} {size / 1024:.0f} KiB" for name, size in results["bytes"].items()))
+    path = save_results("bench_distribution", results, args.output)
+    print(f"Saved results to {path}")
+    if not results["matches"]:
+        print("Cached packets differ from the packet sio.emit encodes")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Time folding an aggregate (group) interaction into the attribute metrics:
+per data point in Python, as MetricState.update did before, versus the
+vectorized group summaries of DatasetIndex.group(), computed for a new group
+and served from the cache for a group interacted with again.
+
+Usage: python -m benchmarks.bench_groups [--dataset housing.csv]
+    [--sizes 10 100 1000] [--output results.json]
+
+Exits with status 1 if a summary differs from what statistics.median,
+statistics.mode and the per data point sums give.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+import warnings
+from array import array
+
+import numpy as np
+
+import bias
+from benchmarks.common import save_results
+
+REPEATS = 200
+
+
+def per_point(index, rows, sample, category_counts):
+    """What update() did for every group: a list of values per attribute,
+    and every data point added to the samples one by one.
+    """
+    quantiles = {}
+    for attr in index.attributes:
+        values = index.values(attr, rows)
+        if attr in index.columns:
+            value = statistics.median(values)
+        else:
+            try:
+                value = statistics.mode(values)
+            except statistics.StatisticsError:
+                value = values[0]
+        quantiles[attr] = index.which_quantile(attr, value)
+    for attr in category_counts:
+        np.add.at(category_counts[attr], index.codes[attr][rows], 1.0 / len(rows))
+    index.ks.add(sample, rows, 1.0 / len(rows))
+    return quantiles
+
+
+def summarized(index, record, sample, category_counts):
+    group = index.group(record)
+    quantiles = {attr: group.quantile(attr) for attr in index.attributes}
+    for attr in category_counts:
+        category_counts[attr] += group.histogram(attr) * (1.0 / len(group.rows))
+    index.ks.add_histogram(sample, group.ks_histogram(), 1.0 / len(group.rows))
+    return quantiles
+
+
+def same(a, b):
+    return a == b or (a != a and b != b)
+
+
+def bench(filename, size, rnd):
+    index = bias.DATA_MAP[filename]["index"]
+    groups = [rnd.sample(range(len(index.row_ids)), min(size, len(index.row_ids))) for _ in range(REPEATS)]
+
+    def fresh():
+        return index.ks.empty_sample(), {attr: np.zeros(len(index.categories[attr])) for attr in index.codes}
+
+    timings = {}
+    results = {}
+    for mode in ("per_point", "new_group", "same_group"):
+        sample, category_counts = fresh()
+        if mode == "per_point":
+            inputs = [np.array(rows) for rows in groups]
+        elif mode == "new_group":
+            inputs = [array("i", rows) for rows in groups]
+        else:
+            inputs = [array("i", groups[0])] * REPEATS
+            summarized(index, inputs[0], *fresh())
+        fold = per_point if mode == "per_point" else summarized
+        start = time.perf_counter()
+        quantiles = [fold(index, rows, sample, category_counts) for rows in inputs]
+        timings[mode] = (time.perf_counter() - start) / REPEATS
+        results[mode] = (quantiles[0], sample, category_counts)
+
+    # the same groups folded both ways give the same quantiles and samples
+    reference, summary = results["per_point"], results["new_group"]
+    matches = all(same(reference[0][attr], summary[0][attr]) for attr in index.attributes)
+    matches = matches and np.allclose(reference[1], summary[1], rtol=0, atol=1e-9)
+    matches = matches and all(
+        np.allclose(reference[2][attr], summary[2][attr], rtol=0, atol=1e-9) for attr in reference[2]
+    )
+    return {"seconds": timings, "match": matches}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dataset", default="housing.csv")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    rnd = random.Random(0)
+    results = {"dataset": args.dataset, "sizes": {}}
+    for size in args.sizes:
+        result = results["sizes"][str(size)] = bench(args.dataset, size, rnd)
+        seconds = result["seconds"]
+        print(
+            f"group of {size}: per data point {seconds['per_point'] * 1e6:.0f} us, "
+            f"new group {seconds['new_group'] * 1e6:.0f} us, same group {seconds['same_group'] * 1e6:.0f} us"
+        )
+
+    path = save_results("bench_groups", results, args.output)
+    print(f"Saved results to {path}")
+    if not all(result["match"] for result in results["sizes"].values()):
+        print("Group summaries differ from the per data point computation")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Weighted k-s statistics of all numerical attributes: bias_util.ks_w2 per
+attribute versus the batched weighted_ks.BaselineECDF.
+
+Usage: python -m benchmarks.bench_ks [--logs 1000] [--output results.json]
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+import bias
+import bias_state
+import bias_util
+from benchmarks.common import make_logs, save_results, scorable_logs
+
+NUM_REPEATS = 20
+
+
+def bench(filename, num_logs):
+    dataset = bias.DATA_MAP[filename]
+    index = dataset["index"]
+    state = bias_state.MetricState(filename)
+    for log in scorable_logs(filename, make_logs(filename, num_logs)):
+        state.update(log)
+    rows = np.frombuffer(state.sample_rows, dtype=np.int64)
+    weights = np.frombuffer(state.sample_weights, dtype=np.float64)
+    attrs = index.ks.attributes
+
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        ks_w2 = [
+            bias_util.ks_w2(
+                dataset["distribution"][attr],
+                index.columns[attr][rows],
+                [1.0] * len(dataset["distribution"][attr]),
+                weights,
+            )
+            for attr in attrs
+        ]
+    ks_w2_seconds = (time.perf_counter() - start) / NUM_REPEATS
+
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        batched = index.ks.statistics(state.ks_sample)
+    batched_seconds = (time.perf_counter() - start) / NUM_REPEATS
+
+    return {
+        "num_attributes": len(attrs),
+        "num_samples": len(rows),
+        "ks_w2_seconds": ks_w2_seconds,
+        "batched_seconds": batched_seconds,
+        "max_difference": float(np.max(np.abs(np.array(ks_w2) - batched), initial=0.0)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--logs", type=int, default=1000, help="interactions per session")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    results = {}
+    for filename in bias.DATA_MAP:
+        result = results[filename] = bench(filename, args.logs)
+        print(
+            f"{filename}: {result['num_attributes']} attrs, {result['num_samples']} samples: "
+            f"ks_w2 {result['ks_w2_seconds'] * 1e3:.2f} ms, batched {result['batched_seconds'] * 1e3:.3f} ms, "
+            f"max difference {result['max_difference']:.2g}"
+        )
+    path = save_results("bench_ks", results, args.output)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Time loading every dataset: parsing the CSV files, parsing and writing
+the cache of dataset_cache, and reading the cache back.
+
+Usage: python -m benchmarks.bench_load [--repeats 5] [--output results.json]
+
+Each run loads the datasets into a new registry, with the cache in a
+temporary directory.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import warnings
+from contextlib import redirect_stdout
+
+import bias
+import dataset_registry
+from benchmarks.common import save_results
+
+
+def load_all(cache_dir):
+    """Seconds to load every dataset of the manifest with the given cache dir."""
+    bias.DATASET_CACHE_DIR = cache_dir
+    registry = dataset_registry.DatasetRegistry(bias.DATA_MAP.manifest_path, bias.load_dataset)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        registry.load_all()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    cache_dir = tempfile.mkdtemp(prefix="socratic-cache-")
+    seconds = {"no_cache": [], "cache_miss": [], "cache_hit": []}
+    try:
+        for _ in range(args.repeats):
+            seconds["no_cache"].append(load_all(""))
+            shutil.rmtree(cache_dir)
+            seconds["cache_miss"].append(load_all(cache_dir))
+            seconds["cache_hit"].append(load_all(cache_dir))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results = {"datasets": len(bias.DATA_MAP), "seconds": {k: statistics.median(v) for k, v in seconds.items()}}
+    print(
+        f"{results['datasets']} datasets: "
+        + ", ".join(f"{k.replace('_', ' ')} {v * 1e3:.0f} ms" for k, v in results["seconds"].items())
+    )
+    path = save_results("bench_load", results, args.output)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Memory held by a session's bias logs: the interaction payloads versus the
+compact bias_state.LogRecord kept instead.
+
+Usage: python -m benchmarks.bench_log_memory [--datasets cars.csv ...]
+    [--logs 1000] [--output results.json]
+
+Payloads are decoded from JSON, as the server receives them, and measured
+with participant_store.deep_sizeof. Exits with status 1 if the metrics of a
+state fed the records differ from those of a state fed the payloads.
+"""
+import argparse
+import json
+import sys
+import warnings
+
+import bias
+import bias_state
+from benchmarks.common import make_logs, save_results, scorable_logs
+from participant_store import deep_sizeof
+
+
+def bench(filename, num_logs):
+    logs = scorable_logs(filename, make_logs(filename, num_logs))
+    for log in logs:
+        log.update(appType="AWARENESS", appLevel="live", participantId="participant-0001")
+    payloads = json.loads(json.dumps(logs))
+
+    state = bias_state.MetricState(filename)
+    records = [state.update(payload) for payload in payloads]
+    replayed = bias_state.MetricState(filename)
+    for record in records:
+        replayed.update(record)
+
+    payload_bytes = deep_sizeof(payloads)
+    record_bytes = deep_sizeof(records)
+    return {
+        "logs": len(payloads),
+        "payload_bytes": payload_bytes,
+        "record_bytes": record_bytes,
+        "reduction": payload_bytes / record_bytes,
+        "matches": json.dumps(state.metrics("full"), sort_keys=True, default=str)
+        == json.dumps(replayed.metrics("full"), sort_keys=True, default=str),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--datasets", nargs="+", help="datasets to measure (default: all)")
+    parser.add_argument("--logs", type=int, default=1000, help="interactions per session")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    results = {}
+    for filename in args.datasets or list(bias.DATA_MAP):
+        result = results[filename] = bench(filename, args.logs)
+        print(
+            f"{filename}: {result['logs']} logs, payloads {result['payload_bytes'] / 1024:.0f} KiB, "
+            f"records {result['record_bytes'] / 1024:.0f} KiB (x{result['reduction']:.1f})"
+        )
+
+    path = save_results("bench_log_memory", results, args.output)
+    print(f"Saved results to {path}")
+    if not all(result["matches"] for result in results.values()):
+        print("Metrics computed from the records differ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
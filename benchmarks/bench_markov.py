@@ -0,0 +1,63 @@
+"""Time bias_util.get_markov_expected_value, uncached and cached; the exact
+Decimal formula it replaced is in tests/test_bias_util.py, which checks it.
+
+Usage: python -m benchmarks.bench_markov [--output results.json]
+
+Covers every N the metrics use: the dataset sizes (data point coverage)
+and the quantile / category counts of every attribute (attribute coverage).
+"""
+import argparse
+import time
+import warnings
+
+import bias
+import bias_util
+from benchmarks.common import save_results
+
+
+def used_sizes():
+    """Get every N get_markov_expected_value is called with."""
+    sizes = set()
+    for dataset in bias.DATA_MAP.values():
+        sizes.add(len(dataset["data"]))
+        for attr in dataset["attributes"]:
+            sizes.add(len(dataset["index"].quantiles[attr]))
+    return sorted(sizes)
+
+
+def time_calls(fn, sizes, ks):
+    start = time.perf_counter()
+    for N in sizes:
+        for k in ks:
+            fn(N, k)
+    return (time.perf_counter() - start) / (len(sizes) * len(ks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    sizes = used_sizes()
+    print(f"N in {sizes}")
+
+    timing_ks = [10, 100, 1000, 10000]
+    results = {"sizes": sizes, "seconds_per_call": {}}
+    for k in timing_ks:
+        bias_util.get_markov_expected_value.cache_clear()
+        closed_form = time_calls(bias_util.get_markov_expected_value.__wrapped__, sizes, [k])
+        time_calls(bias_util.get_markov_expected_value, sizes, [k])  # fill the cache
+        cached = time_calls(bias_util.get_markov_expected_value, sizes, [k])
+        results["seconds_per_call"][str(k)] = {"closed_form": closed_form, "cached": cached}
+        print(
+            f"k = {k}: closed form {closed_form * 1e6:.2f} us, cached {cached * 1e6:.2f} us"
+        )
+
+    path = save_results("bench_markov", results, args.output)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
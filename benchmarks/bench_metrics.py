@@ -0,0 +1,102 @@
+"""Time bias.compute_metrics and each metric function on every dataset.
+
+Usage: python -m benchmarks.bench_metrics [--datasets cars.csv ...]
+    [--lengths 10 100 1000 10000] [--output results.json]
+"""
+import argparse
+import statistics
+import time
+import warnings
+
+import bias
+import bias_state
+from benchmarks.common import make_logs, rss_bytes, save_results, scorable_logs
+
+LENGTHS = [10, 100, 1000, 10000]
+
+# Keep repeating a measurement until it took this many seconds in total
+#   (at least once, at most MAX_REPEATS times)
+TIME_BUDGET = 1.0
+MAX_REPEATS = 20
+
+
+def metric_functions(filename):
+    """Map benchmark name to a function of the logs."""
+    dataset = bias.DATA_MAP[filename]
+    return {
+        "compute_metrics": lambda logs: bias.compute_metrics(filename, logs),
+        "data_point_coverage": lambda logs: bias.data_point_coverage(logs, dataset["data"]),
+        "data_point_distribution": lambda logs: bias.data_point_distribution(logs, dataset["data"]),
+        "attribute_coverage": lambda logs: bias.attribute_coverage(
+            logs, dataset["data"], dataset["attributes"], dataset["distribution"], dataset.get("index")
+        ),
+        "attribute_distribution": lambda logs: bias.attribute_distribution(
+            logs,
+            dataset["data"],
+            dataset["attributes"],
+            dataset["distribution"],
+            dataset["numerical_attributes"],
+        ),
+        # the live path: fold every log into the state, compute once
+        "incremental_update": lambda logs: _update_all(filename, logs),
+    }
+
+
+def _update_all(filename, logs):
+    state = bias_state.MetricState(filename)
+    for log in logs:
+        state.update(log)
+    return state
+
+
+def time_function(fn, *args):
+    """Return timing statistics in seconds of repeated calls to fn(*args)."""
+    times = []
+    while len(times) < MAX_REPEATS and (not times or sum(times) < TIME_BUDGET):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return {
+        "repeats": len(times),
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+    }
+
+
+def bench(filename, num_logs):
+    logs = scorable_logs(filename, make_logs(filename, num_logs))
+    results = {"num_logs": len(logs), "num_agg_logs": sum("agg" in log for log in logs)}
+    for name, fn in metric_functions(filename).items():
+        results[name] = time_function(fn, logs)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--datasets", nargs="+", help="datasets to benchmark (default: all)")
+    parser.add_argument("--lengths", nargs="+", type=int, default=LENGTHS, help="log lengths")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    results = {}
+    for filename in args.datasets or list(bias.DATA_MAP):
+        dataset = bias.DATA_MAP[filename]
+        print(f"{filename}: {len(dataset['data'])} rows x {len(dataset['attributes'])} attrs")
+        results[filename] = {}
+        for num_logs in args.lengths:
+            result = results[filename][str(num_logs)] = bench(filename, num_logs)
+            timings = ", ".join(
+                f"{name} {result[name]['median'] * 1e3:.2f}"
+                for name in metric_functions(filename)
+            )
+            print(f"  {result['num_logs']} logs (ms): {timings}")
+
+    path = save_results("bench_metrics", {"datasets": results, "rss_bytes": rss_bytes()}, args.output)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Time recovering a participant session from session_wal: replaying the
+whole write-ahead log versus loading the latest snapshot and replaying the
+records after it.
+
+Usage: python -m benchmarks.bench_recovery [--dataset cars.csv]
+    [--lengths 1250 10250] [--snapshot-every 500] [--output results.json]
+
+Sessions are logged the way server.py does (a "log" record of the compact log
+of each interaction, a snapshot of the metric state every --snapshot-every
+records) to a temporary directory, then read back and replayed. Exits with status 1 if a
+recovered state's metrics differ from the logged session's.
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import bias
+import bias_state
+import session_wal
+from benchmarks.common import make_logs, save_results, scorable_logs
+
+
+def log_session(wal, pid, filename, logs, snapshot_every):
+    session = {"bias_logs": [], "bias_state": bias_state.MetricState(filename)}
+    for log in logs:
+        record = session["bias_state"].update(log)
+        session["bias_logs"].append(record)
+        wal.append(pid, {"type": "log", "log": bias_state.compact_log(log, record)})
+        if snapshot_every and wal.needs_snapshot(pid):
+            wal.snapshot(pid, {"bias_state": session["bias_state"]})
+    return session
+
+
+def recover(wal, pid, filename):
+    session, records = wal.read(pid)
+    if session is None:
+        session = {"bias_state": bias_state.MetricState(filename)}
+    session["bias_logs"] = []
+    for record in records:
+        session["bias_logs"].append(session["bias_state"].update(record["log"]))
+    return session, len(records)
+
+
+def digest(session):
+    return json.dumps(session["bias_state"].metrics("full"), sort_keys=True, default=str)
+
+
+async def bench(filename, num_logs, snapshot_every, directory):
+    logs = scorable_logs(filename, make_logs(filename, num_logs))
+    results = {"logs": len(logs)}
+    for mode, every in (("wal_only", 0), ("snapshots", snapshot_every)):
+        wal = session_wal.SessionWAL(f"{directory}/{mode}", snapshot_every=every or 1, fsync_interval=0)
+        pid = f"{filename}-{num_logs}"
+        session = log_session(wal, pid, filename, logs, every)
+        await wal.stop()
+        start = time.perf_counter()
+        recovered, replayed = recover(wal, pid, filename)
+        results[mode] = {
+            "seconds": time.perf_counter() - start,
+            "replayed": replayed,
+            "match": digest(recovered) == digest(session),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dataset", default="cars.csv")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1250, 10250])
+    parser.add_argument("--snapshot-every", type=int, default=500)
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    directory = tempfile.mkdtemp(prefix="socratic-wal-")
+    results = {"dataset": args.dataset, "snapshot_every": args.snapshot_every, "lengths": {}}
+    ok = True
+    try:
+        for num_logs in args.lengths:
+            result = asyncio.run(bench(args.dataset, num_logs, args.snapshot_every, directory))
+            results["lengths"][str(num_logs)] = result
+            ok = ok and result["wal_only"]["match"] and result["snapshots"]["match"]
+            print(
+                f"{result['logs']} logs: replaying the log {result['wal_only']['seconds'] * 1e3:.0f} ms, "
+                f"snapshot + {result['snapshots']['replayed']} records "
+                f"{result['snapshots']['seconds'] * 1e3:.0f} ms"
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    path = save_results("bench_recovery", results, args.output)
+    print(f"Saved results to {path}")
+    if not ok:
+        print("Recovered metrics differ from the logged session")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
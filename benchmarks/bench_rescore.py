@@ -0,0 +1,113 @@
+"""Time computing the metric time series of a session log offline: replaying
+every prefix of the session through bias.compute_metrics versus the single
+incremental pass of rescore.py.
+
+Usage: python -m benchmarks.bench_rescore [--dataset cars.csv] [--logs 300]
+    [--output results.json]
+
+The session is written as a TSV session log the way the server does, and
+read back by rescore. Exits with status 1 if a metric differs from the
+replayed one.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import bias
+import rescore
+import session_log
+from benchmarks.common import make_logs, save_results, scorable_logs
+
+COLUMNS = [
+    "sid",
+    "participant_id",
+    "app_mode",
+    "app_type",
+    "app_level",
+    "processed_at",
+    "interaction_type",
+    "input_data",
+    "output_data",
+]
+
+
+def write_log(path, filename, logs):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for i, log in enumerate(logs):
+            response = {
+                "sid": "sid",
+                "participant_id": "participant-0001",
+                "app_mode": filename,
+                "app_type": "AWARENESS",
+                "app_level": "live",
+                "processed_at": i,
+                "interaction_type": log["interactionType"],
+                "input_data": log,
+            }
+            f.write(session_log._tsv_row(i, response, COLUMNS, i == 0))
+
+
+def replay_prefixes(filename, logs):
+    return [bias.compute_metrics(filename, logs[: i + 1]) for i in range(len(logs))]
+
+
+def matches(frame, replayed):
+    for (_, row), metrics in zip(frame.iterrows(), replayed):
+        for name, (metric, _) in metrics.items():
+            values = metric.items() if isinstance(metric, dict) else [(None, metric)]
+            for attr, value in values:
+                if abs(row[name if attr is None else f"{name}.{attr}"] - value) > 1e-9:
+                    return False
+    return True
+
+
+def bench(filename, num_logs, directory):
+    logs = scorable_logs(filename, make_logs(filename, num_logs))
+    path = Path(directory) / "logs_participant-0001_0.tsv"
+    write_log(path, filename, logs)
+
+    start = time.perf_counter()
+    frame = rescore.rescore([path], workers=1)
+    incremental_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    replayed = replay_prefixes(filename, logs)
+    replay_seconds = time.perf_counter() - start
+    return {
+        "logs": len(logs),
+        "replay_seconds": replay_seconds,
+        "incremental_seconds": incremental_seconds,
+        "match": matches(frame, replayed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dataset", default="cars.csv")
+    parser.add_argument("--logs", type=int, default=300, help="interactions in the session")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    directory = tempfile.mkdtemp(prefix="socratic-rescore-")
+    try:
+        results = bench(args.dataset, args.logs, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(
+        f"{args.dataset}, {results['logs']} logs: replaying every prefix {results['replay_seconds']:.2f} s, "
+        f"rescore {results['incremental_seconds']:.2f} s"
+    )
+    path = save_results("bench_rescore", dict(results, dataset=args.dataset), args.output)
+    print(f"Saved results to {path}")
+    if not results["match"]:
+        print("Rescored metrics differ from the replayed ones")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Encode time and bytes on the wire of the interaction events as JSON, as
+python-socketio sends them by default, versus MessagePack with packed float
+arrays (serialization.py), for every dataset.
+
+Usage: python -m benchmarks.bench_serialization [--datasets cars.csv ...]
+    [--logs 200] [--output results.json]
+
+The payloads are those of a session of --logs synthetic interactions: the
+aggregate interactions a client sends with recieve_interaction, the
+"interaction_response" carrying their "deltas" metrics, and the first "full"
+one. Exits with status 1 if a decoded MessagePack payload differs from the
+decoded JSON one.
+"""
+import argparse
+import json
+import math
+import sys
+import time
+import warnings
+
+from socketio import packet
+
+import bias
+import bias_state
+import serialization
+from benchmarks.common import make_logs, save_results, scorable_logs
+
+
+def size(encoded_packet):
+    if isinstance(encoded_packet, list):
+        return sum(len(ep) for ep in encoded_packet)
+    return len(encoded_packet.encode("utf-8"))
+
+
+def same(a, b):
+    """Equal as a client decodes them: numbers compare by value, NaN equals NaN."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+def response(filename, log, output_data):
+    """A response as handle_interaction builds it."""
+    return {
+        "sid": "sid",
+        "participant_id": "participant-0001",
+        "app_mode": filename,
+        "app_type": "AWARENESS",
+        "app_level": "live",
+        "processed_at": "2024-01-01 00:00:00",
+        "interaction_type": log["interactionType"],
+        "input_data": log,
+        "output_data": output_data,
+    }
+
+
+def payloads(filename, num_logs):
+    """Events of a session: {kind: [(event name, data), ...]}."""
+    logs = scorable_logs(filename, make_logs(filename, num_logs))
+    state = bias_state.MetricState(filename)
+    events = {"recieve_interaction": [], "interaction_response": [], "full": []}
+    for i, log in enumerate(logs):
+        state.update(log)
+        if i == 0:
+            metrics = state.metrics("full")
+            events["full"].append(("interaction_response", response(filename, log, metrics)))
+            state.mark_sent(metrics)
+        elif log.get("agg"):
+            events["recieve_interaction"].append(("recieve_interaction", log))
+            metrics = state.metrics("deltas")
+            events["interaction_response"].append(("interaction_response", response(filename, log, metrics)))
+            state.mark_sent(metrics)
+    # the full payload of the whole session
+    events["full"].append(("interaction_response", response(filename, logs[-1], state.metrics("full"))))
+    return events
+
+
+def encode(events, serialize):
+    start = time.perf_counter()
+    packets = [packet.Packet(packet.EVENT, data=[event, serialize(data)]).encode() for event, data in events]
+    return time.perf_counter() - start, packets
+
+
+def decode_json(encoded_packet):
+    # 2["event",data]
+    return json.loads(encoded_packet[1:])[1]
+
+
+def bench(filename, num_logs):
+    result = {}
+    for kind, events in payloads(filename, num_logs).items():
+        if not events:
+            continue
+        json_seconds, json_packets = encode(events, lambda data: data)
+        msgpack_seconds, msgpack_packets = encode(events, serialization.encode)
+        match = all(
+            same(serialization.decode(msgpack_packet[1]), decode_json(json_packet))
+            for json_packet, msgpack_packet in zip(json_packets, msgpack_packets)
+        )
+        result[kind] = {
+            "events": len(events),
+            "json_seconds": json_seconds / len(events),
+            "msgpack_seconds": msgpack_seconds / len(events),
+            "json_bytes": sum(map(size, json_packets)) / len(events),
+            "msgpack_bytes": sum(map(size, msgpack_packets)) / len(events),
+            "match": match,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--datasets", nargs="+", help="datasets to measure (default: all)")
+    parser.add_argument("--logs", type=int, default=200, help="interactions per session")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    results = {}
+    for filename in args.datasets or list(bias.DATA_MAP):
+        result = results[filename] = bench(filename, args.logs)
+        for kind, r in result.items():
+            print(
+                f"{filename} {kind}: JSON {r['json_bytes'] / 1024:.1f} KiB {r['json_seconds'] * 1e3:.2f} ms, "
+                f"MessagePack {r['msgpack_bytes'] / 1024:.1f} KiB {r['msgpack_seconds'] * 1e3:.2f} ms"
+            )
+
+    path = save_results("bench_serialization", results, args.output)
+    print(f"Saved results to {path}")
+    if not all(r["match"] for result in results.values() for r in result.values()):
+        print("Decoded MessagePack payloads differ from the JSON ones")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
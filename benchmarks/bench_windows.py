@@ -0,0 +1,97 @@
+"""Time and memory of the metric state of a growing session over the whole
+session, a window of the last interactions and with decayed weights.
+
+Usage: python -m benchmarks.bench_windows [--dataset cars.csv]
+    [--lengths 1000 10000] [--window 500] [--half-life 100]
+    [--output results.json]
+
+For each session length, reports the time of an update plus a "summary"
+metrics computation at the end of the session and the size of the state
+(participant_store.deep_sizeof). Exits with status 1 if the windowed
+state's metrics differ from those of a session state fed the window's
+interactions only.
+"""
+import argparse
+import sys
+import time
+import warnings
+
+import bias
+import bias_state
+from benchmarks.common import make_logs, save_results, scorable_logs
+from participant_store import deep_sizeof
+
+# updates timed at the end of each session
+TIMED = 200
+
+
+def values(metrics):
+    flat = {}
+    for name, (metric, _) in metrics.items():
+        if isinstance(metric, dict):
+            flat.update((f"{name}.{attr}", value) for attr, value in metric.items())
+        else:
+            flat[name] = metric
+    return flat
+
+
+def bench(filename, logs, window):
+    state = bias_state.metric_state(filename, window)
+    for log in logs[:-TIMED]:
+        state.update(log)
+    start = time.perf_counter()
+    for log in logs[-TIMED:]:
+        state.update(log)
+        state.metrics("summary")
+    seconds = (time.perf_counter() - start) / TIMED
+    return state, {"seconds": seconds, "bytes": deep_sizeof(state)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dataset", default="cars.csv")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--window", type=int, default=500, help="interactions in the window")
+    parser.add_argument("--half-life", type=int, default=100, help="half-life in interactions")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    windows = {
+        "session": None,
+        "window": ("interactions", args.window),
+        "decayed": ("halfLife", args.half_life),
+    }
+    results = {"dataset": args.dataset, "lengths": {}}
+    ok = True
+    for num_logs in args.lengths:
+        logs = scorable_logs(args.dataset, make_logs(args.dataset, num_logs))
+        result = results["lengths"][str(num_logs)] = {}
+        for name, window in windows.items():
+            state, result[name] = bench(args.dataset, logs, window)
+            if name == "window":
+                reference = bias_state.MetricState(args.dataset)
+                for log in logs[-args.window :]:
+                    reference.update(log)
+                expected = values(reference.metrics("summary"))
+                got = values(state.metrics("summary"))
+                result[name]["match"] = all(abs(got[key] - expected[key]) < 1e-9 for key in expected)
+                ok = ok and result[name]["match"]
+        print(
+            f"{len(logs)} logs: "
+            + ", ".join(
+                f"{name} {result[name]['seconds'] * 1e3:.2f} ms/update {result[name]['bytes'] / 1024:.0f} KiB"
+                for name in windows
+            )
+        )
+
+    path = save_results("bench_windows", results, args.output)
+    print(f"Saved results to {path}")
+    if not ok:
+        print("Windowed metrics differ from the metrics of the window's interactions")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Shared helpers for the benchmarks.
+"""
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import bias
+import bias_state
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def make_logs(filename, num_logs, agg_ratio=0.2, max_group_size=50, seed=0):
+    """Make a synthetic interaction log for the dataset.
+
+    Mixes single data point hovers with aggregate (group) clicks whose `id`
+        is a list of data point ids, like the frontend sends.
+    """
+    rnd = random.Random(seed)
+    dataset = bias.DATA_MAP[filename]
+    ids = list(dataset["data"])
+    attrs = dataset["attributes"]
+    logs = []
+    for i in range(num_logs):
+        if i > 0 and rnd.random() < agg_ratio:
+            group = rnd.sample(ids, rnd.randint(1, min(max_group_size, len(ids))))
+            x_attr, y_attr = rnd.sample(attrs, 2)
+            logs.append(
+                {
+                    "appMode": filename,
+                    "interactionType": "click_group",
+                    "agg": True,
+                    "data": {
+                        "id": group,
+                        "x": {"name": x_attr, "value": [dataset["data"][pid][x_attr] for pid in group]},
+                        "y": {"name": y_attr, "value": [dataset["data"][pid][y_attr] for pid in group]},
+                    },
+                }
+            )
+        else:
+            logs.append({"appMode": filename, "interactionType": "mouseover_item", "data": {"id": rnd.choice(ids)}})
+    return logs
+
+
+def scorable_logs(filename, logs):
+    """Drop the logs the metrics cannot be computed for.
+
+    E.g. aggregates over synthetic_voters_v14.csv whose median of a string
+        valued "numerical" attribute raises.
+    """
+    state = bias_state.MetricState(filename)
+    kept = []
+    for log in logs:
+        try:
+            state.update(log)
+        except Exception:
+            continue
+        kept.append(log)
+    return kept
+
+
+def rss_bytes(pid=None):
+    """Return the current and peak resident set size of a process in bytes
+    (this one by default), as {"current": ..., "peak": ...}.
+    """
+    status = Path(f"/proc/{pid or 'self'}/status")
+    if not status.exists():
+        # no procfs, only the peak of this process is known
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak *= 1024
+        return {"current": None, "peak": peak if pid is None else None}
+    fields = {}
+    for line in status.read_text().splitlines():
+        key, _, value = line.partition(":")
+        if key in ("VmRSS", "VmHWM"):
+            fields[key] = int(value.split()[0]) * 1024
+    return {"current": fields.get("VmRSS"), "peak": fields.get("VmHWM")}
+
+
+def save_results(name, results, output=None):
+    """Store benchmark results as JSON along with what they were measured on.
+
+    Goes to benchmarks/results/<name>_<time>.json unless output is given.
+    Returns the path written.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    document = {
+        "benchmark": name,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if output is None:
+        output = RESULTS_DIR / f"{name}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(document, indent=2))
+    return output
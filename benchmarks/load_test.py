@@ -0,0 +1,167 @@
+"""Load test: concurrent Socket.IO clients sending interactions to the server.
+
+Usage: python -m benchmarks.load_test [--clients 10] [--events 200]
+    [--dataset cars.csv] [--url http://localhost:3000] [--output results.json]
+
+Each client is a participant sending synthetic interactions through
+`recieve_interaction`, one at a time, and waiting for the
+`interaction_response` before sending the next one. Without --url, a server
+with Firestore stubbed out (benchmarks.stub_server) is started on a free
+port and stopped afterwards; extra environment variables such as
+METRICS_WINDOW_MS are passed on to it.
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+
+import socketio
+
+import bias
+from benchmarks.common import make_logs, rss_bytes, save_results, scorable_logs
+
+RESPONSE_TIMEOUT = 30.0
+
+
+class LoadClient:
+    """One simulated participant."""
+
+    def __init__(self, url, participant_id, logs):
+        self.url = url
+        self.participant_id = participant_id
+        self.logs = logs
+        self.latencies = []
+        self.errors = 0
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("interaction_response", self._on_response)
+        self._response = None
+
+    async def _on_response(self, data):
+        if self._response is not None and not self._response.done():
+            self._response.set_result(data)
+
+    async def run(self):
+        await self.sio.connect(self.url)
+        loop = asyncio.get_event_loop()
+        try:
+            for log in self.logs:
+                payload = dict(log, appType="AWARENESS", appLevel="live", participantId=self.participant_id)
+                self._response = loop.create_future()
+                start = time.perf_counter()
+                await self.sio.emit("recieve_interaction", payload)
+                try:
+                    await asyncio.wait_for(self._response, RESPONSE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.errors += 1
+                    continue
+                self.latencies.append(time.perf_counter() - start)
+        finally:
+            await self.sio.disconnect()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def start_server(port):
+    """Start benchmarks.stub_server and wait until it accepts connections."""
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.stub_server", "--port", str(port)])
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Timed out waiting for the server to start")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+async def run_clients(url, num_clients, num_events, filename):
+    clients = []
+    run_id = int(time.time())
+    for i in range(num_clients):
+        logs = scorable_logs(filename, make_logs(filename, num_events, seed=i))
+        clients.append(LoadClient(url, f"load-{run_id}-{i}", logs))
+    start = time.perf_counter()
+    await asyncio.gather(*(client.run() for client in clients))
+    return clients, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--clients", type=int, default=10, help="number of concurrent clients")
+    parser.add_argument("--events", type=int, default=200, help="interactions per client")
+    parser.add_argument("--dataset", default="cars.csv")
+    parser.add_argument("--url", help="server to test (default: start a stubbed one)")
+    parser.add_argument("--output", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    # only to generate the interactions
+    bias.precompute_distributions()
+
+    process = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        process = start_server(port)
+        url = f"http://localhost:{port}"
+    try:
+        clients, elapsed = asyncio.get_event_loop().run_until_complete(
+            run_clients(url, args.clients, args.events, args.dataset)
+        )
+        server_rss = rss_bytes(process.pid) if process is not None else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    results = {
+        "url": args.url,
+        "dataset": args.dataset,
+        "clients": args.clients,
+        "events_per_client": args.events,
+        "events": len(latencies),
+        "errors": sum(client.errors for client in clients),
+        "seconds": elapsed,
+        "events_per_second": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1e3 if latencies else None,
+            "p99": percentile(latencies, 99) * 1e3 if latencies else None,
+            "mean": statistics.mean(latencies) * 1e3 if latencies else None,
+            "max": max(latencies) * 1e3 if latencies else None,
+        },
+        "server_rss_bytes": server_rss,
+        "client_rss_bytes": rss_bytes(),
+    }
+    print(
+        f"{results['events']} events from {args.clients} clients in {elapsed:.1f} s: "
+        f"{results['events_per_second']:.0f} events/s, "
+        f"p50 {results['latency_ms']['p50']:.1f} ms, p99 {results['latency_ms']['p99']:.1f} ms, "
+        f"{results['errors']} errors"
+    )
+    if server_rss is not None and server_rss["current"] is not None:
+        print(f"Server RSS {server_rss['current'] / 2**20:.0f} MB (peak {server_rss['peak'] / 2**20:.0f} MB)")
+    path = save_results("load_test", results, args.output)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
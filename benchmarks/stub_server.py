@@ -0,0 +1,50 @@
+"""Run the server with Firestore stubbed out, for load tests.
+
+Usage: python -m benchmarks.stub_server [--port 3000] [--workdir DIR]
+
+Documents go to an in-memory firestore_queue.MemorySink instead of
+Firestore, so no credentials are needed. Session logs are written below
+--workdir (a temporary directory by default) instead of ./output.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import types
+import warnings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 3000)))
+    parser.add_argument("--workdir", help="directory to write session logs to")
+    args = parser.parse_args()
+
+    # server imports the Firestore client from firebase_config, which needs
+    #   credentials; nothing reaches the client with the sink replaced below
+    firebase_config = types.ModuleType("firebase_config")
+    firebase_config.db = None
+    sys.modules["firebase_config"] = firebase_config
+
+    from aiohttp import web
+
+    import bias
+    import firestore_queue
+    import server
+
+    server.FIRESTORE_QUEUE.sink = firestore_queue.MemorySink()
+
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    # datasets are loaded from ./data, everything written goes to the workdir;
+    #   metric worker processes started there find the datasets through these
+    os.environ["DATASET_MANIFEST"] = bias.DATA_MAP.manifest_path
+    if bias.DATASET_CACHE_DIR:
+        os.environ["DATASET_CACHE_DIR"] = os.path.abspath(bias.DATASET_CACHE_DIR)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="socratic-load-"))
+    print(f"Writing session logs to {os.getcwd()}")
+    web.run_app(server.APP, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,185 +15,93 @@ from scipy.stats import chisquare
 from scipy.stats import ks_2samp
 
 import bias_util
+import dataset_cache
+import dataset_registry
+from dataset_index import DatasetIndex
 
 NUM_QUANTILES = 4
 MIN_LOG_NUM = 10
-DATA_MAP = {
-    "credit_risk.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "Age",
-            "Annual Income",
-            "Employment Length",
-            "Loan Amount",
-            "Loan Interest Rate",
-            "Credit History",
-        ],
-        "data": {},
-    },
-    "cars.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "Length",
-            "Width",
-            "Height",
-            "Number of Forward Gears",
-            "Torque",
-            "Horsepower",
-            "City mpg",
-            "Highway mpg",
-        ],
-        "data": {},
-    },
-    "cars-w-year.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "MPG",
-            "Cylinders",
-            "Displacement",
-            "Horsepower",
-            "Weight",
-            "Acceleration",
-            "Year",
-        ],
-        "data": {},
-    },
-    "movies-w-year.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "Running Time",
-            "Rotten Tomatoes Rating",
-            "IMDB Rating",
-            "Worldwide Gross",
-            "Production Budget",
-            "Release Year",
-        ],
-        "data": {},
-    },
-    "euro.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": ["Age", "Salary", "Goals"],
-        "data": {},
-    },
-    "housing.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "Rooms",
-            "Fireplaces",
-            "Price",
-            "Satisfaction",
-            "Lot Area",
-            "Year",
-        ],
-        "data": {},
-    },
-    "colleges.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "Admission Rate",
-            "ACT Median",
-            "SAT Average",
-            "Population",
-            "Average Cost",
-            "Expenditure",
-            "Average Faculty Salary",
-            "Median Debt",
-            "Median Family Income",
-            "Median Earnings",
-        ],
-        "data": {},
-    },
-    "tutorial_dataset_movie.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "Worldwide Gross",
-            "Production Budget",
-            "Release Year",
-            "Running Time",
-            "Rotten Tomatoes Rating",
-            "IMDB Rating",
-            "Profit Ratio",
-            "Decade",
-        ],
-        "data": {},
-    },
-    "synthetic_voters_v14.csv": {
-        "attributes": [],
-        "distribution": {},
-        "numerical_attributes": [
-            "age",
-            "income",
-            "abortion_view",
-            "gun_control_view",
-            "immigration_view"
-        ],
-        "data": {},
-    },
-}
 
 
 def precompute_distributions():
-    """Precompute the distributions of each attribute of the data."""
+    """Load every dataset now instead of on first use."""
     print("**precomputing attribute distributions")
-    for filename in DATA_MAP:
-        read_data(filename)
-        dataset = DATA_MAP[filename]
-        for attr in dataset["attributes"]:
-            if attr in dataset["numerical_attributes"]:
-                # if it is numerical, make it a list of values, cast to num
-                dataset["distribution"][attr] = [
-                    bias_util.cast_to_num(dataset["data"][row_id][attr]) for row_id in dataset["data"]
-                ]
-                # Sort in ascending order
-                dataset["distribution"][attr].sort()
-            else:
-                # if it is categorical, make it a dictionary with counts instead
-                dataset["distribution"][attr] = {}
-                for row_id in dataset["data"]:
-                    # safe to cast to string
-                    val = str(dataset["data"][row_id][attr])
-                    if val not in dataset["distribution"][attr]:
-                        dataset["distribution"][attr][val] = 0
-                    dataset["distribution"][attr][val] += 1
-
-
-def read_data(filename):
-    """Read in the data file and save it."""
-    dataset = DATA_MAP[filename]
-    data = dataset["data"]
-    with open(os.path.join("data", filename), encoding="utf-8") as csvfile:
-        print(f"  reading data for {filename} ... ", end="", flush=True)
+    DATA_MAP.load_all()
+
+
+def load_dataset(path, entry):
+    """Read a data file and precompute the distributions of its attributes.
+
+    `entry` is the dataset's manifest entry, see dataset_registry. The parsed
+        columns and distributions are cached in DATASET_CACHE_DIR, see
+        dataset_cache, and the rows are read from the memory-mapped cache.
+    """
+    data, distribution = dataset_cache.load(path, entry, DATASET_CACHE_DIR, read_data)
+    dataset = {
+        "attributes": list(data.attributes),
+        # numerical attributes are sorted lists of values, categorical ones
+        #   dictionaries with counts
+        "distribution": distribution,
+        "numerical_attributes": list(entry.get("numerical_attributes", [])),
+        "data": data,
+    }
+    # quantiles and per-row quantile buckets used by attribute coverage
+    dataset["index"] = DatasetIndex(dataset, NUM_QUANTILES)
+    return dataset
+
+
+def read_data(path, entry):
+    """Read in the data file.
+
+    Returns the attributes, the row ids and the values of each attribute in
+        row order: numbers for numerical attributes where possible, strings
+        otherwise.
+    """
+    numerical_attributes = entry.get("numerical_attributes", [])
+    primary_key = entry.get("primary_key")
+    with open(path, encoding="utf-8") as csvfile:
+        print(f"  reading data for {os.path.basename(path)} ... ", end="", flush=True)
         reader = csv.DictReader(csvfile, delimiter=",", quotechar='"')
-        dataset["attributes"] = reader.fieldnames
-        
-        # Determine the primary key field name
-        if "voter_id" in reader.fieldnames:
-            primary_key = "voter_id"
-        elif "id" in reader.fieldnames:
-            primary_key = "id"
-        elif "Title" in reader.fieldnames and filename == "tutorial_dataset_movie.csv":
-            # Special case for tutorial dataset that uses Title as primary key
-            primary_key = "Title"
-        else:
-            # Use the first column as primary key if no id/voter_id column exists
-            primary_key = reader.fieldnames[0]
-        
+        attributes = reader.fieldnames
+
+        # Determine the primary key field name, unless the manifest declares it
+        if primary_key is None:
+            if "voter_id" in reader.fieldnames:
+                primary_key = "voter_id"
+            elif "id" in reader.fieldnames:
+                primary_key = "id"
+            else:
+                # Use the first column as primary key if no id/voter_id column exists
+                primary_key = reader.fieldnames[0]
+
+        row_index = {}
+        values = {attr: [] for attr in attributes}
         for row in reader:
-            data[row[primary_key]] = {}  # store data in data dict
-            for attr in row:
-                if attr in dataset["numerical_attributes"]:
-                    data[row[primary_key]][attr] = bias_util.cast_to_num(row[attr])
+            i = row_index.get(row[primary_key])
+            if i is None:
+                i = row_index[row[primary_key]] = len(row_index)
+                for attr in attributes:
+                    values[attr].append(None)
+            # a repeated id keeps its first position and its last values
+            for attr in attributes:
+                if attr in numerical_attributes:
+                    values[attr][i] = bias_util.cast_to_num(row[attr])
                 else:
-                    data[row[primary_key]][attr] = str(row[attr])
+                    values[attr][i] = str(row[attr])
         print(f"done")
+    return attributes, list(row_index), values
+
+
+# Parsed datasets are cached here, keyed by the hash of the file; empty to
+#   parse the files on every start
+DATASET_CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", os.path.join("data", ".cache"))
+if DATASET_CACHE_DIR:
+    # absolute, the working directory may change after startup
+    DATASET_CACHE_DIR = os.path.abspath(DATASET_CACHE_DIR)
+
+# Datasets declared in data/datasets.json (see DATASET_MANIFEST), each loaded
+#   by load_dataset when first used
+DATA_MAP = dataset_registry.from_env(load_dataset)
 
 
 def compute_metrics(filename, logs):
@@ -210,13 +118,16 @@ def compute_metrics(filename, logs):
     # Calculate the metrics one by one
     dpc = data_point_coverage(logs, dataset["data"])
     dpd = data_point_distribution(logs, dataset["data"])
-    ac = attribute_coverage(logs, dataset["data"], dataset["attributes"], dataset["distribution"])
+    ac = attribute_coverage(
+        logs, dataset["data"], dataset["attributes"], dataset["distribution"], dataset.get("index")
+    )
     ad = attribute_distribution(
         logs,
         dataset["data"],
         dataset["attributes"],
         dataset["distribution"],
         dataset["numerical_attributes"],
+        dataset.get("index"),
     )
 
     # Prepare the payload and round metrics to 4 decimal places
@@ -317,13 +228,13 @@ def data_point_distribution(logs, active_data):
                 log_counter += 1
                 dpd_details["counts"][log["data"]["id"]] += 1
 
-    # construct an array of expected values and an array of observed values
+    # expected count per data point, the same for all of them
     expected = 1.0 * log_counter / len(active_data)
-    exp_arr = [expected for _ in range(len(active_data))]
-    obs_arr = [dpd_details["counts"][item] for item in active_data]
 
-    # compute chi square result and dpd metric
-    chi_squared_result = chisquare(obs_arr, f_exp=exp_arr)
+    # compute chi square result and dpd metric, only data points that were
+    #   interacted with need their count compared with the expected one
+    visited_counts = [count for count in dpd_details["counts"].values() if count]
+    chi_squared_result = bias_util.uniform_chisquare(visited_counts, len(active_data), log_counter)
     if len(logs) < MIN_LOG_NUM:
         dpd_metric = 0
     else:
@@ -343,9 +254,12 @@ def data_point_distribution(logs, active_data):
     return dpd_metric, dpd_details
 
 
-def attribute_coverage(logs, active_data, active_attrs, active_attr_distr):
+def attribute_coverage(logs, active_data, active_attrs, active_attr_distr, active_index=None):
     """Compute the attribute coverage metric for each attribute.
 
+    If the dataset's precomputed DatasetIndex is given, quantiles and the
+        quantile of each data point are looked up instead of recomputed.
+
     Returns a tuple of
         (1) dictionary mapping attribute name to [0, 1] metric value, and
         (2) dictionary mapping attribute name to the quantized coverage of the
@@ -362,7 +276,10 @@ def attribute_coverage(logs, active_data, active_attrs, active_attr_distr):
         ac_details[attr] = {}
 
         # get attribute distribution and quantization
-        quantiles = bias_util.get_quantization(active_attr_distr[attr], NUM_QUANTILES)
+        if active_index is not None:
+            quantiles = active_index.quantiles[attr]
+        else:
+            quantiles = bias_util.get_quantization(active_attr_distr[attr], NUM_QUANTILES)
         ac_details[attr]["quantiles"] = quantiles
 
         # calculate coverage
@@ -398,14 +315,21 @@ def attribute_coverage(logs, active_data, active_attrs, active_attr_distr):
                         except statistics.StatisticsError:
                             # just take the first element on the list then
                             val = val_list[0]
-                    which_quantile = bias_util.which_quantile(quantiles, val)
+                    if active_index is not None:
+                        which_quantile = active_index.which_quantile(attr, val)
+                    else:
+                        which_quantile = bias_util.which_quantile(quantiles, val)
                     ac_details[attr]["coverage"][which_quantile] = 1
 
                 else:
                     log_counter += 1
                     pid = log["data"]["id"]
-                    dp = active_data[pid]
-                    which_quantile = bias_util.which_quantile(quantiles, dp[attr])
+                    if active_index is not None:
+                        row = active_index.row_index[pid]
+                        which_quantile = quantiles[active_index.buckets[attr][row]]
+                    else:
+                        dp = active_data[pid]
+                        which_quantile = bias_util.which_quantile(quantiles, dp[attr])
                     ac_details[attr]["coverage"][which_quantile] = 1
 
         # calculate ac metric
@@ -436,7 +360,9 @@ def attribute_coverage(logs, active_data, active_attrs, active_attr_distr):
     return ac_metric, ac_details
 
 
-def attribute_distribution(logs, active_data, active_attrs, active_attr_distr, active_numerical_attrs):
+def attribute_distribution(
+    logs, active_data, active_attrs, active_attr_distr, active_numerical_attrs, active_index=None
+):
     """Compute the attribute distribution metric for each attribute.
 
     Returns a tuple of
@@ -446,9 +372,13 @@ def attribute_distribution(logs, active_data, active_attrs, active_attr_distr, a
 
     Metric value set to 0 if # of logs < min_log_num to avoid volatility in
         initial bias values when few logs are present.
+
+    With the dataset's DatasetIndex, the k-s test uses its precomputed
+        baseline CDFs instead of sorting the baseline on every call.
     """
     ad_metric = {}
     ad_details = {}
+    ks_rows = None  # row index of every interacted data point, in order
 
     # calculate ad for EACH attribute
     for attr in active_attrs:
@@ -484,7 +414,12 @@ def attribute_distribution(logs, active_data, active_attrs, active_attr_distr, a
                         user_weights.append(1.0)
 
             # calculate ad metric
-            ks_stat = bias_util.ks_w2(a_distr, user_distr, baseline_weights, user_weights)
+            if active_index is not None:
+                if ks_rows is None:
+                    ks_rows = active_index.rows([pid for log in logs for pid in _ids(log)])
+                ks_stat = active_index.ks.statistic(attr, ks_rows, user_weights)
+            else:
+                ks_stat = bias_util.ks_w2(a_distr, user_distr, baseline_weights, user_weights)
             if len(logs) < MIN_LOG_NUM:
                 ad_metric[attr] = 0
             else:
@@ -558,3 +493,12 @@ def attribute_distribution(logs, active_data, active_attrs, active_attr_distr, a
                 ad_details[attr]["p_value"] = chi_squared_result[1]
 
     return ad_metric, ad_details
+
+
+def _ids(log):
+    """Get the data point ids of a log, in order."""
+    if "data" in log and "id" in log["data"]:
+        if isinstance(log["data"]["id"], list):
+            return log["data"]["id"]
+        return [log["data"]["id"]]
+    return []
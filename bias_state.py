@@ -0,0 +1,1026 @@
+"""Incremental bias metric state.
+"""
+import math
+import statistics
+import sys
+import time
+from array import array
+from collections import deque
+
+import numpy as np
+from scipy.stats import chisquare
+
+import bias
+import bias_util
+
+# How much of the metric details is included in a metrics() payload:
+#   "summary" -- metric values and scalar details only
+#   "deltas"  -- summary plus the entries that changed since the last payload
+#   "full"    -- every detail, including per data point / sample lists
+DETAIL_LEVELS = ["summary", "deltas", "full"]
+
+# Windows an interaction can limit its session's metrics to, with its
+#   "metricsWindow" field ({kind: size}, see parse_window):
+#   "interactions"    -- the last `size` interactions
+#   "seconds"         -- the interactions of the last `size` seconds
+#   "halfLife"        -- every interaction, weighted by how recent it is, with
+#                        the weight halving every `size` interactions
+#   "halfLifeSeconds" -- the same, halving every `size` seconds
+WINDOW_KINDS = ["interactions", "seconds", "halfLife", "halfLifeSeconds"]
+
+# Interactions of a decayed state weighted below this are folded out
+DECAY_CUTOFF = 1e-4
+# Weights of a decayed state are rescaled once they grew by this factor
+DECAY_MAX_GROWTH = 2.0**32
+
+# Fields of a MetricState its snapshots share, which updates never modify
+SHARED_FIELDS = ("dataset", "index", "quantiles")
+
+# Fields of an interaction log kept by compact_log, besides "data"
+COMPACT_LOG_FIELDS = ["interactionType", "interactionAt", "agg", "metricsWindow", "detailLevel"]
+
+# Interaction types folded into the metrics, the others are only logged
+COMPUTE_BIAS_FOR_TYPES = [
+    "mouseout_item",
+    "mouseout_group",
+    "click_group",
+    "click_add_item",
+    "click_remove_item",
+    "mouseover_item",  # Added for hover interactions
+]
+
+
+class LogRecord:
+    """Compact form of an interaction log, holding only what
+    MetricState.update reads from it.
+
+    `rows` is the row index of the data point, or an array("i") of the row
+        indices of an aggregate's data points, None without a data point id.
+        For aggregates, `x_name` / `y_name` are the attributes of the axes
+        whose values the payload lists, and `x_value` / `y_value` the values
+        representing the aggregate on them (see MetricState._representative).
+        Row indices refer to the dataset version of the state the record was
+        made by. `at` is the time of the interaction in seconds, from its
+        "interactionAt" field, None without one.
+    """
+
+    __slots__ = ("agg", "rows", "at", "x_name", "x_value", "y_name", "y_value")
+
+    def __init__(self, agg, rows, at=None, x_name=None, x_value=None, y_name=None, y_value=None):
+        self.agg = agg
+        self.rows = rows
+        self.at = at
+        self.x_name = x_name
+        self.x_value = x_value
+        self.y_name = y_name
+        self.y_value = y_value
+
+
+class MetricState:
+    """Running state of Wall et al.'s metrics for a single participant session.
+
+    Each interaction log is folded in once by update(), so computing the
+        metrics after every interaction no longer replays the whole session.
+    With the "full" detail level, metrics() returns exactly what
+        bias.compute_metrics returns for the same list of logs.
+
+    This state covers the whole session; see metric_state() for the states
+        limited to a window of recent interactions.
+    """
+
+    # see WINDOW_KINDS, None for the whole session
+    window = None
+
+    def __init__(self, filename, dataset=None):
+        if dataset is None:
+            dataset = bias.DATA_MAP[filename]
+        self.filename = filename
+        self.dataset = dataset
+        self.index = dataset["index"]
+        # the dataset file may be reloaded while the session goes on, which
+        #   keeps scoring against the version it started with
+        self.version = dataset["version"]
+
+        # detail level of metrics() payloads, and the number of samples the
+        #   receiver already has, which "deltas" payloads are relative to
+        self.detail_level = "full"
+        self.sent_cursor = 0
+
+        # number of logs seen (all logs / logs without the "agg" key)
+        self.num_logs = 0
+        self.num_non_agg_logs = 0
+
+        # data point coverage
+        self.visited = set()
+        self.dpc_counter = 0
+
+        # data point distribution (fractional counter also used by the
+        #   categorical attribute distribution), counts of the visited rows
+        self.frac_counter = 0
+        self.counts = {}
+
+        # attribute coverage
+        self.ac_counter = 0
+        self.quantiles = {}
+        self.coverage = {}
+        for attr in dataset["attributes"]:
+            quantiles = self.index.quantiles[attr]
+            self.quantiles[attr] = quantiles
+            self.coverage[attr] = {}
+            for q in quantiles:
+                self.coverage[attr][q] = 0
+        # (sample cursor, attribute, quantile) of each newly covered quantile
+        self.coverage_added = []
+
+        # attribute distribution -- numerical attributes keep the row and
+        #   weight of every interacted data point, their values are gathered
+        #   from the dataset columns when the payload needs them; the k-s test
+        #   runs on a histogram of the weights over the sorted baseline values
+        self.numerical_attrs = []
+        self.sample_rows = array("q")
+        self.sample_weights = array("d")
+        self.ks_sample = self.index.ks.empty_sample()
+        # categorical attributes keep fractional counts per category code
+        #   (in the order of the baseline distribution); which samples come
+        #   from single data point interactions is flagged separately
+        self.category_counts = {}
+        self.sample_single = array("b")
+        for attr in dataset["attributes"]:
+            if attr in dataset["numerical_attributes"]:
+                self.numerical_attrs.append(attr)
+            else:
+                self.category_counts[attr] = np.zeros(len(self.index.categories[attr]))
+
+    def __getstate__(self):
+        # the dataset is shared, only its filename and version are pickled;
+        #   the registry keeps the versions superseded by a reload
+        state = self.__dict__.copy()
+        del state["dataset"]
+        del state["index"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.dataset = bias.DATA_MAP.get_version(self.filename, self.version)
+        self.index = self.dataset["index"]
+
+    def snapshot(self):
+        """Get a copy of the state that later updates leave alone, e.g. to
+        compute its metrics on another thread.
+
+        The dataset is shared, and so is whatever the updates never modify;
+            the rest is copied, which costs much less than pickling it.
+        """
+        state = object.__new__(type(self))
+        memo = {}
+        for name, value in self.__dict__.items():
+            state.__dict__[name] = value if name in SHARED_FIELDS else _copy(value, memo)
+        return state
+
+    def update(self, log):
+        """Fold a single interaction log, or a LogRecord made from one by
+        this state, into the metric state.
+
+        Returns the LogRecord of the log, which is all a session needs to
+            keep of it. A log that cannot be scored (e.g. an unknown data point
+            id) raises before any of the state is modified.
+        """
+        record = log if isinstance(log, LogRecord) else self.record(log)
+        is_agg_log = record.agg
+        has_id = record.rows is not None
+        is_aggregate = has_id and isinstance(record.rows, array)
+
+        index = self.index
+        if is_aggregate:
+            # shared by every interaction with the same group of data points
+            group = index.group(record.rows)
+            rows = group.rows
+            agg_size = len(rows)
+            # resolve every attribute's quantile before touching the state
+            which_quantiles = {}
+            for attr in self.coverage:
+                which_quantiles[attr] = self._aggregate_quantile(record, attr, group)
+        elif has_id:
+            row = record.rows
+            row_quantiles = index.row_quantiles(row)
+
+        self.num_logs += 1
+        if not is_agg_log:
+            self.num_non_agg_logs += 1
+
+        if not has_id:
+            return record
+
+        cursor = len(self.sample_rows)
+        if is_aggregate:
+            if not is_agg_log:
+                self.dpc_counter += agg_size
+                row_ids = index.row_ids
+                self.visited.update(row_ids[row] for row in rows.tolist())
+
+            for _ in range(agg_size):
+                self.frac_counter += 1.0 / agg_size
+            counts = self.counts
+            for row in rows.tolist():
+                counts[row] = counts.get(row, 0) + 1.0 / agg_size
+
+            self.ac_counter += 1
+            for attr in which_quantiles:
+                self._cover(cursor, attr, which_quantiles[attr])
+
+            self.sample_rows.extend(rows.tolist())
+            self.sample_weights.extend([1.0 / agg_size] * agg_size)
+            self.sample_single.extend([0] * agg_size)
+            for attr in self.category_counts:
+                self.category_counts[attr] += group.histogram(attr) * (1.0 / agg_size)
+            index.ks.add_histogram(self.ks_sample, group.ks_histogram(), 1.0 / agg_size)
+
+        else:
+            if not is_agg_log:
+                self.dpc_counter += 1
+                self.visited.add(index.row_ids[row])
+
+            self.frac_counter += 1
+            self.counts[row] = self.counts.get(row, 0) + 1
+
+            self.ac_counter += 1
+            for attr, which_quantile in row_quantiles:
+                self._cover(cursor, attr, which_quantile)
+
+            self.sample_rows.append(row)
+            self.sample_weights.append(1.0)
+            self.sample_single.append(1)
+            for attr in self.category_counts:
+                self.category_counts[attr][index.codes[attr][row]] += 1
+            index.ks.add(self.ks_sample, row, 1.0)
+        return record
+
+    def record(self, log):
+        """Make the LogRecord of an interaction log.
+
+        Raises if the log cannot be scored, like update().
+        """
+        is_agg_log = "agg" in log
+        at = log.get("interactionAt")
+        at = at / 1000 if isinstance(at, (int, float)) and not isinstance(at, bool) else None
+        if "data" not in log or "id" not in log["data"]:
+            return LogRecord(is_agg_log, None, at)
+        ids = log["data"]["id"]
+        if not isinstance(ids, list):
+            return LogRecord(is_agg_log, self.index.row_index[ids], at)
+
+        rows = array("i", self.index.rows(ids).tolist())
+        # only the representative value of each axis is kept, the first one
+        #   wins if both are on the same attribute
+        x_name = sys.intern(log["data"]["x"]["name"])
+        y_name = sys.intern(log["data"]["y"]["name"])
+        record = LogRecord(is_agg_log, rows, at)
+        if x_name in self.coverage:
+            record.x_name = x_name
+            record.x_value = self._representative(x_name, log["data"]["x"]["value"])
+        if y_name in self.coverage and y_name != x_name:
+            record.y_name = y_name
+            record.y_value = self._representative(y_name, log["data"]["y"]["value"])
+        return record
+
+    def _cover(self, cursor, attr, which_quantile):
+        coverage = self.coverage[attr]
+        if coverage.get(which_quantile) != 1:
+            coverage[which_quantile] = 1
+            self.coverage_added.append((cursor, attr, which_quantile))
+
+    def _aggregate_quantile(self, record, attr, group):
+        """Get the quantile of an aggregate interaction for the attribute."""
+        # for actively visualized x- and y- attribute axes, we already have
+        #   the value from the list of values in the log
+        if record.x_name == attr:
+            return self.index.which_quantile(attr, record.x_value)
+        if record.y_name == attr:
+            return self.index.which_quantile(attr, record.y_value)
+        # otherwise the value representing the group's data points
+        return group.quantile(attr)
+
+    def _record_quantiles(self, record):
+        """Get the (attribute, quantile) pairs a record covers."""
+        if record.rows is None:
+            return []
+        if isinstance(record.rows, array):
+            group = self.index.group(record.rows)
+            return [(attr, self._aggregate_quantile(record, attr, group)) for attr in self.coverage]
+        return self.index.row_quantiles(record.rows)
+
+    def with_window(self, window, records):
+        """Get a state of the same dataset version limited to another window
+        (see parse_window), with the session's records (oldest first) that
+        fall into it folded in.
+        """
+        state = metric_state(self.filename, window, self.dataset)
+        state.detail_level = self.detail_level
+        for record in state.tail(records):
+            state.update(record)
+        return state
+
+    def tail(self, records):
+        """Get the records of a session (oldest first) this state covers."""
+        return records
+
+    def trim(self, records):
+        """Drop the records this state no longer covers from the front of a
+        session's list of them (oldest first), after an update().
+
+        The records are kept for with_window(), which can then only go back
+            as far as they do. A state over the whole session keeps them all.
+        """
+
+    def _samples(self):
+        """Get the rows, weights and single data point flags of the samples,
+        as NumPy views only valid until the next update().
+        """
+        return (
+            np.frombuffer(self.sample_rows, dtype=np.int64),
+            np.frombuffer(self.sample_weights, dtype=np.float64),
+            np.frombuffer(self.sample_single, dtype=np.int8),
+        )
+
+    def _visited_count(self):
+        return len(self.visited)
+
+    def _representative(self, attr, val_list):
+        """Get the value representing a list of values of the attribute."""
+        if attr in self.dataset["numerical_attributes"]:
+            # take the median value
+            return statistics.median(val_list)
+        try:
+            # use the most common categorical value
+            return statistics.mode(val_list)
+        # thrown in the event of all equal values (and no unique mode)
+        except statistics.StatisticsError:
+            # just take the first element on the list then
+            return val_list[0]
+
+    def metrics(self, detail_level=None, timings=None):
+        """Compute all of the bias metrics from the current state.
+
+        Return results in a dictionary mapping metric name to result. The
+            detail level (see DETAIL_LEVELS) defaults to self.detail_level.
+        With "deltas", every details dict carries "delta_since" and
+            "delta_until" sample cursors; entries ending in "_added" hold the
+            samples in that range (in order), entries ending in "_changed" the
+            current value of everything that changed in it. States limited to a
+            window do not keep what changed; their "deltas" payloads are
+            summaries.
+        If a `timings` dict is given, the seconds spent on each metric are
+            stored in it by metric name.
+        """
+        level = detail_level or self.detail_level
+        if level not in DETAIL_LEVELS:
+            raise ValueError(f"Unknown detail level: {level}")
+        delta = None
+        if level == "deltas" and self.window is None:
+            delta = _Delta(self, self.sent_cursor)
+        metrics = {}
+        for name, metric in (
+            ("data_point_coverage", self.data_point_coverage),
+            ("data_point_distribution", self.data_point_distribution),
+            ("attribute_coverage", self.attribute_coverage),
+            ("attribute_distribution", self.attribute_distribution),
+        ):
+            start = time.perf_counter()
+            metrics[name] = metric(level, delta)
+            if timings is not None:
+                timings[name] = time.perf_counter() - start
+        return metrics
+
+    def mark_sent(self, metrics):
+        """Record that a metrics() payload reached the participant, so the
+        next "deltas" payload only carries what changed after it.
+        """
+        dpd_details = metrics["data_point_distribution"][1]
+        if "delta_until" in dpd_details:
+            self.sent_cursor = dpd_details["delta_until"]
+
+    def data_point_coverage(self, level="full", delta=None):
+        """Compute the data point coverage metric, see bias.data_point_coverage."""
+        active_data = self.dataset["data"]
+        expected = bias_util.get_markov_expected_value(len(active_data), self.dpc_counter)
+        covered = self._visited_count()
+        percent_unique = covered / expected
+        if self.num_non_agg_logs < bias.MIN_LOG_NUM:
+            dpc_metric = 0
+        else:
+            dpc_metric = float(f"{1.0 - min(1, percent_unique):.4f}")
+
+        dpc_details = {}
+        dpc_details["N(dataset_size)"] = len(active_data)
+        dpc_details["total_num_logs"] = self.num_non_agg_logs
+        dpc_details["k(num_dp_logs)"] = self.dpc_counter
+        dpc_details["covered"] = covered
+        if level == "full":
+            dpc_details["visited"] = sorted(list(self.visited))
+        dpc_details["expected_unique"] = expected
+        dpc_details["percent_unique"] = percent_unique
+        if delta is not None:
+            delta.add_cursors(dpc_details)
+            dpc_details["visited_changed"] = sorted(pid for pid in delta.changed_ids() if pid in self.visited)
+
+        return dpc_metric, dpc_details
+
+    def data_point_distribution(self, level="full", delta=None):
+        """Compute the data point distribution metric, see bias.data_point_distribution."""
+        active_data = self.dataset["data"]
+        dpd_details = {}
+        if level == "full":
+            counts = dict.fromkeys(self.index.row_ids, 0)
+            row_ids = self.index.row_ids
+            for row, count in self.counts.items():
+                counts[row_ids[row]] = count
+            dpd_details["counts"] = counts
+
+        log_counter = self.frac_counter
+        expected = 1.0 * log_counter / len(active_data)
+
+        # only visited rows are counted, unvisited ones add `expected` each
+        chi_squared_result = bias_util.uniform_chisquare(
+            list(self.counts.values()), len(active_data), log_counter
+        )
+        if self.num_logs < bias.MIN_LOG_NUM:
+            dpd_metric = 0
+        else:
+            dpd_metric = float(f"{1 - chi_squared_result[1]:.4f}")
+
+        dpd_details["total_num_logs"] = self.num_logs
+        dpd_details["k(num_dp_logs)"] = log_counter
+        dpd_details["expected_per_dp"] = expected
+        dpd_details["degrees_of_freedom"] = len(active_data) - 1
+        dpd_details["chi_squared"] = chi_squared_result[0]
+        if str(chi_squared_result[1]) == "nan":
+            dpd_details["p_value"] = None
+        else:
+            dpd_details["p_value"] = chi_squared_result[1]
+        if delta is not None:
+            delta.add_cursors(dpd_details)
+            changed_counts = [self.counts[row] for row in delta.changed_rows().tolist()]
+            dpd_details["counts_changed"] = dict(zip(delta.changed_ids(), changed_counts))
+
+        return dpd_metric, dpd_details
+
+    def attribute_coverage(self, level="full", delta=None):
+        """Compute the attribute coverage metric, see bias.attribute_coverage."""
+        ac_metric = {}
+        ac_details = {}
+
+        for attr in self.dataset["attributes"]:
+            quantiles = self.quantiles[attr]
+            ac_details[attr] = {}
+            if level == "full":
+                ac_details[attr]["quantiles"] = quantiles
+                ac_details[attr]["coverage"] = dict(self.coverage[attr])
+
+            # 1 for a covered quantile, its weight in a decayed state
+            covered = 0
+            for q in quantiles:
+                covered += self.coverage[attr][q]
+            expected = bias_util.get_markov_expected_value(len(quantiles), self.ac_counter)
+            if expected == 0:  # prevent divide by 0 error
+                percent_unique = 1
+            else:
+                percent_unique = covered / expected
+            if self.num_logs < bias.MIN_LOG_NUM:
+                ac_metric[attr] = 0
+            else:
+                ac_metric[attr] = float(f"{1.0 - min(1, percent_unique):.4f}")
+
+            ac_details[attr]["N(num_quantiles)"] = len(quantiles)
+            ac_details[attr]["total_num_logs"] = self.num_logs
+            ac_details[attr]["k(num_dp_logs)"] = self.ac_counter
+            ac_details[attr]["expected_unique"] = expected
+            ac_details[attr]["covered"] = covered
+            ac_details[attr]["percent_unique"] = percent_unique
+            if delta is not None:
+                delta.add_cursors(ac_details[attr])
+                ac_details[attr]["coverage_added"] = delta.coverage_added(attr)
+
+        return ac_metric, ac_details
+
+    def attribute_distribution(self, level="full", delta=None):
+        """Compute the attribute distribution metric, see bias.attribute_distribution."""
+        ad_metric = {}
+        ad_details = {}
+        active_data = self.dataset["data"]
+        sample_rows, sample_weights, sample_single = self._samples()
+        if level == "full":
+            user_weights = sample_weights.tolist()
+            single_rows = sample_rows[sample_single.astype(bool)]
+        if delta is not None:
+            new_weights = sample_weights[delta.since :].tolist()
+            new_single_rows = delta.single_rows()
+            changed_rows = delta.changed_rows()
+        # k-s statistics of all numerical attributes at once
+        ks_stats = self.index.ks.statistics(self.ks_sample).tolist()
+
+        for attr in self.dataset["attributes"]:
+            a_distr = self.dataset["distribution"][attr]
+            ad_details[attr] = {}
+            if level == "full":
+                ad_details[attr]["baseline_distr"] = a_distr
+            ad_details[attr]["total_num_logs"] = self.num_logs
+            if delta is not None:
+                delta.add_cursors(ad_details[attr])
+
+            if attr in self.numerical_attrs:
+                # numerical attribute -- k-s test
+                ks_stat = ks_stats[self.index.ks.position[attr]]
+                if self.num_logs < bias.MIN_LOG_NUM:
+                    ad_metric[attr] = 0
+                else:
+                    ad_metric[attr] = float(f"{ks_stat:.4f}")
+
+                if level == "full":
+                    ad_details[attr]["interaction_distr"] = self.index.columns[attr][sample_rows].tolist()
+                    ad_details[attr]["baseline_weights"] = [1.0] * len(a_distr)
+                    ad_details[attr]["user_distr_weights"] = user_weights
+                if delta is not None:
+                    ad_details[attr]["interaction_distr_added"] = self.index.columns[attr][
+                        sample_rows[delta.since :]
+                    ].tolist()
+                    ad_details[attr]["user_distr_weights_added"] = new_weights
+                ad_details[attr]["ks_stat"] = ks_stat
+                ad_details[attr]["p_value"] = "TODO"  # TODO
+
+            else:
+                # categorical attribute -- chi-square test
+                log_counter = self.frac_counter
+                # category codes follow the key order of the baseline distribution
+                categories = self.index.categories[attr]
+                obs_arr = self.category_counts[attr]
+                exp_arr = np.fromiter(a_distr.values(), dtype=np.float64, count=len(a_distr))
+                exp_arr = exp_arr / len(active_data) * log_counter
+
+                chi_squared_result = chisquare(obs_arr, f_exp=exp_arr)
+                if self.num_logs < bias.MIN_LOG_NUM:
+                    ad_metric[attr] = 0
+                else:
+                    ad_metric[attr] = float(f"{1 - chi_squared_result[1]:.4f}")
+
+                if level == "full":
+                    user_distr = {}
+                    counts = obs_arr.tolist()
+                    for code in np.flatnonzero(obs_arr).tolist():
+                        user_distr[categories[code]] = counts[code]
+                    user_distr_flat = self.index.values(attr, single_rows)
+                    try:
+                        user_distr_flat = sorted([float(i) for i in user_distr_flat])
+                    except Exception as e:
+                        user_distr_flat = sorted([str(i) for i in user_distr_flat])
+                    ad_details[attr]["interaction_distr"] = user_distr_flat
+                    ad_details[attr]["interaction_distr_dict"] = user_distr
+                if delta is not None:
+                    ad_details[attr]["interaction_distr_added"] = self.index.values(attr, new_single_rows)
+                    changed_codes = np.unique(self.index.codes[attr][changed_rows]).tolist()
+                    ad_details[attr]["interaction_distr_dict_changed"] = {
+                        categories[code]: obs_arr[code].item() for code in changed_codes
+                    }
+                ad_details[attr]["k(num_dp_logs)"] = log_counter
+                ad_details[attr]["chi_squared"] = chi_squared_result[0]
+                if str(chi_squared_result[1]) == "nan":
+                    ad_details[attr]["p_value"] = None
+                else:
+                    ad_details[attr]["p_value"] = chi_squared_result[1]
+
+        return ad_metric, ad_details
+
+
+class _Delta:
+    """What changed in a MetricState after the sample cursor `since`."""
+
+    def __init__(self, state, since):
+        self.state = state
+        # a cursor past the end belongs to an earlier state, start over
+        self.since = since if since <= len(state.sample_rows) else 0
+        self.until = len(state.sample_rows)
+        self._changed_rows = None
+
+    def add_cursors(self, details):
+        details["delta_since"] = self.since
+        details["delta_until"] = self.until
+
+    def changed_rows(self):
+        """Rows of the data points interacted with after the cursor, sorted."""
+        if self._changed_rows is None:
+            rows = np.frombuffer(self.state.sample_rows, dtype=np.int64)[self.since : self.until]
+            self._changed_rows = np.unique(rows)
+        return self._changed_rows
+
+    def changed_ids(self):
+        row_ids = self.state.index.row_ids
+        return [row_ids[row] for row in self.changed_rows().tolist()]
+
+    def single_rows(self):
+        """Rows of single data point interactions after the cursor, in order."""
+        rows = np.frombuffer(self.state.sample_rows, dtype=np.int64)[self.since : self.until]
+        single = np.frombuffer(self.state.sample_single, dtype=np.int8)[self.since : self.until]
+        return rows[single.astype(bool)]
+
+    def coverage_added(self, attr):
+        return [q for cursor, a, q in self.state.coverage_added if a == attr and cursor >= self.since]
+
+
+class _RecentMetricState(MetricState):
+    """Metric state over the recent interactions of a session, which folds
+    interactions out again once they are too old to count.
+
+    What an interaction added is subtracted again when it is folded out; the
+        counts no interaction is left on (data point, category and k-s grid
+        point counts alike) are dropped or reset to exactly 0, so folding out
+        leaves no rounding residue behind.
+    """
+
+    def __init__(self, filename, window, dataset=None):
+        super().__init__(filename, dataset)
+        self.window = window
+        # (record, time) of the interactions folded in, oldest first
+        self.entries = deque()
+        # the samples before this one were folded out
+        self.sample_start = 0
+        # data point id -> number of interactions folded in on it
+        self.visited_refs = {}
+        # row -> number of interactions folded in on it, for self.counts
+        self.count_refs = {}
+        # attribute -> quantile -> number of interactions folded in on it
+        self.coverage_refs = {attr: dict.fromkeys(coverage, 0) for attr, coverage in self.coverage.items()}
+        # number of data points folded in on each category code and k-s grid
+        #   point, exact as long as there are fewer than 2^53 of them
+        self.category_refs = {attr: np.zeros(len(counts)) for attr, counts in self.category_counts.items()}
+        self.ks_refs = self.index.ks.empty_sample()
+
+    def _fold(self, record, quantiles, sign, scale=1):
+        """Add (sign 1) or remove (sign -1) what a record contributes, its
+        weights multiplied by `scale`.
+        """
+        self.num_logs += sign
+        if not record.agg:
+            self.num_non_agg_logs += sign
+        if record.rows is None:
+            return
+
+        index = self.index
+        if isinstance(record.rows, array):
+            group = index.group(record.rows)
+            rows = group.rows.tolist()
+            weight = scale / len(rows)
+        else:
+            group = None
+            rows = [record.rows]
+            weight = scale
+        if not record.agg:
+            self.dpc_counter += sign * scale * len(rows)
+            for row in rows:
+                self._visit(index.row_ids[row], sign, scale)
+        self.frac_counter += sign * weight * len(rows)
+        for row in rows:
+            if _refer(self.count_refs, row, sign):
+                self.counts[row] = self.counts.get(row, 0) + sign * weight
+            else:
+                del self.counts[row]
+
+        self.ac_counter += sign * scale
+        for attr, which_quantile in quantiles:
+            refs = self.coverage_refs[attr]
+            refs[which_quantile] += sign
+            if sign > 0:
+                self.coverage[attr][which_quantile] = scale
+            elif not refs[which_quantile]:
+                self.coverage[attr][which_quantile] = 0
+
+        if sign > 0:
+            self.sample_rows.extend(rows)
+            self.sample_weights.extend([weight] * len(rows))
+            self.sample_single.extend([int(group is None)] * len(rows))
+        else:
+            self.sample_start += len(rows)
+        if group is not None:
+            for attr, counts in self.category_counts.items():
+                histogram = group.histogram(attr)
+                counts += histogram * (sign * weight)
+                self.category_refs[attr] += histogram * sign
+            ks_histogram = group.ks_histogram()
+            index.ks.add_histogram(self.ks_sample, ks_histogram, sign * weight)
+            index.ks.add_histogram(self.ks_refs, ks_histogram, sign)
+        else:
+            for attr, counts in self.category_counts.items():
+                code = index.codes[attr][rows[0]]
+                counts[code] += sign * weight
+                self.category_refs[attr][code] += sign
+            index.ks.add(self.ks_sample, rows[0], sign * weight)
+            index.ks.add(self.ks_refs, rows[0], float(sign))
+        if sign < 0:
+            for attr, counts in self.category_counts.items():
+                counts[self.category_refs[attr] == 0] = 0.0
+            self.ks_sample[self.ks_refs == 0] = 0.0
+
+    def _visit(self, row_id, sign, scale):
+        _refer(self.visited_refs, row_id, sign)
+
+    def _drop_samples(self):
+        """Drop the samples folded out, amortized over the updates."""
+        if self.sample_start > 1024 and 2 * self.sample_start > len(self.sample_rows):
+            for samples in (self.sample_rows, self.sample_weights, self.sample_single):
+                del samples[: self.sample_start]
+            self.sample_start = 0
+
+    def _samples(self):
+        rows, weights, single = super()._samples()
+        return rows[self.sample_start :], weights[self.sample_start :], single[self.sample_start :]
+
+
+class WindowedMetricState(_RecentMetricState):
+    """Metric state over the last interactions of a session only: the last N
+    of them (window ("interactions", N)) or those of the last T seconds
+    (("seconds", T), by their "interactionAt" time).
+
+    Interactions leaving the window are folded out again, so an update costs
+        the same however long the session goes on, and the state holds no
+        more than the window. A data point is visited, and a quantile
+        covered, while an interaction in the window is on it.
+    """
+
+    def __init__(self, filename, window, dataset=None):
+        super().__init__(filename, window, dataset)
+        # the data point ids of the interactions in the window
+        self.visited = self.visited_refs
+
+    def update(self, log):
+        """Fold an interaction log, or a LogRecord made from one by this state,
+        into the window and fold out those it pushes out of the window.
+
+        Returns the LogRecord of the log. A log that cannot be scored raises
+            before any of the state is modified.
+        """
+        record = log if isinstance(log, LogRecord) else self.record(log)
+        quantiles = self._record_quantiles(record)
+        now = _time(record)
+        self._fold(record, quantiles, 1)
+        self.entries.append((record, now))
+
+        kind, size = self.window
+        entries = self.entries
+        while len(entries) > 1 and (len(entries) > size if kind == "interactions" else entries[0][1] < now - size):
+            old, _ = entries.popleft()
+            self._fold(old, self._record_quantiles(old), -1)
+        self._drop_samples()
+        return record
+
+    def tail(self, records):
+        kind, size = self.window
+        if kind == "interactions":
+            return records[-size:] if records else records
+        return _since(records, size)
+
+    def trim(self, records):
+        # the window holds the latest len(self.entries) records
+        del records[: max(len(records) - len(self.entries), 0)]
+
+
+class DecayedMetricState(_RecentMetricState):
+    """Metric state weighting the interactions of a session by how recent
+    they are: by 2^(-age / half_life), the age counted in interactions
+    (window ("halfLife", half_life)) or in seconds (("halfLifeSeconds",
+    half_life), by their "interactionAt" time).
+
+    The interaction counts, the data point counts and the sample weights of
+        the attribute distributions decay; a data point counts as visited,
+        and a quantile as covered, with the weight of the latest interaction
+        on it. Weights are kept relative to the time of the last settle(),
+        which rescales them, so an update only adds its own weights; that
+        happens when the metrics are computed or the weights grew by
+        DECAY_MAX_GROWTH. Interactions weighted below DECAY_CUTOFF are folded
+        out then, which bounds the state to the last log2(1 / DECAY_CUTOFF)
+        half-lives; the plain log counts (num_logs) count those only.
+    """
+
+    def __init__(self, filename, window, dataset=None):
+        super().__init__(filename, window, dataset)
+        self.half_life = window[1]
+        self.by_time = window[0] == "halfLifeSeconds"
+        # interactions folded in, the clock of ("halfLife", half_life)
+        self.num_updates = 0
+        # time the weights are relative to, and of the latest interaction
+        self.settled_at = None
+        self.now = None
+        # data point id -> weight of the latest interaction on it
+        self.visited = {}
+        self.visited_weight = 0.0
+
+    def update(self, log):
+        """Fold an interaction log, or a LogRecord made from one by this state,
+        into the decayed state.
+
+        Returns the LogRecord of the log. A log that cannot be scored raises
+            before any of the state is modified.
+        """
+        record = log if isinstance(log, LogRecord) else self.record(log)
+        quantiles = self._record_quantiles(record)
+        self.num_updates += 1
+        now = _time(record) if self.by_time else self.num_updates
+        if self.now is not None:
+            # clocks going backwards do not make interactions weigh more
+            now = max(now, self.now)
+        if self.settled_at is None:
+            self.settled_at = now
+        growth = 2.0 ** ((now - self.settled_at) / self.half_life)
+        if growth > DECAY_MAX_GROWTH:
+            self.settle(now)
+            growth = 1.0
+        self.now = now
+
+        self._fold(record, quantiles, 1, growth)
+        self.entries.append((record, now))
+        return record
+
+    def settle(self, now=None):
+        """Rescale the weights to the time `now` (of the latest interaction by
+        default), and fold out the interactions weighted below DECAY_CUTOFF.
+        """
+        now = self.now if now is None else now
+        if self.settled_at is None or now == self.settled_at:
+            return
+        factor = 2.0 ** (-(now - self.settled_at) / self.half_life)
+        self.settled_at = now
+        self.dpc_counter *= factor
+        self.frac_counter *= factor
+        self.ac_counter *= factor
+        self.counts = {row: count * factor for row, count in self.counts.items()}
+        self.visited = {row_id: weight * factor for row_id, weight in self.visited.items()}
+        self.visited_weight *= factor
+        for coverage in self.coverage.values():
+            for q in coverage:
+                coverage[q] *= factor
+        for counts in self.category_counts.values():
+            counts *= factor
+        self.ks_sample *= factor
+        np.frombuffer(self.sample_weights, dtype=np.float64)[self.sample_start :] *= factor
+
+        horizon = now - self._horizon()
+        while self.entries and self.entries[0][1] < horizon:
+            old, at = self.entries.popleft()
+            self._fold(old, self._record_quantiles(old), -1, 2.0 ** ((at - now) / self.half_life))
+        self._drop_samples()
+
+    def metrics(self, detail_level=None, timings=None):
+        # weights as of the latest interaction
+        self.settle()
+        return super().metrics(detail_level, timings)
+
+    def tail(self, records):
+        if not self.by_time:
+            # the interactions less than the horizon before the latest one
+            return records[-(math.floor(self._horizon()) + 1) :] if records else records
+        return _since(records, self._horizon())
+
+    def trim(self, records):
+        if not self.by_time:
+            del records[: max(len(records) - math.floor(self._horizon()) - 1, 0)]
+            return
+        if not records:
+            return
+        # from the front, so each record is looked at about once
+        since = _time(records[-1]) - self._horizon()
+        start = 0
+        while start < len(records) - 1 and _time(records[start]) < since:
+            start += 1
+        del records[:start]
+
+    def _horizon(self):
+        """Get the age at which interactions weigh DECAY_CUTOFF."""
+        return self.half_life * math.log2(1 / DECAY_CUTOFF)
+
+    def _visit(self, row_id, sign, scale):
+        if sign > 0:
+            self.visited_weight += scale - self.visited.get(row_id, 0.0)
+            self.visited[row_id] = scale
+        if not _refer(self.visited_refs, row_id, sign):
+            self.visited_weight -= self.visited.pop(row_id)
+
+    def _visited_count(self):
+        return self.visited_weight
+
+
+def parse_window(spec):
+    """Get the window of a "metricsWindow" field, {kind: size} with a kind of
+    WINDOW_KINDS, as (kind, size); None (whole session) if empty.
+
+    Raises ValueError for anything else.
+    """
+    if not spec:
+        return None
+    if isinstance(spec, dict) and len(spec) == 1:
+        ((kind, size),) = spec.items()
+        if kind in WINDOW_KINDS and isinstance(size, (int, float)) and not isinstance(size, bool) and size > 0:
+            if kind == "interactions":
+                if size != int(size):
+                    raise ValueError(f"Window of {size} interactions")
+                size = int(size)
+            return (kind, size)
+    raise ValueError(f"Unknown metrics window: {spec!r}")
+
+
+def apply_window(state, log, records):
+    """Get the state to fold an interaction log into: `state`, or if the log's
+    "metricsWindow" field asks for another window, a state limited to it with
+    the session's `records` (oldest first) that fall into it folded in.
+
+    Raises ValueError if the field is not a window, see parse_window.
+    """
+    if "metricsWindow" not in log:
+        return state
+    window = parse_window(log["metricsWindow"])
+    if window == state.window:
+        return state
+    return state.with_window(window, records)
+
+
+def metric_state(filename, window=None, dataset=None):
+    """Create the metric state of a session limited to `window` (see
+    parse_window), for the loaded version of the dataset unless `dataset` is
+    given.
+    """
+    if window is None:
+        return MetricState(filename, dataset)
+    if window[0] in ("interactions", "seconds"):
+        return WindowedMetricState(filename, window, dataset)
+    return DecayedMetricState(filename, window, dataset)
+
+
+def compact_log(log, record):
+    """Get the interaction log holding only what folding it into a session
+    reads (see LogRecord), with `record` the LogRecord made from it.
+
+    Unlike the record, it refers to data points by id, so it can be folded
+        into a state of another version of the dataset; an aggregate's axes
+        carry the representative value only.
+    """
+    compact = {key: log[key] for key in COMPACT_LOG_FIELDS if key in log}
+    if record.rows is None:
+        return compact
+    data = compact["data"] = {"id": log["data"]["id"]}
+    if isinstance(record.rows, array):
+        for axis, name, value in (("x", record.x_name, record.x_value), ("y", record.y_name, record.y_value)):
+            # the value of an attribute that is not covered, or on both axes, is not read
+            data[axis] = {"name": log["data"][axis]["name"], "value": [] if name is None else [value]}
+    return compact
+
+
+def _copy(value, memo):
+    """Copy the containers of a MetricState field, sharing the immutable
+    items in them; `memo` maps the id of each container copied to its copy,
+    so containers shared by several fields stay shared.
+    """
+    copied = memo.get(id(value))
+    if copied is not None:
+        return copied
+    if isinstance(value, dict):
+        copied = dict(value)
+        for key, item in copied.items():
+            if isinstance(item, (dict, set, list, deque, array, np.ndarray)):
+                copied[key] = _copy(item, memo)
+    elif isinstance(value, (set, list, deque)):
+        # of numbers, tuples and LogRecords, none of which change
+        copied = value.copy()
+    elif isinstance(value, array):
+        copied = value[:]
+    elif isinstance(value, np.ndarray):
+        copied = value.copy()
+    else:
+        return value
+    memo[id(value)] = copied
+    return copied
+
+
+def _refer(refs, key, sign):
+    """Count a reference to `key` in (sign 1) or out (sign -1) of `refs`,
+    dropping keys without any; returns the count left.
+    """
+    count = refs.get(key, 0) + sign
+    if count:
+        refs[key] = count
+    else:
+        del refs[key]
+    return count
+
+
+def _since(records, age):
+    """Get the records (oldest first) at most `age` seconds older than the
+    latest one.
+    """
+    start = len(records)
+    if records:
+        since = _time(records[-1]) - age
+        while start > 0 and _time(records[start - 1]) >= since:
+            start -= 1
+    return records[start:]
+
+
+def _time(record):
+    # records of interactions without a time are placed when folded in
+    at = getattr(record, "at", None)
+    return time.time() if at is None else at
@@ -3,21 +3,46 @@
 import math
 import numbers
 import numpy as np
-from decimal import Decimal
+from functools import lru_cache
 from time import strftime, localtime, time
 
+from scipy.special import chdtrc
 
+
+@lru_cache(maxsize=65536)
 def get_markov_expected_value(N, k):
-    """Get the expected value from the markov chain."""
-    try:
-        num = Decimal(N) ** k - Decimal(N - 1) ** k
-        denom = Decimal(N) ** (k - 1)
-        result = num / denom
-        return float(result)
-    except OverflowError:
-        msg = f"** Warning: overflow computing markov expected value with N = {N} and k = {k}"
-        print(msg)
-        return float(N)
+    """Get the expected value from the markov chain.
+
+    That is the expected number of distinct items after k uniform draws
+        from N items, N * (1 - (1 - 1/N)^k), evaluated with log1p/expm1 so it
+        stays accurate for large N and k and costs the same for any k.
+    """
+    if k == 0:
+        return 0.0
+    return -N * math.expm1(k * math.log1p(-1 / N))
+
+
+def uniform_chisquare(observed, num_categories, total):
+    """Chi-square test of counts against a uniform expectation.
+
+    Same result as scipy.stats.chisquare(obs, f_exp=[expected] * num_categories)
+        with expected = total / num_categories, where `observed` only holds
+        the counts of the categories that were observed at all; each of the
+        others contributes `expected` to the statistic. The cost is linear in
+        the number of observed categories.
+
+    Returns a tuple of (chi-square statistic, p-value).
+    """
+    expected = 1.0 * total / num_categories
+    observed = np.asarray(observed, dtype=np.float64)
+    if expected == 0:
+        stat = np.float64("nan")  # 0 / 0, as in scipy
+    else:
+        stat = np.sum((observed - expected) ** 2 / expected) + (num_categories - len(observed)) * expected
+    if num_categories < 2:
+        return stat, np.float64("nan")  # no degrees of freedom
+    # chi-square survival function, what scipy.stats.chi2.sf evaluates
+    return stat, chdtrc(num_categories - 1, stat)
 
 
 def get_quantization(distr, num_quantiles):
@@ -0,0 +1,204 @@
+"""On-disk cache of parsed datasets, memory-mapped from NumPy files.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections.abc import Mapping
+
+import numpy as np
+
+# bump when the layout written by _write changes
+FORMAT_VERSION = 1
+
+
+class ColumnarData(Mapping):
+    """Row id -> {attribute: value}, read from the columns of a dataset.
+
+    A column holds either float64 values (a NumPy array, memory-mapped when
+        read from the cache) or int32 codes into a list of values, for
+        categorical attributes and "numerical" ones that are not all numbers.
+        Row dicts are built on access, so no process keeps a Python object
+        per cell.
+    """
+
+    def __init__(self, row_ids, attributes, arrays, categories):
+        self.row_ids = row_ids
+        self.row_index = {row_id: i for i, row_id in enumerate(row_ids)}
+        self.attributes = attributes
+        self._arrays = arrays  # attribute -> float64 values or int32 codes
+        self._categories = categories  # attribute -> list of values, for coded columns
+
+    def __getitem__(self, row_id):
+        i = self.row_index[row_id]
+        row = {}
+        for attr in self.attributes:
+            categories = self._categories.get(attr)
+            if categories is None:
+                row[attr] = self._arrays[attr].item(i)
+            else:
+                row[attr] = categories[self._arrays[attr].item(i)]
+        return row
+
+    def __contains__(self, row_id):
+        return row_id in self.row_index
+
+    def __iter__(self):
+        return iter(self.row_ids)
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def column(self, attr):
+        """Get the values of an attribute in row order, as a list."""
+        categories = self._categories.get(attr)
+        if categories is None:
+            return self._arrays[attr].tolist()
+        return [categories[code] for code in self._arrays[attr].tolist()]
+
+    def array(self, attr):
+        """Get the float64 values of an attribute, None if it is coded."""
+        return None if attr in self._categories else self._arrays[attr]
+
+    def codes(self, attr):
+        """Get the codes and the list of values of a coded attribute, None if
+        it is stored as float64. Values are in order of first appearance.
+        """
+        if attr not in self._categories:
+            return None
+        return self._arrays[attr], self._categories[attr]
+
+
+def load(path, entry, cache_dir, parse):
+    """Load a parsed dataset from the cache, parsing and caching it on a miss.
+
+    `parse(path, entry)` returns the attributes, the row ids and a dict of
+        attribute -> values in row order. The cache is keyed by a hash of the
+        file and its manifest `entry`; without a `cache_dir`, or if it cannot
+        be written, the parsed dataset is kept in memory only.
+
+    Returns the ColumnarData and the distribution of every attribute: the
+        sorted values of numerical attributes, the count of each value of the
+        categorical ones.
+    """
+    if not cache_dir:
+        return _build(*parse(path, entry), entry)
+
+    key = _key(path, entry)
+    name = os.path.basename(path)
+    directory = os.path.join(cache_dir, f"{name}.{key[:16]}")
+    try:
+        return _read(directory, key)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        print(f"  ignoring the cache of {name}: {e}")
+
+    data, distribution = _build(*parse(path, entry), entry)
+    try:
+        _write(directory, key, data, distribution)
+    except OSError as e:
+        print(f"  could not cache {name}: {e}")
+        return data, distribution
+    _remove_stale(cache_dir, name, directory)
+    # reading it back maps the arrays, instead of keeping the parsed copies
+    return _read(directory, key)
+
+
+def _key(path, entry):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(json.dumps([FORMAT_VERSION, entry], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _build(attributes, row_ids, values, entry):
+    numerical = set(entry.get("numerical_attributes", []))
+    arrays = {}
+    categories = {}
+    distribution = {}
+    for attr in attributes:
+        column = values[attr]
+        if attr in numerical and all(type(val) is float for val in column):
+            arrays[attr] = np.array(column, dtype=np.float64)
+        else:
+            code_of = {}
+            codes = [code_of.setdefault(val, len(code_of)) for val in column]
+            arrays[attr] = np.array(codes, dtype=np.int32)
+            categories[attr] = list(code_of)
+        if attr in numerical:
+            distribution[attr] = sorted(column)
+        else:
+            counts = np.bincount(arrays[attr], minlength=len(categories[attr])).tolist()
+            distribution[attr] = dict(zip(categories[attr], counts))
+    return ColumnarData(row_ids, attributes, arrays, categories), distribution
+
+
+def _write(directory, key, data, distribution):
+    """Write the dataset to a temporary directory and move it into place."""
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        meta = {"format": FORMAT_VERSION, "key": key, "row_ids": data.row_ids, "attributes": {}}
+        for i, attr in enumerate(data.attributes):
+            column = {"file": f"{i}.npy"}
+            codes = data.codes(attr)
+            if codes is None:
+                np.save(os.path.join(tmp, column["file"]), data.array(attr))
+            else:
+                np.save(os.path.join(tmp, column["file"]), codes[0])
+                column["categories"] = codes[1]
+            distr = distribution[attr]
+            if isinstance(distr, dict):
+                column["counts"] = list(distr.values())
+            elif codes is None:
+                # sorted values, as floats they are stored as an array too
+                column["sorted_file"] = f"{i}.sorted.npy"
+                np.save(os.path.join(tmp, column["sorted_file"]), np.array(distr, dtype=np.float64))
+            else:
+                column["sorted"] = distr
+            meta["attributes"][attr] = column
+        # the attribute order is the order of the keys
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+            # another process cached it first
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _read(directory, key):
+    with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["format"] != FORMAT_VERSION or meta["key"] != key:
+        raise ValueError("written for another version")
+    attributes = list(meta["attributes"])
+    arrays = {}
+    categories = {}
+    distribution = {}
+    for attr, column in meta["attributes"].items():
+        arrays[attr] = np.load(os.path.join(directory, column["file"]), mmap_mode="r")
+        if "categories" in column:
+            categories[attr] = column["categories"]
+        if "counts" in column:
+            distribution[attr] = dict(zip(column["categories"], column["counts"]))
+        elif "sorted_file" in column:
+            distribution[attr] = np.load(os.path.join(directory, column["sorted_file"])).tolist()
+        else:
+            distribution[attr] = column["sorted"]
+    return ColumnarData(meta["row_ids"], attributes, arrays, categories), distribution
+
+
+def _remove_stale(cache_dir, name, keep):
+    """Remove caches of previous versions of the file."""
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith(f"{name}.") and entry.path != keep:
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,243 @@
+"""Precomputed, read-only lookup structures for a dataset.
+"""
+import bisect
+import statistics
+from collections import OrderedDict
+from types import MappingProxyType
+
+import numpy as np
+
+import bias_util
+from weighted_ks import BaselineECDF
+
+# number of aggregate groups whose summaries each index keeps, see group()
+MAX_GROUPS = 1024
+
+_MISSING = object()
+
+
+class DatasetIndex:
+    """Immutable per-dataset index used on the interaction hot path.
+
+    Built once per dataset version in bias.load_dataset. Stores, per
+        attribute, the quantile boundaries (numerical) or category list
+        (categorical), and for every row the id of the quantile bucket its
+        value falls into, so attribute coverage never sorts or scans quantiles
+        per interaction.
+
+    Also keeps the data columnar (one NumPy array per numerical attribute,
+        integer codes into a category list per categorical attribute, shared
+        with the dataset's columns) so values of many data points can be
+        gathered at once, and the baseline CDFs of the numerical attributes
+        (see weighted_ks).
+
+    Summaries of the aggregates (groups of data points) interacted with are
+        memoized, see group().
+    """
+
+    def __init__(self, dataset, num_quantiles):
+        # a dataset_cache.ColumnarData
+        data = dataset["data"]
+        self.attributes = tuple(dataset["attributes"])
+        self.row_ids = tuple(data)
+        self.row_index = MappingProxyType(data.row_index)
+
+        quantiles = {}
+        is_numerical = {}
+        buckets = {}
+        for attr in self.attributes:
+            # get_quantization sorts in place, so hand it a copy
+            distr = dataset["distribution"][attr]
+            distr = list(distr) if isinstance(distr, list) else dict(distr)
+            attr_quantiles = tuple(bias_util.get_quantization(distr, num_quantiles))
+            quantiles[attr] = attr_quantiles
+            is_numerical[attr] = bias_util.is_numerical(attr_quantiles)
+
+            # position of the first quantile with the same value, which is
+            #   what bias_util.which_quantile resolves to
+            position = {}
+            for i, q in enumerate(attr_quantiles):
+                position.setdefault(q, i)
+            column = data.array(attr)
+            coded = data.codes(attr)
+            if is_numerical[attr] and column is not None and attr_quantiles and not np.isnan(column).any():
+                # the first quantile not below the value, as in which_quantile()
+                bucket_ids = np.searchsorted(np.array(attr_quantiles), column, side="left").tolist()
+            elif not is_numerical[attr] and coded is not None:
+                # every category is its own quantile
+                bucket_of = [position[val] for val in coded[1]]
+                bucket_ids = [bucket_of[code] for code in coded[0].tolist()]
+            else:
+                bucket_ids = [position[bias_util.which_quantile(attr_quantiles, val)] for val in data.column(attr)]
+            buckets[attr] = tuple(bucket_ids)
+
+        columns = {}
+        codes = {}
+        categories = {}
+        for attr in self.attributes:
+            if attr in dataset["numerical_attributes"]:
+                column = data.array(attr)
+                columns[attr] = column if column is not None else np.array(data.column(attr))
+                columns[attr].flags.writeable = False
+            else:
+                # categories are in order of first appearance
+                codes[attr], values = data.codes(attr)
+                categories[attr] = tuple(values)
+                codes[attr].flags.writeable = False
+
+        self.quantiles = MappingProxyType(quantiles)
+        self.is_numerical = MappingProxyType(is_numerical)
+        self.buckets = MappingProxyType(buckets)
+        # bucket ids of every attribute for each row, in self.attributes order
+        self.row_buckets = tuple(zip(*(buckets[attr] for attr in self.attributes)))
+        self.columns = MappingProxyType(columns)
+        self.codes = MappingProxyType(codes)
+        self.categories = MappingProxyType(categories)
+        # baseline CDFs for the weighted k-s test of the numerical attributes
+        self.ks = BaselineECDF(
+            {attr: dataset["distribution"][attr] for attr in self.attributes if attr in columns}, columns
+        )
+        # the numerical columns holding numbers and the category codes of the
+        #   categorical attributes stacked into 2-D arrays, so the data points
+        #   of a group are summarized for every attribute at once; codes are
+        #   offset to be unique across attributes
+        self.stacked = tuple(attr for attr in columns if columns[attr].dtype.kind in "iuf")
+        num_rows = len(self.row_ids)
+        stacked_columns = np.array([columns[attr] for attr in self.stacked], dtype=np.float64)
+        offsets = np.cumsum([0] + [len(categories[attr]) for attr in codes])
+        stacked_codes = np.array([codes[attr] for attr in codes], dtype=np.int64).reshape(len(codes), num_rows)
+        stacked_codes += offsets[:-1, None]
+        for array in (stacked_columns, offsets, stacked_codes):
+            array.flags.writeable = False
+        self._stacked_columns = stacked_columns.reshape(len(self.stacked), num_rows)
+        self._code_offsets = offsets
+        self._stacked_codes = stacked_codes
+        # row bytes -> GroupSummary, least recently used first
+        self._groups = OrderedDict()
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f"DatasetIndex is read-only, cannot set {name}")
+        super().__setattr__(name, value)
+
+    def rows(self, row_ids):
+        """Get the row indices of the given data point ids as a NumPy array."""
+        row_index = self.row_index
+        return np.fromiter((row_index[row_id] for row_id in row_ids), dtype=np.int64, count=len(row_ids))
+
+    def values(self, attr, rows):
+        """Gather the values of an attribute at the given row indices, as a list."""
+        if attr in self.columns:
+            return self.columns[attr][rows].tolist()
+        categories = self.categories[attr]
+        return [categories[code] for code in self.codes[attr][rows].tolist()]
+
+    def group(self, rows):
+        """Get the GroupSummary of an aggregate, given the array("i") of the
+        row indices of its data points.
+
+        Summaries are memoized by the rows (in order) for the MAX_GROUPS most
+            recently used groups, so interacting with the same bar or group
+            again costs a lookup.
+        """
+        key = rows.tobytes()
+        group = self._groups.get(key)
+        if group is not None:
+            self._groups.move_to_end(key)
+            return group
+        rows = np.frombuffer(rows, dtype=np.int32).copy()
+        rows.flags.writeable = False
+        group = self._groups[key] = GroupSummary(self, rows)
+        if len(self._groups) > MAX_GROUPS:
+            self._groups.popitem(last=False)
+        return group
+
+    def row_quantiles(self, row):
+        """Get (attribute, quantile) pairs of the data point at a row index."""
+        row_buckets = self.row_buckets[row]
+        quantiles = self.quantiles
+        return [(attr, quantiles[attr][bucket]) for attr, bucket in zip(self.attributes, row_buckets)]
+
+    def which_quantile(self, attr, val):
+        """Figure out which quantile the given value belongs to.
+
+        Same result as bias_util.which_quantile, found by bisection.
+        """
+        if not self.is_numerical[attr]:
+            return val
+        quantiles = self.quantiles[attr]
+        val = bias_util.cast_to_num(val)
+        if val != val:  # NaN never falls into a quantile
+            return val
+        i = bisect.bisect_left(quantiles, val)
+        if i == len(quantiles):
+            return val
+        return quantiles[i]
+
+
+class GroupSummary:
+    """What the metrics need to know about the data points of an aggregate,
+    kept by DatasetIndex.group().
+
+    `rows` are the row indices of the data points, in the order the
+        aggregate lists them. The median of every numerical attribute, and
+        the count of every category, are computed at once from the index's
+        stacked columns; the most common category is the first one met of the
+        equally common ones, as with statistics.mode.
+    """
+
+    __slots__ = ("index", "rows", "_values", "_quantiles", "_histograms", "_ks")
+
+    def __init__(self, index, rows):
+        self.index = index
+        self.rows = rows
+        self._values = {}
+        self._quantiles = {}
+        self._histograms = {}
+        self._ks = None
+        if not len(rows):
+            return
+
+        values = index._stacked_columns[:, rows]
+        # NaN makes the median depend on the order of the values, left to
+        #   statistics.median
+        has_nan = np.isnan(values).any(axis=1).tolist()
+        for attr, median, nan in zip(index.stacked, np.median(values, axis=1).tolist(), has_nan):
+            if not nan:
+                self._values[attr] = median
+
+        codes = index._stacked_codes[:, rows]
+        offsets = index._code_offsets
+        counts = np.bincount(codes.ravel(), minlength=offsets[-1]).astype(np.float64)
+        counts.flags.writeable = False
+        counts_at = counts[codes]
+        first = np.argmax(counts_at == counts_at.max(axis=1, keepdims=True), axis=1)
+        most_common = (codes[np.arange(len(codes)), first] - offsets[:-1]).tolist()
+        for i, attr in enumerate(index.codes):
+            self._histograms[attr] = counts[offsets[i] : offsets[i + 1]]
+            self._values[attr] = index.categories[attr][most_common[i]]
+
+    def quantile(self, attr):
+        """Get the quantile of the value representing the group for the
+        attribute: the median of a numerical attribute, the most common value
+        of a categorical one.
+        """
+        if attr not in self._quantiles:
+            value = self._values.get(attr, _MISSING)
+            if value is _MISSING:
+                # raises like the metrics do for values without a median
+                value = statistics.median(self.index.values(attr, self.rows))
+            self._quantiles[attr] = self.index.which_quantile(attr, value)
+        return self._quantiles[attr]
+
+    def histogram(self, attr):
+        """Get the number of data points per category code of a categorical
+        attribute, as a float array.
+        """
+        return self._histograms[attr]
+
+    def ks_histogram(self):
+        """Get the data points of the group as a weighted_ks histogram."""
+        if self._ks is None:
+            self._ks = self.index.ks.histogram(self.rows)
+        return self._ks
@@ -0,0 +1,237 @@
+"""Registry of the datasets, declared in a manifest and loaded on first use.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+
+class DatasetRegistry(Mapping):
+    """Dataset name (the `appMode` of interactions) -> dataset dict.
+
+    The manifest is a JSON file of the form
+        {"datasets": {name: {"file": ..., "primary_key": ..., "numerical_attributes": [...]}}}
+        where `file` is relative to the manifest and every column that is not
+        listed as numerical is categorical. `primary_key` may be left out to
+        use the "voter_id" or "id" column, or else the first one.
+
+    A dataset is parsed by `load(path, entry)` the first time it is looked up
+        and kept until its file or manifest entry changes: check(), run every
+        `reload_interval` seconds once start()ed, loads the new version off
+        the event loop and swaps it in. Sessions that started on the previous
+        version keep using it: the versions a reload superseded are kept, by
+        version, for get_version(). Each dataset dict carries its "name" and
+        its "version", a hash of the content of the file it was read from and
+        of its manifest entry: touching, copying or checking the file out
+        again does not make a new version.
+
+    Iteration and len() cover every declared dataset without loading any.
+    """
+
+    def __init__(self, manifest_path, load, reload_interval=5.0):
+        # absolute, the working directory may change after startup
+        self.manifest_path = os.path.abspath(manifest_path)
+        self.load = load
+        self.reload_interval = reload_interval
+        self.reloads = 0
+        self._entries = {}
+        self._manifest_version = None
+        self._loaded = {}
+        self._failed = {}  # name -> version of the file that failed to load
+        self._versions = {}  # name -> (file signature, entry, version)
+        self._superseded = {}  # (name, version) -> dataset replaced by a reload
+        self._lock = threading.RLock()
+        self._task = None
+        self._read_manifest()
+
+    # -- mapping interface
+
+    def __getitem__(self, name):
+        dataset = self._loaded.get(name)
+        if dataset is None:
+            dataset = self._load(name)
+        return dataset
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    # -- versions
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def num_loaded(self):
+        return len(self._loaded)
+
+    def num_superseded(self):
+        return len(self._superseded)
+
+    def get_version(self, name, version):
+        """Get the dataset at the given version: the loaded one, one a reload
+        superseded, or else the one in the file now, which check() has not
+        loaded yet (e.g. in a worker process, which never check()s).
+
+        Raises LookupError if none of them has that version.
+        """
+        dataset = self[name]
+        if dataset["version"] == version:
+            return dataset
+        with self._lock:
+            dataset = self._superseded.get((name, version))
+            if dataset is None and self._version(name) == version:
+                dataset = self._load(name, reload=True)
+        if dataset is None:
+            raise LookupError(f"Version {version} of dataset {name} is no longer available")
+        return dataset
+
+    # -- loading
+
+    def load_all(self):
+        """Load every declared dataset now."""
+        for name in self:
+            self[name]
+
+    async def preload(self, names):
+        """Load the given datasets off the event loop, unless already loaded."""
+        missing = [name for name in names if name in self._entries and name not in self._loaded]
+        if missing:
+            await asyncio.get_event_loop().run_in_executor(None, lambda: [self[name] for name in missing])
+
+    def check(self):
+        """Re-read the manifest if it changed, and reload the loaded datasets
+        whose file or entry changed.
+
+        Returns the names of the datasets reloaded.
+        """
+        reloaded = []
+        with self._lock:
+            self._read_manifest()
+            for name, dataset in list(self._loaded.items()):
+                if name not in self._entries:
+                    del self._loaded[name]
+                    continue
+                version = self._version(name)
+                if version == dataset["version"]:
+                    continue
+                if self._failed.get(name) == version:
+                    continue  # still the version that failed, keep the loaded one
+                try:
+                    self._load(name, reload=True)
+                except Exception as e:
+                    self._failed[name] = version
+                    print(f"Reloading dataset {name} failed: {e}")
+                else:
+                    reloaded.append(name)
+        return reloaded
+
+    def _load(self, name, reload=False):
+        with self._lock:
+            if not reload and name in self._loaded:
+                return self._loaded[name]
+            entry = self._entries[name]
+            path = self._path(name)
+            version = self._version(name)
+            dataset = self.load(path, entry)
+            dataset["name"] = name
+            dataset["version"] = version
+            previous = self._loaded.get(name)
+            if previous is not None and previous["version"] != version:
+                self._superseded[(name, previous["version"])] = previous
+            self._loaded[name] = dataset
+            self._failed.pop(name, None)
+            if reload:
+                self.reloads += 1
+            return dataset
+
+    def _read_manifest(self):
+        signature = _signature(self.manifest_path)
+        if signature == self._manifest_version:
+            return
+        with open(self.manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        self._entries = manifest["datasets"]
+        self._manifest_version = signature
+
+    def _path(self, name):
+        return os.path.join(os.path.dirname(self.manifest_path), self._entries[name]["file"])
+
+    def _version(self, name):
+        """Version of the dataset's file as it is now, hashed again only if
+        the file's modification time or size or the manifest entry changed.
+        """
+        path = self._path(name)
+        entry = self._entries[name]
+        signature = _signature(path)
+        cached = self._versions.get(name)
+        if cached is not None and cached[0] == signature and cached[1] == entry:
+            return cached[2]
+        version = _content_hash(path, entry) if signature is not None else None
+        self._versions[name] = (signature, entry, version)
+        return version
+
+    # -- background reloading
+
+    def start(self):
+        """Start checking for changes periodically on the running event loop."""
+        if self._task is None and self.reload_interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                reloaded = await loop.run_in_executor(None, self.check)
+            except Exception as e:
+                # e.g. a manifest caught half-written, tried again next time
+                print(f"Checking the datasets failed: {e}")
+                continue
+            for name in reloaded:
+                print(f"Reloaded dataset {name}")
+
+
+def _signature(path):
+    """Modification time and size of a file, None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _content_hash(path, entry):
+    """SHA-256 of a file's content and its manifest entry."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(json.dumps(entry, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def from_env(load):
+    """Create a DatasetRegistry configured by DATASET_MANIFEST and
+    DATASET_RELOAD_INTERVAL.
+    """
+    return DatasetRegistry(
+        os.environ.get("DATASET_MANIFEST", os.path.join("data", "datasets.json")),
+        load,
+        reload_interval=float(os.environ.get("DATASET_RELOAD_INTERVAL", 5)),
+    )
@@ -0,0 +1,103 @@
+"""Encoded "attribute_distribution" messages, serialized once per dataset
+version.
+"""
+import asyncio
+import zlib
+from collections import OrderedDict
+
+from socketio import packet
+
+import socket_packets
+
+EVENT = "attribute_distribution"
+COMPRESSIONS = ["deflate"]
+
+
+class DistributionPayloads:
+    """Sends the distributions of the datasets to a socket as the
+    "attribute_distribution" event, {dataset name: distribution}.
+
+    Every dataset's distribution is serialized to JSON once per version,
+        and the encoded packets for the sets of datasets asked for are kept
+        (the `max_packets` most recently used), so a socket connecting costs
+        no serialization. A packet is encoded exactly like
+        sio.emit(EVENT, distributions) would; with compression "deflate" the
+        event instead carries {"encoding": "deflate", "datasets": [names],
+        "data": <zlib-compressed JSON of the distributions>} as a binary
+        attachment.
+    """
+
+    def __init__(self, sio, registry, max_packets=32):
+        self.sio = sio
+        self.registry = registry
+        self.max_packets = max_packets
+        self.built = 0
+        self.cached = 0
+        self._fragments = {}  # name -> (version, '"name":{...}')
+        self._packets = OrderedDict()
+        self._building = {}  # key -> future of a packet being encoded
+
+    async def send(self, sid, names=None, compression=None):
+        """Send the distributions of the given datasets (every declared one
+        by default; unknown names are left out) to the socket.
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if names is None:
+            names = list(self.registry)
+        else:
+            names = [name for name in dict.fromkeys(names) if name in self.registry]
+        # datasets not used yet are loaded off the event loop
+        await self.registry.preload(names)
+        await socket_packets.send(self.sio, sid, await self.packet(names, compression))
+
+    async def packet(self, names, compression=None):
+        """Get the encoded packet for the loaded datasets `names`, encoding it
+        off the event loop unless cached.
+        """
+        key = (tuple(names), tuple(self.registry[name]["version"] for name in names), compression)
+        encoded_packet = self._packets.get(key)
+        if encoded_packet is not None:
+            self._packets.move_to_end(key)
+            self.cached += 1
+            return encoded_packet
+        future = self._building.get(key)
+        if future is None:
+            # shared by the sockets connecting meanwhile
+            datasets = [self.registry[name] for name in names]
+            future = asyncio.get_event_loop().run_in_executor(None, self._encode, datasets, compression)
+            self._building[key] = future
+            try:
+                encoded_packet = await future
+            finally:
+                del self._building[key]
+            self._packets[key] = encoded_packet
+            while len(self._packets) > self.max_packets:
+                self._packets.popitem(last=False)
+            self.built += 1
+            return encoded_packet
+        self.cached += 1
+        return await asyncio.shield(future)
+
+    def _encode(self, datasets, compression):
+        body = "{" + ",".join(self._fragment(dataset) for dataset in datasets) + "}"
+        if compression is None:
+            # what packet.Packet(packet.EVENT, data=[EVENT, distributions]).encode() returns
+            return f"{packet.EVENT}[{packet.Packet.json.dumps(EVENT)},{body}]"
+        data = {
+            "encoding": compression,
+            "datasets": [dataset["name"] for dataset in datasets],
+            "data": zlib.compress(body.encode("utf-8")),
+        }
+        return socket_packets.encode_event(EVENT, data)
+
+    def _fragment(self, dataset):
+        name = dataset["name"]
+        cached = self._fragments.get(name)
+        if cached is not None and cached[0] == dataset["version"]:
+            return cached[1]
+        json = packet.Packet.json
+        fragment = json.dumps(name) + ":" + json.dumps(dataset["distribution"], separators=(",", ":"))
+        # older versions are not sent any more
+        self._fragments[name] = (dataset["version"], fragment)
+        return fragment
@@ -0,0 +1,150 @@
+"""Write-behind queue for Firestore documents.
+
+Socket.IO handlers enqueue documents without waiting on Firestore; a
+background task writes them out in batches.
+"""
+import asyncio
+import time
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_SIZE = 500
+
+
+class FirestoreSink:
+    """Sink writing batches of documents to a Firestore client."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def write(self, docs):
+        """Write a list of (collection, document) pairs in one batch. Blocking."""
+        batch = self.db.batch()
+        for collection, doc in docs:
+            batch.set(self.db.collection(collection).document(), doc)
+        batch.commit()
+
+
+class MemorySink:
+    """In-memory stand-in for FirestoreSink, e.g. for tests or local runs.
+
+    Documents end up in `collections`, a dict mapping collection name to a
+        list of documents. Setting `fail_next` to n makes the next n writes
+        raise, to exercise retries.
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.batches = []
+        self.fail_next = 0
+
+    def write(self, docs):
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            raise RuntimeError("MemorySink: simulated write failure")
+        self.batches.append(list(docs))
+        for collection, doc in docs:
+            self.collections.setdefault(collection, []).append(doc)
+
+
+class WriteBehindQueue:
+    """Bounded queue of documents flushed to a sink by a background task.
+
+    A flush happens once `batch_size` documents are waiting or `flush_interval`
+        seconds after the first waiting document, whichever comes first. The
+        sink's blocking write runs in the default executor so the event loop
+        is never stalled on a round-trip. Failed batches are retried with
+        exponential backoff up to `max_retries` times, then dropped.
+    When `max_size` documents are queued, put() waits until there is room.
+    """
+
+    def __init__(
+        self,
+        sink,
+        batch_size=100,
+        flush_interval=1.0,
+        max_size=10000,
+        max_retries=3,
+        retry_backoff=0.5,
+    ):
+        self.sink = sink
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.written = 0
+        self.dropped = 0
+        self._queue = None
+        self._task = None
+        self._closed = False
+
+    def start(self):
+        """Start the background flush task on the running event loop."""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._closed = False
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop accepting documents and flush everything still queued."""
+        if self._task is None:
+            return
+        self._closed = True
+        await self._queue.put(None)  # wake up the flush task
+        await self._task
+        self._task = None
+
+    def qsize(self):
+        """Number of documents waiting to be written."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def put(self, collection, doc):
+        """Queue a document for the given collection, waiting if the queue is full."""
+        if self._task is None or self._closed:
+            raise RuntimeError("WriteBehindQueue is not running")
+        await self._queue.put((collection, doc))
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            docs = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(docs) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                docs.append(item)
+            await self._write(loop, docs)
+
+        # drain whatever was queued before stop() in full batches
+        docs = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                docs.append(item)
+        for i in range(0, len(docs), self.batch_size):
+            await self._write(loop, docs[i : i + self.batch_size])
+
+    async def _write(self, loop, docs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await loop.run_in_executor(None, self.sink.write, docs)
+                self.written += len(docs)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.dropped += len(docs)
+                    print(f"Error writing {len(docs)} documents to Firestore, dropping them: {e}")
+                    return
+                await asyncio.sleep(self.retry_backoff * 2**attempt)
@@ -0,0 +1,145 @@
+"""Timing and gauges of the server, exposed in the Prometheus text format.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Distribution of observed values, optionally split by one label."""
+
+    def __init__(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}  # label value -> [bucket counts..., sum, count]
+
+    def observe(self, value, label_value=None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, label_value=None):
+        """Observe the seconds spent in the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label_value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, series in self._series.items():
+            labels = _labels(self.label, label_value)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(self.label, label_value, le=_number(bound))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(self.label, label_value, le='+Inf')} {series[-1]}")
+            lines.append(f"{self.name}_sum{labels} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Sampled:
+    """Gauge or counter whose value is read when rendered.
+
+    `read()` returns a number, or a dict mapping label value to number.
+    """
+
+    def __init__(self, name, help, read, kind="gauge", label=None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+        self.label = label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        value = self.read()
+        if isinstance(value, dict):
+            for label_value, v in value.items():
+                lines.append(f"{self.name}{_labels(self.label, label_value)} {_number(v)}")
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up a task that sleeps for
+    `interval` seconds, i.e. how long callbacks wait for the loop.
+    """
+
+    def __init__(self, histogram=None, interval=0.5):
+        self.histogram = histogram
+        self.interval = interval
+        self.lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.monotonic() - start - self.interval)
+            if self.histogram is not None:
+                self.histogram.observe(self.lag)
+
+
+def _labels(label, label_value, **extra):
+    pairs = []
+    if label is not None and label_value is not None:
+        pairs.append((label, label_value))
+    pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
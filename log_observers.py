@@ -0,0 +1,67 @@
+"""Scoped broadcast of the admin "log" stream.
+"""
+import socket_packets
+
+
+class LogObservers:
+    """Sockets observing the "log" stream, each with its subscription filter.
+
+    A filter restricts the stream by participant id, app type and dataset
+        (app mode); a missing or empty criterion matches everything.
+    Responses are sent in the serialization each socket negotiated with
+        `serializations` (a serialization.Serializations), JSON without it.
+    """
+
+    def __init__(self, sio, serializations=None):
+        self.sio = sio
+        self.serializations = serializations
+        self.filters = {}
+
+    def subscribe(self, sid, participant_ids=None, app_types=None, datasets=None):
+        """Subscribe a socket to the log stream, replacing any previous filter."""
+        self.filters[sid] = {
+            "participant_id": _as_set(participant_ids),
+            "app_type": _as_set(app_types),
+            "app_mode": _as_set(datasets),
+        }
+
+    def unsubscribe(self, sid):
+        self.filters.pop(sid, None)
+
+    def is_subscribed(self, sid):
+        return sid in self.filters
+
+    def subscribers(self, response):
+        """Get the sockets whose filter matches the response."""
+        sids = []
+        for sid, criteria in self.filters.items():
+            for key, allowed in criteria.items():
+                if allowed and response.get(key) not in allowed:
+                    break
+            else:
+                sids.append(sid)
+        return sids
+
+    async def broadcast(self, event, response):
+        """Send the response to the matching observers, serializing it only
+        once per serialization.
+        """
+        sids = self.subscribers(response)
+        if not sids:
+            return
+        encoded_packets = {}
+        for sid in sids:
+            serialization = "json" if self.serializations is None else self.serializations.get(sid)
+            encoded_packet = encoded_packets.get(serialization)
+            if encoded_packet is None:
+                data = response if self.serializations is None else self.serializations.encode(response, serialization)
+                encoded_packet = encoded_packets[serialization] = socket_packets.encode_event(event, data)
+            await socket_packets.send(self.sio, sid, encoded_packet)
+
+
+def _as_set(values):
+    if values is None:
+        return None
+    if isinstance(values, str):
+        return {values}
+    return set(values)
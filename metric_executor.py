@@ -0,0 +1,162 @@
+"""Run bias metric computation off the event loop.
+"""
+import asyncio
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bias
+
+EXECUTOR_MODES = ["inline", "thread", "process"]
+
+
+def _compute_metrics(state):
+    """Compute the metrics of a bias_state.MetricState.
+
+    Returns the metrics and the seconds spent on each of them.
+    """
+    timings = {}
+    return state.metrics(timings=timings), timings
+
+
+def _compute_pickled_metrics(payload):
+    """Compute the metrics of a pickled bias_state.MetricState, in a worker
+    process; see _compute_metrics.
+    """
+    return _compute_metrics(pickle.loads(payload))
+
+
+def _load_datasets():
+    """Load every dataset when a worker process starts, rather than in the
+    first computation that needs one.
+    """
+    bias.DATA_MAP.load_all()
+
+
+class _Slot:
+    """Per-participant bookkeeping: at most one computation runs at a time."""
+
+    def __init__(self):
+        self.task = None
+        self.pending_state = None
+        self.pending_future = None
+
+
+class MetricExecutor:
+    """Compute bias metrics in a process or thread pool.
+
+    Computations of the same participant run one at a time and in order. If a
+        participant's events arrive while a computation is running, only the
+        most recent one is kept waiting; the superseded request resolves to
+        None instead of computing metrics for a stale state.
+
+    In "inline" mode the metrics are computed directly on the event loop.
+        In "thread" mode, the default, each computation runs on a snapshot of
+        the state (see MetricState.snapshot), so the interactions folded in
+        meanwhile do not leak into it. In "process" mode, each computation
+        pickles the whole state to a worker process, which only pays off when
+        computing the metrics takes much longer than that.
+
+    If set, `observe(seconds, metric_name)` is called with the time each
+        metric took to compute.
+    """
+
+    def __init__(self, mode="thread", max_workers=None):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown metric executor mode: {mode}")
+        self.mode = mode
+        self.max_workers = max_workers
+        self.coalesced = 0
+        self.observe = None
+        self._pool = None
+        self._slots = {}
+
+    def start(self):
+        """Create the worker pool. Worker processes are started by a fork
+        server (or spawned where there is none) rather than forked from the
+        server, whose other threads may hold locks at that point. Like any
+        spawned process, they import the main module again (which must
+        guard what it runs under `if __name__ == "__main__"`), then load
+        every dataset.
+        """
+        max_workers = self.max_workers or os.cpu_count()
+        if self.mode == "process":
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=context, initializer=_load_datasets
+            )
+        elif self.mode == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metrics")
+
+    async def stop(self):
+        """Wait for running computations and shut the pool down."""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_event_loop().run_in_executor(None, pool.shutdown)
+
+    def pending(self):
+        """Number of participants with a computation running or waiting."""
+        return len(self._slots)
+
+    async def compute(self, key, state):
+        """Compute the metrics of `state`, a participant's bias_state.MetricState.
+
+        `key` identifies the participant. Returns the metrics, or None if a
+            newer request for the same participant superseded this one.
+        """
+        if self._pool is None:
+            result, timings = _compute_metrics(state)
+            self._observe(timings)
+            return result
+
+        loop = asyncio.get_event_loop()
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot()
+        if slot.pending_future is not None:
+            # a newer state supersedes the waiting one
+            slot.pending_future.set_result(None)
+            self.coalesced += 1
+        slot.pending_state = state
+        slot.pending_future = loop.create_future()
+        future = slot.pending_future
+        if slot.task is None:
+            slot.task = asyncio.ensure_future(self._drain(key, slot))
+        return await future
+
+    async def _drain(self, key, slot):
+        loop = asyncio.get_event_loop()
+        try:
+            while slot.pending_future is not None:
+                state, future = slot.pending_state, slot.pending_future
+                slot.pending_state = slot.pending_future = None
+                # snapshot the state now, later updates must not leak into this run
+                if self.mode == "process":
+                    job = (_compute_pickled_metrics, pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+                else:
+                    job = (_compute_metrics, state.snapshot())
+                try:
+                    result, timings = await loop.run_in_executor(self._pool, *job)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                    self._observe(timings)
+        finally:
+            del self._slots[key]
+
+    def _observe(self, timings):
+        if self.observe is not None:
+            for name, seconds in timings.items():
+                self.observe(seconds, name)
+
+
+def from_env():
+    """Create a MetricExecutor configured by METRICS_EXECUTOR / METRICS_WORKERS."""
+    mode = os.environ.get("METRICS_EXECUTOR", "thread")
+    max_workers = os.environ.get("METRICS_WORKERS")
+    return MetricExecutor(mode, int(max_workers) if max_workers else None)
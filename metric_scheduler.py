@@ -0,0 +1,122 @@
+"""Throttle bias metric recomputation per participant.
+"""
+import asyncio
+import os
+import time
+
+
+class _Slot:
+    """Per-participant throttling state."""
+
+    def __init__(self):
+        self.last_run = None
+        self.events_since_run = 0
+        self.pending_state = None
+        self.pending_future = None
+        self.timer = None
+
+
+class MetricScheduler:
+    """Coalesce bursts of interactions into fewer metric computations.
+
+    Every interaction is still folded into the participant's state by the
+        caller; only the metric computation is throttled. A participant's
+        metrics are computed at most once per `window` seconds (0, the
+        default, computes every interaction), or earlier once `every_n`
+        interactions have piled up (0 disables the count trigger). The first
+        interaction after a quiet window is computed right away; one that
+        falls inside the window waits, and is computed at the end of the
+        window unless a newer interaction supersedes it, so the result for
+        the latest state is always delivered.
+
+    Computations go through a metric_executor.MetricExecutor.
+    """
+
+    def __init__(self, executor, window=0, every_n=0):
+        self.executor = executor
+        self.window = window
+        self.every_n = every_n
+        self.computed = 0
+        self.skipped = 0
+        self._slots = {}
+
+    async def submit(self, key, state):
+        """Request the metrics of `state`, the MetricState of participant `key`.
+
+        Returns the metrics, or None if a newer interaction of the participant
+            superseded this one before it was computed.
+        """
+        loop = asyncio.get_event_loop()
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot()
+
+        if slot.pending_future is not None and not slot.pending_future.done():
+            slot.pending_future.set_result(None)
+            self.skipped += 1
+        slot.pending_state = state
+        slot.pending_future = future = loop.create_future()
+        slot.events_since_run += 1
+
+        now = time.monotonic()
+        due = slot.last_run is None or now - slot.last_run >= self.window
+        if self.every_n and slot.events_since_run >= self.every_n:
+            due = True
+        if due:
+            self._fire(key)
+        elif slot.timer is None:
+            slot.timer = loop.call_later(slot.last_run + self.window - now, self._fire, key)
+        return await future
+
+    def forget(self, key):
+        """Drop the throttling state of a participant; an interaction still
+        waiting resolves to None, as if superseded.
+        """
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        if slot.timer is not None:
+            slot.timer.cancel()
+        if slot.pending_future is not None and not slot.pending_future.done():
+            slot.pending_future.set_result(None)
+            self.skipped += 1
+
+    def _fire(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            return
+        if slot.timer is not None:
+            slot.timer.cancel()
+            slot.timer = None
+        if slot.pending_future is None:
+            return
+        state, future = slot.pending_state, slot.pending_future
+        slot.pending_state = slot.pending_future = None
+        slot.last_run = time.monotonic()
+        slot.events_since_run = 0
+        self.computed += 1
+        asyncio.ensure_future(self._run(key, state, future))
+        # the slot is only needed until the window is over
+        asyncio.get_event_loop().call_later(self.window, self._prune, key, slot, slot.last_run)
+
+    def _prune(self, key, slot, last_run):
+        # nothing ran or is waiting since
+        if self._slots.get(key) is slot and slot.last_run == last_run and slot.pending_future is None:
+            del self._slots[key]
+
+    async def _run(self, key, state, future):
+        try:
+            result = await self.executor.compute(key, state)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+
+def from_env(executor):
+    """Create a MetricScheduler configured by METRICS_WINDOW_MS / METRICS_EVERY_N."""
+    window_ms = float(os.environ.get("METRICS_WINDOW_MS", 0))
+    every_n = int(os.environ.get("METRICS_EVERY_N", 0))
+    return MetricScheduler(executor, window_ms / 1000.0, every_n)
@@ -0,0 +1,389 @@
+"""Bounded store of participant sessions, spilling idle ones to disk.
+"""
+import asyncio
+import os
+import pickle
+import sys
+import time
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+# of the spilled session files
+SUFFIX = ".pickle.z"
+
+
+class ParticipantStore(MutableMapping):
+    """Participant id -> session dict, with a memory budget.
+
+    Sessions idle for `idle_ttl` seconds, or disconnected for
+        `disconnected_ttl` seconds, are spilled to `spill_dir` as compressed
+        pickles; while the resident sessions exceed `max_bytes`, the least
+        recently used ones are spilled as well. The mapping interface only
+        covers resident sessions; `await store.load(pid)` loads a spilled
+        session back off the event loop before it is used again. One that
+        cannot be unpickled any more is reported missing, and its file is
+        kept aside as <pid>.pickle.bad.
+
+    Sessions spilled by an earlier run are picked up by start(), unless
+        `is_stale` tells a newer copy of them exists elsewhere.
+
+    Session sizes are estimated by walking the session dict, and only
+        re-measured for sessions used since the previous sweep.
+
+    Hooks, all optional:
+        is_busy(pid, session) -- True if the session must not be spilled now
+        on_spill(pid, session) -- called before a session is spilled
+        on_load(pid, session) -- called after a session was loaded back
+        is_stale(pid, spilled_at) -- True if a session spilled by an earlier
+            run at `spilled_at` (a time.time()) is outdated; it is deleted
+    """
+
+    def __init__(
+        self,
+        spill_dir,
+        max_bytes=512 * 1024 * 1024,
+        idle_ttl=1800.0,
+        disconnected_ttl=300.0,
+        sweep_interval=10.0,
+        is_busy=None,
+        on_spill=None,
+        on_load=None,
+        is_stale=None,
+    ):
+        self.spill_dir = Path(spill_dir)
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.disconnected_ttl = disconnected_ttl
+        self.sweep_interval = sweep_interval
+        self.is_busy = is_busy
+        self.on_spill = on_spill
+        self.on_load = on_load
+        self.is_stale = is_stale
+        self.spilled = 0
+        self.loaded = 0
+        self._sessions = OrderedDict()  # least recently used first
+        self._last_used = {}
+        self._disconnected_at = {}
+        self._sizes = {}
+        self._dirty = set()
+        self._spilled_sizes = {}  # pid -> bytes on disk, of every spilled session
+        self._spilling = {}  # pid -> blob still being written
+        self._loading = {}  # pid -> task loading the session back
+        self._task = None
+
+    # -- mapping interface
+
+    def __getitem__(self, pid):
+        session = self._sessions[pid]
+        self._touch(pid)
+        return session
+
+    def __setitem__(self, pid, session):
+        self._sessions[pid] = session
+        self._touch(pid)
+
+    def __delitem__(self, pid):
+        if pid in self._sessions:
+            del self._sessions[pid]
+        elif not self._discard_spilled(pid):
+            raise KeyError(pid)
+        self._last_used.pop(pid, None)
+        self._disconnected_at.pop(pid, None)
+        self._sizes.pop(pid, None)
+        self._dirty.discard(pid)
+
+    def __contains__(self, pid):
+        return pid in self._sessions
+
+    def __iter__(self):
+        return iter(list(self._sessions))
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # -- connection tracking
+
+    def connected(self, pid):
+        self._disconnected_at.pop(pid, None)
+
+    def disconnected(self, pid):
+        if pid in self._sessions:
+            self._disconnected_at[pid] = time.monotonic()
+
+    def is_resident(self, pid):
+        return pid in self._sessions
+
+    def is_spilled(self, pid):
+        return pid in self._spilled_sizes
+
+    async def load(self, pid):
+        """Get a session, loading it back off the event loop if it was
+        spilled; concurrent calls for the same participant share the load.
+
+        Returns None if there is no such session, or it cannot be unpickled
+            any more.
+        """
+        if pid in self._sessions:
+            return self[pid]
+        if pid not in self._spilled_sizes:
+            return None
+        task = self._loading.get(pid)
+        if task is None:
+            task = self._loading[pid] = asyncio.ensure_future(self._load(pid))
+            task.add_done_callback(lambda _: self._loading.pop(pid, None))
+        await asyncio.shield(task)
+        return self[pid] if pid in self._sessions else None
+
+    # -- memory
+
+    def memory_usage(self):
+        """Get the estimated size in bytes of every known session.
+
+        Returns a dict mapping participant id to {"bytes": ..., "spilled": ...};
+            for spilled sessions, "bytes" is the size on disk.
+        """
+        self._measure()
+        usage = {}
+        for pid in self._sessions:
+            usage[pid] = {"bytes": self._sizes.get(pid, 0), "spilled": False}
+        for pid, size in self._spilled_sizes.items():
+            usage[pid] = {"bytes": size, "spilled": True}
+        return usage
+
+    def num_spilled(self):
+        """Number of sessions spilled to disk, including those of an earlier run."""
+        return len(self._spilled_sizes)
+
+    def resident_bytes(self):
+        return sum(self._sizes.get(pid, 0) for pid in self._sessions)
+
+    # -- eviction
+
+    def start(self):
+        """Pick up the sessions spilled by an earlier run, and start sweeping
+        periodically on the running event loop.
+        """
+        if self._task is None:
+            self._scan()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sweep(self):
+        """Spill expired sessions, then least recently used ones until the
+        resident sessions fit into the memory budget.
+
+        Returns the ids of the spilled sessions.
+        """
+        now = time.monotonic()
+        evict = []
+        for pid in self._sessions:
+            disconnected_at = self._disconnected_at.get(pid)
+            if now - self._last_used[pid] >= self.idle_ttl:
+                evict.append(pid)
+            elif disconnected_at is not None and now - disconnected_at >= self.disconnected_ttl:
+                evict.append(pid)
+
+        self._measure()
+        total = self.resident_bytes() - sum(self._sizes.get(pid, 0) for pid in evict)
+        if total > self.max_bytes:
+            for pid in self._sessions:
+                if total <= self.max_bytes:
+                    break
+                if pid not in evict:
+                    evict.append(pid)
+                    total -= self._sizes.get(pid, 0)
+
+        spilled = []
+        for pid in evict:
+            session = self._sessions[pid]
+            if self.is_busy is not None and self.is_busy(pid, session):
+                continue
+            self._spill(pid, session)
+            spilled.append(pid)
+        if spilled:
+            await self._write_spilled(spilled)
+        return spilled
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                spilled = await self.sweep()
+                if spilled:
+                    print(f"Spilled {len(spilled)} idle participant sessions to {self.spill_dir}")
+            except Exception as e:
+                print(f"Error sweeping participant sessions: {e}")
+
+    def _touch(self, pid):
+        self._sessions.move_to_end(pid)
+        self._last_used[pid] = time.monotonic()
+        self._dirty.add(pid)
+
+    def _measure(self):
+        for pid in self._dirty:
+            if pid in self._sessions:
+                self._sizes[pid] = deep_sizeof(self._sessions[pid])
+        self._dirty.clear()
+
+    # -- spilling
+
+    def _spill_path(self, pid):
+        return self.spill_dir / f"{quote(str(pid), safe='')}{SUFFIX}"
+
+    def _spill(self, pid, session):
+        if self.on_spill is not None:
+            self.on_spill(pid, session)
+        # pickled on the event loop so the session cannot change underneath
+        blob = zlib.compress(pickle.dumps(session, pickle.HIGHEST_PROTOCOL))
+        del self._sessions[pid]
+        self._last_used.pop(pid, None)
+        self._disconnected_at.pop(pid, None)
+        self._sizes.pop(pid, None)
+        self._dirty.discard(pid)
+        self._spilling[pid] = blob
+        self._spilled_sizes[pid] = len(blob)
+        self.spilled += 1
+
+    async def _write_spilled(self, pids):
+        loop = asyncio.get_event_loop()
+        for pid in pids:
+            blob = self._spilling.get(pid)
+            if blob is None:
+                continue  # loaded back in the meantime
+            path = self._spill_path(pid)
+            await loop.run_in_executor(None, _write_file, path, blob)
+            if self._spilling.get(pid) is blob:
+                del self._spilling[pid]
+            elif pid not in self._spilling:
+                # loaded back or deleted while being written, the file is stale
+                path.unlink(missing_ok=True)
+
+    async def _load(self, pid):
+        path = None
+        blob = self._spilling.get(pid)
+        if blob is None:
+            path = self._spill_path(pid)
+        try:
+            session = await asyncio.get_event_loop().run_in_executor(None, _read_session, path, blob)
+        except FileNotFoundError:
+            self._spilled_sizes.pop(pid, None)
+            return
+        except Exception as e:
+            # e.g. the dataset version it refers to is gone
+            print(f"Could not load the spilled session of participant {pid}: {e!r}")
+            if self._discard_spilled(pid, keep=True) and path is not None:
+                os.replace(path, path.with_suffix(".bad"))
+            return
+        # the file is only deleted once the session is back
+        if not self._discard_spilled(pid) or pid in self._sessions:
+            # deleted or replaced while loading
+            return
+        self._sessions[pid] = session
+        self._touch(pid)
+        self.loaded += 1
+        if self.on_load is not None:
+            self.on_load(pid, session)
+
+    def _discard_spilled(self, pid, keep=False):
+        if self._spilled_sizes.pop(pid, None) is None:
+            return False
+        if self._spilling.pop(pid, None) is None and not keep:
+            self._spill_path(pid).unlink(missing_ok=True)
+        return True
+
+    def _scan(self):
+        """Add the sessions in `spill_dir` that are not outdated to the
+        spilled ones.
+        """
+        try:
+            names = os.listdir(self.spill_dir)
+        except FileNotFoundError:
+            return
+        stale = 0
+        for name in names:
+            if not name.endswith(SUFFIX):
+                continue
+            pid = unquote(name[: -len(SUFFIX)])
+            if pid in self._sessions or pid in self._spilled_sizes:
+                continue
+            path = self.spill_dir / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if self.is_stale is not None and self.is_stale(pid, stat.st_mtime):
+                path.unlink(missing_ok=True)
+                stale += 1
+            else:
+                self._spilled_sizes[pid] = stat.st_size
+        if stale:
+            print(f"Deleted {stale} outdated spilled participant sessions from {self.spill_dir}")
+
+
+def _read_session(path, blob):
+    """Unpickle a spilled session, from `blob` or else from its file."""
+    if blob is None:
+        blob = path.read_bytes()
+    return pickle.loads(zlib.decompress(blob))
+
+
+def _write_file(path, blob):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def deep_sizeof(obj):
+    """Estimate the memory held by obj and everything it references.
+
+    Objects defining __getstate__ are measured by what they pickle, so
+        shared data (like the datasets referenced by a MetricState) is left out.
+    """
+    seen = set()
+    size = 0
+    stack = deque([obj])
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif any("__getstate__" in cls.__dict__ for cls in type(o).__mro__[:-1]):
+            # defined by the class or a base class other than object
+            stack.append(o.__getstate__())
+        elif hasattr(o, "__dict__"):
+            stack.append(o.__dict__)
+        elif "__slots__" in type(o).__dict__:
+            stack.extend(getattr(o, name, None) for name in type(o).__slots__)
+    return size
+
+
+def from_env(**hooks):
+    """Create a ParticipantStore configured by PARTICIPANT_MEMORY_MB,
+    PARTICIPANT_IDLE_TTL, PARTICIPANT_DISCONNECTED_TTL and PARTICIPANT_SPILL_DIR.
+    """
+    return ParticipantStore(
+        os.environ.get("PARTICIPANT_SPILL_DIR", "output/.sessions"),
+        max_bytes=float(os.environ.get("PARTICIPANT_MEMORY_MB", 512)) * 1024 * 1024,
+        idle_ttl=float(os.environ.get("PARTICIPANT_IDLE_TTL", 1800)),
+        disconnected_ttl=float(os.environ.get("PARTICIPANT_DISCONNECTED_TTL", 300)),
+        **hooks,
+    )
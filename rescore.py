@@ -0,0 +1,238 @@
+"""Compute the bias metrics of archived session logs again, offline.
+
+Usage: python rescore.py [paths ...] [--output scores.csv] [--workers N]
+
+Reads the session logs the server wrote (logs_*.tsv and logs_*.ndjson, see
+session_log; directories are searched recursively, output/ by default) and
+replays the interactions of each log file through a bias_state.MetricState,
+one pass per session, the participants spread over a process pool. Servers
+that did not stream the logs yet wrote every response of the session so far
+to a new file on each save; such a dump is skipped when a later file of the
+participant repeats it, so its interactions are scored once. Writes one
+row per interaction with one column per metric and per attribute metric
+("attribute_coverage.<attribute>"); only the interactions the server scores
+have metric values, limited to the window the session asked for (see
+bias_state.apply_window). Written as Parquet if --output ends in .parquet (needs
+pyarrow or fastparquet), as CSV otherwise.
+"""
+import argparse
+import ast
+import csv
+import importlib.util
+import json
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import bias_state
+
+LOG_PATTERNS = ["logs_*.tsv", "logs_*.ndjson"]
+COLUMNS = [
+    "file",
+    "row",
+    "participant_id",
+    "app_mode",
+    "app_type",
+    "app_level",
+    "processed_at",
+    "interaction_type",
+    "error",
+]
+
+
+def find_logs(paths):
+    """Session log files at or below the given paths, sorted."""
+    found = set()
+    for path in map(Path, paths):
+        if path.is_dir():
+            for pattern in LOG_PATTERNS:
+                found.update(path.rglob(pattern))
+        else:
+            found.add(path)
+    return sorted(found)
+
+
+def read_log(path):
+    """Responses of a session log, input_data decoded back into the
+    interaction it was.
+    """
+    path = Path(path)
+    responses = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.suffix == ".ndjson":
+            for line in f:
+                if line.strip():
+                    responses.append(json.loads(line))
+            return responses
+        reader = csv.reader(f, delimiter="\t", quotechar='"')
+        header = next(reader, None)
+        if header is None:
+            return responses
+        columns = header[1:]
+        for cells in reader:
+            response = dict(zip(columns, cells[1:]))
+            # written with str(), the repr of the dict the client sent
+            input_data = response.get("input_data")
+            response["input_data"] = literal_eval(input_data) if input_data else {}
+            responses.append(response)
+    return responses
+
+
+def literal_eval(text):
+    """ast.literal_eval, also reading the nan and inf that str() writes for
+    such floats.
+    """
+    return ast.literal_eval(_NonFinite().visit(ast.parse(text, mode="eval")))
+
+
+class _NonFinite(ast.NodeTransformer):
+    def visit_Name(self, node):
+        if node.id in ("nan", "inf"):
+            return ast.copy_location(ast.Constant(float(node.id)), node)
+        return node
+
+
+def response_key(response):
+    """What tells the responses of a session log apart."""
+    data = response["input_data"]
+    return (
+        str(response.get("processed_at")),
+        str(data.get("interactionAt")),
+        str(response.get("interaction_type") or data.get("interactionType")),
+    )
+
+
+def score_logs(paths):
+    """Score the session logs of a participant, skipping every log that a
+    later one (in name order, which is time order) starts with.
+    """
+    logs = [(path, read_log(path)) for path in sorted(paths)]
+    keys = [[response_key(response) for response in responses] for _, responses in logs]
+    rows = []
+    for i, (path, responses) in enumerate(logs):
+        if any(later[: len(keys[i])] == keys[i] for later in keys[i + 1 :]):
+            # dumped again, with the responses that followed, by a later save
+            continue
+        rows.extend(score_responses(path, responses))
+    return rows
+
+
+def score_responses(path, responses):
+    """Metric time series of a session log: a row per response, holding the
+    metrics after it for the interactions the server folds into them.
+    """
+    rows = []
+    state = None
+    records = []
+    for i, response in enumerate(responses):
+        data = response["input_data"]
+        app_mode = response.get("app_mode") or data.get("appMode")
+        interaction_type = response.get("interaction_type") or data.get("interactionType")
+        row = {
+            "file": str(path),
+            "row": i,
+            "participant_id": response.get("participant_id"),
+            "app_mode": app_mode,
+            "app_type": response.get("app_type"),
+            "app_level": response.get("app_level"),
+            "processed_at": response.get("processed_at"),
+            "interaction_type": interaction_type,
+            "error": None,
+        }
+        rows.append(row)
+        if interaction_type not in bias_state.COMPUTE_BIAS_FOR_TYPES:
+            continue
+        try:
+            if state is None or state.filename != app_mode:
+                state = bias_state.MetricState(app_mode)
+                records = []
+            try:
+                # windows the session asked for, as the server does
+                state = bias_state.apply_window(state, data, records)
+            except ValueError:
+                pass
+            records.append(state.update(data))
+            state.trim(records)
+            metrics = state.metrics("summary")
+        except Exception as e:
+            # the server would have failed this interaction as well
+            row["error"] = f"{type(e).__name__}: {e}"
+            continue
+        for name, (metric, _) in metrics.items():
+            if isinstance(metric, dict):
+                for attr, value in metric.items():
+                    row[f"{name}.{attr}"] = value
+            else:
+                row[name] = metric
+    return rows
+
+
+def rescore(paths, workers=None):
+    """Score the session logs, in a process pool unless `workers` is 1.
+
+    Returns a DataFrame with a row per response, in file order per participant.
+    """
+    # the logs of a participant are in its own directory
+    participants = {}
+    for path in sorted(map(Path, paths)):
+        participants.setdefault(path.parent, []).append(path)
+    groups = list(participants.values())
+    if workers == 1:
+        results = map(score_logs, groups)
+        return _frame(results)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return _frame(pool.map(score_logs, groups))
+
+
+def _frame(results):
+    rows = [row for rows in results for row in rows]
+    metric_columns = list(dict.fromkeys(key for row in rows for key in row if key not in COLUMNS))
+    return pd.DataFrame(rows, columns=COLUMNS + metric_columns)
+
+
+def write(frame, path):
+    """Write the scores as Parquet or CSV, by the extension of `path`."""
+    path = Path(path)
+    if path.parent != Path(""):
+        path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("paths", nargs="*", default=["output"], help="session logs or directories (default: output)")
+    parser.add_argument("--output", default="scores.csv", help="file to write, .parquet or .csv (default: scores.csv)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs, 1 scores inline)")
+    args = parser.parse_args()
+
+    if args.output.endswith(".parquet") and not any(
+        importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet")
+    ):
+        print("Writing Parquet needs pyarrow or fastparquet, install one or write a .csv")
+        sys.exit(1)
+    paths = find_logs(args.paths)
+    if not paths:
+        print("No session logs found")
+        sys.exit(1)
+
+    warnings.simplefilter("ignore")
+    started = time.perf_counter()
+    frame = rescore(paths, args.workers or os.cpu_count())
+    write(frame, args.output)
+    errors = frame["error"].notna().sum()
+    print(
+        f"Scored {len(paths)} session logs, {len(frame)} interactions in "
+        f"{time.perf_counter() - started:.1f} s ({errors} failed), written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
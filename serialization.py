@@ -0,0 +1,150 @@
+"""MessagePack serialization of the interaction events, negotiated per
+socket.
+"""
+import json
+
+import msgpack
+import numpy as np
+
+SERIALIZATIONS = ["json", "msgpack"]
+
+# MessagePack extension types of the packed float arrays:
+#   FLOAT_ARRAY   -- a list of numbers, as little-endian float64 values
+#   FLOAT_MAP     -- a dict of numbers, as a MessagePack array of the keys
+#                    followed by a FLOAT_ARRAY / FLOAT32_ARRAY of the values
+#   FLOAT32_ARRAY -- a list of numbers that are all exact as float32 (counts,
+#                    weights of 1.0, ...), as little-endian float32 values
+FLOAT_ARRAY = 1
+FLOAT_MAP = 2
+FLOAT32_ARRAY = 3
+# lists and dicts shorter than this are left as MessagePack arrays / maps
+MIN_PACKED = 8
+# packed as they are
+_SCALARS = (str, int, float, bool, type(None))
+
+
+class Serializations:
+    """Serialization each socket asked for, "json" unless it negotiated
+    "msgpack" (see SERIALIZATIONS).
+
+    With "msgpack", the data of the socket's interaction events is the
+        MessagePack encoding of what would have been sent as JSON, a binary
+        attachment. Lists and dicts of numbers are packed as float arrays,
+        see encode().
+    """
+
+    def __init__(self):
+        self.formats = {}
+        self.encoded = 0
+        self.decoded = 0
+
+    def negotiate(self, sid, requested):
+        """Set the serialization of a socket to the first of `requested` (names
+        in order of preference) that is supported, "json" if none.
+
+        Returns the serialization picked.
+        """
+        for name in requested:
+            if name in SERIALIZATIONS:
+                break
+        else:
+            name = "json"
+        if name == "json":
+            self.formats.pop(sid, None)
+        else:
+            self.formats[sid] = name
+        return name
+
+    def get(self, sid):
+        return self.formats.get(sid, "json")
+
+    def forget(self, sid):
+        self.formats.pop(sid, None)
+
+    def encode(self, data, serialization):
+        """Get the data of an event in the given serialization."""
+        if serialization != "msgpack":
+            return data
+        self.encoded += 1
+        return encode(data)
+
+    def decode(self, data):
+        """Get the data of a received event, decoded if it is MessagePack."""
+        if not isinstance(data, (bytes, bytearray)):
+            return data
+        self.decoded += 1
+        return decode(data)
+
+
+def encode(data):
+    """Encode JSON-like data as MessagePack.
+
+    Lists of at least MIN_PACKED numbers with at least one float among them,
+        and dicts whose values are such numbers, are packed as FLOAT_ARRAY /
+        FLOAT32_ARRAY and FLOAT_MAP extensions. Dict keys are converted to
+        strings as json does, so the decoded data equals what the JSON
+        serialization would give (up to integers packed among floats, which
+        come back as floats).
+    """
+    return msgpack.packb(_pack(data), use_bin_type=True)
+
+
+def decode(blob):
+    """Decode MessagePack data, unpacking the float array extensions."""
+    return msgpack.unpackb(blob, raw=False, ext_hook=_unpack_ext, strict_map_key=False)
+
+
+def _pack(obj):
+    if type(obj) in _SCALARS:
+        return obj
+    if isinstance(obj, dict):
+        keys = [key if isinstance(key, str) else json.dumps(key) for key in obj]
+        values = list(obj.values())
+        floats = _float_array(values)
+        if floats is not None:
+            return msgpack.ExtType(FLOAT_MAP, msgpack.packb([keys, floats]))
+        return {key: value if type(value) in _SCALARS else _pack(value) for key, value in zip(keys, values)}
+    if isinstance(obj, (list, tuple)):
+        floats = _float_array(obj)
+        if floats is not None:
+            return floats
+        return [value if type(value) in _SCALARS else _pack(value) for value in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _float_array(values):
+    """Get a list of numbers with a float among them as a FLOAT_ARRAY or
+    FLOAT32_ARRAY extension, None for anything else.
+    """
+    if len(values) < MIN_PACKED or not isinstance(values[0], (float, int, np.number)):
+        return None
+    try:
+        array = np.array(values)
+    except ValueError:
+        # lists of different lengths
+        return None
+    if array.ndim != 1 or array.dtype != np.float64:
+        return None
+    types = set(map(type, values))
+    if bool in types:
+        return None
+    if int in types and np.abs(array).max() > 2**53:
+        # not exact as a float64
+        return None
+    single = array.astype("<f4")
+    if (single == array).all():
+        return msgpack.ExtType(FLOAT32_ARRAY, single.tobytes())
+    return msgpack.ExtType(FLOAT_ARRAY, array.astype("<f8", copy=False).tobytes())
+
+
+def _unpack_ext(code, data):
+    if code == FLOAT_ARRAY:
+        return np.frombuffer(data, dtype="<f8").tolist()
+    if code == FLOAT32_ARRAY:
+        return np.frombuffer(data, dtype="<f4").astype(np.float64).tolist()
+    if code == FLOAT_MAP:
+        keys, values = decode(data)
+        return dict(zip(keys, values))
+    return msgpack.ExtType(code, data)
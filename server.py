@@ -1,8 +1,12 @@
 """Server for interfacing with the frontend.
 """
+import asyncio
+import logging
 import os
+import time
 from pathlib import Path
 from datetime import datetime
+from urllib.parse import parse_qs
 
 import pandas as pd
 import socketio
@@ -12,27 +16,439 @@ from firebase_config import db  # Import the Firestore client
 from firebase_admin import credentials, firestore
 
 import bias
+import bias_state
 import bias_util
+import distribution_payload
+import firestore_queue
+import instrumentation
+import log_observers
+import metric_executor
+import metric_scheduler
+import participant_store
+import serialization
+import session_log
+import session_wal
 
 # Set the path for the Google Cloud Logging logger
 currdir = Path(__file__).parent.absolute()
 
-CLIENTS = {}  # entire data map of all client data
+# Per-event logging is only printed with LOG_LEVEL=DEBUG
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+logger = logging.getLogger("server")
+if LOG_LEVEL != "DEBUG":
+    # python-socketio, python-engineio and aiohttp log every packet and
+    #   request at INFO, and only quiet themselves when logging is not
+    #   configured yet
+    for name in ("socketio", "engineio", "aiohttp.access"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+# entire data map of all client data, idle sessions are spilled to disk
+#   (see participant_store) and loaded back when used again
+CLIENTS = participant_store.from_env()
 CLIENT_PARTICIPANT_ID_SOCKET_ID_MAPPING = {}
 CLIENT_SOCKET_ID_PARTICIPANT_MAPPING = {}
-COMPUTE_BIAS_FOR_TYPES = [
-    "mouseout_item",
-    "mouseout_group",
-    "click_group",
-    "click_add_item",
-    "click_remove_item",
-    "mouseover_item",  # Added for hover interactions
-]
-
-SIO = socketio.AsyncServer(cors_allowed_origins='*')
+# Detail level of metric payloads unless the interaction asks for another
+#   one via "detailLevel", see bias_state.DETAIL_LEVELS; the frontend in
+#   public/ reads the per data point details of every payload, so the
+#   slimmer levels are for clients that merge them
+DEFAULT_DETAIL_LEVEL = os.environ.get("METRICS_DETAIL_LEVEL", "full")
+
+SIO = socketio.AsyncServer(
+    cors_allowed_origins='*',
+    logger=LOG_LEVEL == "DEBUG",
+    engineio_logger=LOG_LEVEL == "DEBUG",
+)
 APP = web.Application(middlewares=[IndexMiddleware()])
 SIO.attach(APP)
 
+# Responses are streamed to output/<app_type>/<pid>/logs_<pid>_<time>.tsv
+#   (or .ndjson, see SESSION_LOG_FORMAT) by a background writer
+LOG_WRITER = session_log.LogWriter()
+SESSION_LOG_FORMAT = os.environ.get("SESSION_LOG_FORMAT", "tsv")
+
+# Sockets that connected with ?serialization=msgpack send and receive the
+#   data of their interaction events as MessagePack, see serialization
+SERIALIZATIONS = serialization.Serializations()
+
+# Only observers (ADMIN clients, or sockets that subscribed) receive the
+#   "log" stream of other participants' responses
+LOG_OBSERVERS = log_observers.LogObservers(SIO, SERIALIZATIONS)
+
+# Bias-relevant events of every session are logged, and the sessions
+#   snapshotted now and then, so they survive a restart of the server (see
+#   session_wal); None if SESSION_WAL_DIR is empty
+SESSION_WAL = session_wal.from_env()
+# the fields of a session kept in its snapshots, the others are rebuilt,
+#   see session_snapshot
+SNAPSHOT_KEYS = ["participant_id", "app_mode", "app_type", "app_level", "connected_at", "bias_state"]
+# recoveries in progress by participant id, interactions arriving meanwhile
+#   wait for the same one
+RECOVERIES = {}
+
+# The "attribute_distribution" message is serialized once per dataset
+#   version and set of datasets asked for
+DISTRIBUTIONS = distribution_payload.DistributionPayloads(SIO, bias.DATA_MAP)
+
+# Firestore writes are queued and flushed in batches by a background task
+FIRESTORE_QUEUE = firestore_queue.WriteBehindQueue(firestore_queue.FirestoreSink(db))
+
+# Bias metrics are computed in a worker pool, see METRICS_EXECUTOR, and at
+#   most once per participant per METRICS_WINDOW_MS
+METRIC_EXECUTOR = metric_executor.from_env()
+METRIC_SCHEDULER = metric_scheduler.from_env(METRIC_EXECUTOR)
+
+
+def open_session_log(pid, app_type):
+    """Start a new log file for the participant's session."""
+    extension = "ndjson" if SESSION_LOG_FORMAT == "ndjson" else "tsv"
+    path = f"output/{app_type}/{pid}/logs_{pid}_{bias_util.get_current_time()}.{extension}"
+    return session_log.SessionLog(LOG_WRITER, path, SESSION_LOG_FORMAT)
+
+
+def new_session(pid, app_mode, app_type, app_level, connected_at):
+    """Create the fields of a session that its snapshots keep."""
+    return {
+        "participant_id": pid,
+        "app_mode": app_mode,
+        "app_type": app_type,
+        "app_level": app_level,
+        "connected_at": connected_at,
+        "bias_logs": [],
+        # created by the first interaction metrics are computed for, other
+        #   interaction types do not need the dataset
+        "bias_state": None,
+    }
+
+
+def log_session_start(pid, client):
+    if SESSION_WAL is not None:
+        # nothing before the start needs to be replayed
+        SESSION_WAL.restart(pid)
+        record = {key: client[key] for key in ("app_mode", "app_type", "app_level", "connected_at")}
+        SESSION_WAL.append(pid, dict(record, type="start"))
+
+
+def fold_bias_log(client, data):
+    """Fold an interaction log into the session's metric state.
+
+    Returns the LogRecord of the log.
+    """
+    state = client["bias_state"]
+    if state is None:
+        state = client["bias_state"] = bias_state.MetricState(client["app_mode"])
+    try:
+        # the session so far, limited to the window the interaction asks for
+        state = client["bias_state"] = bias_state.apply_window(state, data, client["bias_logs"])
+    except ValueError as e:
+        logger.debug("Ignoring metricsWindow: %s", e)
+    # the session keeps a compact record, the payload is in the session log,
+    #   and only as many records as a window needs
+    record = state.update(data)
+    client["bias_logs"].append(record)
+    state.trim(client["bias_logs"])
+    detail_level = data.get("detailLevel", DEFAULT_DETAIL_LEVEL)
+    if detail_level in bias_state.DETAIL_LEVELS:
+        state.detail_level = detail_level
+    return record
+
+
+def session_snapshot(client):
+    """Get what a snapshot of the session keeps: SNAPSHOT_KEYS, and the
+    session's records only while its metrics are limited to a window, which
+    bounds them (see MetricState.trim).
+
+    Over the whole session, the metric state holds what its records add up
+        to; a window asked for after a recovery then reaches back to the
+        snapshot only.
+    """
+    snapshot = {key: client[key] for key in SNAPSHOT_KEYS}
+    state = client["bias_state"]
+    if state is not None and state.window is not None:
+        snapshot["bias_logs"] = client["bias_logs"]
+    return snapshot
+
+
+async def recover_session(pid):
+    """Rebuild the session of a participant from its latest snapshot and
+    the events logged after it, None if nothing was logged.
+
+    Concurrent calls for the same participant share one recovery, so they
+        all get the same session, which replayed every event once.
+    """
+    if SESSION_WAL is None or not SESSION_WAL.exists(pid):
+        return None
+    task = RECOVERIES.get(pid)
+    if task is None:
+        task = RECOVERIES[pid] = asyncio.ensure_future(_recover_session(pid))
+        task.add_done_callback(lambda _: RECOVERIES.pop(pid, None))
+    return await asyncio.shield(task)
+
+
+async def _recover_session(pid):
+    started = time.perf_counter()
+    try:
+        client, records = await SESSION_WAL.recover(pid)
+    except Exception as e:
+        print(f"Could not recover the session of participant {pid}: {e}")
+        return None
+    if client is not None:
+        # see session_snapshot
+        client.setdefault("bias_logs", [])
+    failed = 0
+    for record in records:
+        if record["type"] == "start":
+            client = new_session(
+                pid, record["app_mode"], record["app_type"], record["app_level"], record["connected_at"]
+            )
+        elif client is not None:
+            try:
+                fold_bias_log(client, record["log"])
+            except Exception:
+                # e.g. the dataset changed since
+                failed += 1
+    if client is None:
+        return None
+    print(
+        f"Recovered participant {pid}: {len(records)} events replayed ({failed} failed) "
+        f"in {(time.perf_counter() - started) * 1e3:.0f} ms"
+    )
+    return client
+
+
+def attach_socket(client, sid):
+    """Make `sid` the socket the session's responses go to.
+
+    A new socket (the page was reloaded, or the connection dropped) has none
+        of the samples sent to the previous one, so the next "deltas" payload
+        carries every sample again.
+    """
+    if client.get("id") == sid:
+        return
+    client["id"] = sid
+    if client["bias_state"] is not None:
+        client["bias_state"].sent_cursor = 0
+
+
+def session_busy(pid, client):
+    # an interaction is still being processed
+    return client["session_log"].in_flight > 0
+
+
+def spill_session(pid, client):
+    # release everything but the pickled session itself, socket mappings
+    #   are dropped on disconnect
+    client["session_log"].writer.close(client["session_log"].path)
+    METRIC_SCHEDULER.forget(pid)
+    if SESSION_WAL is not None:
+        SESSION_WAL.close(pid)
+
+
+def load_session(pid, client):
+    # appends to the same log file
+    client["session_log"].writer = LOG_WRITER
+
+
+def spilled_session_stale(pid, spilled_at):
+    # events were logged after the session was spilled, before a restart;
+    #   it is recovered from the write-ahead log instead
+    return SESSION_WAL is not None and SESSION_WAL.modified_at(pid) > spilled_at
+
+
+CLIENTS.is_busy = session_busy
+CLIENTS.on_spill = spill_session
+CLIENTS.on_load = load_session
+CLIENTS.is_stale = spilled_session_stale
+
+# Served at /metrics in the Prometheus text format
+METRICS = instrumentation.Registry()
+STAGE_SECONDS = METRICS.add(
+    instrumentation.Histogram(
+        "interaction_stage_seconds", "Time spent in each stage of on_interaction.", label="stage"
+    )
+)
+BIAS_METRIC_SECONDS = METRICS.add(
+    instrumentation.Histogram(
+        "bias_metric_seconds", "Time spent computing each bias metric.", label="metric"
+    )
+)
+LOOP_LAG_SECONDS = METRICS.add(
+    instrumentation.Histogram("event_loop_lag_seconds", "Delay of event loop wake-ups.")
+)
+LOOP_LAG = instrumentation.LoopLagMonitor(LOOP_LAG_SECONDS)
+METRIC_EXECUTOR.observe = BIAS_METRIC_SECONDS.observe
+METRICS.add(
+    instrumentation.Sampled(
+        "queue_depth",
+        "Items waiting in the background queues.",
+        lambda: {
+            "firestore": FIRESTORE_QUEUE.qsize(),
+            "session_log": LOG_WRITER.qsize(),
+            "metric_executor": METRIC_EXECUTOR.pending(),
+        },
+        label="queue",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "participants",
+        "Participant sessions by state.",
+        lambda: {
+            "connected": len(CLIENT_PARTICIPANT_ID_SOCKET_ID_MAPPING),
+            "resident": len(CLIENTS),
+            "spilled": CLIENTS.num_spilled(),
+        },
+        label="state",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "datasets",
+        "Datasets declared in the manifest, loaded so far, and versions kept after a reload.",
+        lambda: {
+            "declared": len(bias.DATA_MAP),
+            "loaded": bias.DATA_MAP.num_loaded(),
+            "superseded": bias.DATA_MAP.num_superseded(),
+        },
+        label="state",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "dataset_reloads_total",
+        "Datasets reloaded because their file or manifest entry changed.",
+        lambda: bias.DATA_MAP.reloads,
+        kind="counter",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "attribute_distribution_packets_total",
+        "Attribute distribution messages encoded, or sent from the cache.",
+        lambda: {"built": DISTRIBUTIONS.built, "cached": DISTRIBUTIONS.cached},
+        kind="counter",
+        label="result",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "bias_computations_total",
+        "Metric computations run, or skipped because a newer interaction superseded them.",
+        lambda: {"computed": METRIC_SCHEDULER.computed, "skipped": METRIC_SCHEDULER.skipped},
+        kind="counter",
+        label="result",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "session_wal_total",
+        "Events appended to the session write-ahead log, snapshots taken and sessions recovered.",
+        lambda: {
+            "appended": SESSION_WAL.appended,
+            "snapshots": SESSION_WAL.snapshots,
+            "recovered": SESSION_WAL.recovered,
+        }
+        if SESSION_WAL is not None
+        else {},
+        kind="counter",
+        label="event",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "msgpack_events_total",
+        "Interaction events encoded to, or decoded from, MessagePack.",
+        lambda: {"encoded": SERIALIZATIONS.encoded, "decoded": SERIALIZATIONS.decoded},
+        kind="counter",
+        label="direction",
+    )
+)
+METRICS.add(
+    instrumentation.Sampled(
+        "firestore_documents_total",
+        "Documents written to or dropped by the Firestore queue.",
+        lambda: {"written": FIRESTORE_QUEUE.written, "dropped": FIRESTORE_QUEUE.dropped},
+        kind="counter",
+        label="result",
+    )
+)
+
+
+async def start_log_writer(app):
+    LOG_WRITER.start()
+
+
+async def stop_log_writer(app):
+    for client in CLIENTS.values():
+        client["session_log"].close(force=True)
+    await asyncio.get_event_loop().run_in_executor(None, LOG_WRITER.stop)
+
+
+async def start_firestore_queue(app):
+    FIRESTORE_QUEUE.start()
+
+
+async def stop_firestore_queue(app):
+    await FIRESTORE_QUEUE.stop()
+
+
+async def start_participant_store(app):
+    CLIENTS.start()
+
+
+async def stop_participant_store(app):
+    await CLIENTS.stop()
+
+
+async def start_loop_lag_monitor(app):
+    LOOP_LAG.start()
+
+
+async def stop_loop_lag_monitor(app):
+    await LOOP_LAG.stop()
+
+
+async def start_dataset_registry(app):
+    bias.DATA_MAP.start()
+
+
+async def stop_dataset_registry(app):
+    await bias.DATA_MAP.stop()
+
+
+async def start_session_wal(app):
+    if SESSION_WAL is not None:
+        SESSION_WAL.start()
+
+
+async def stop_session_wal(app):
+    if SESSION_WAL is not None:
+        await SESSION_WAL.stop()
+
+
+async def start_metric_executor(app):
+    METRIC_EXECUTOR.start()
+
+
+async def stop_metric_executor(app):
+    await METRIC_EXECUTOR.stop()
+
+
+APP.on_startup.append(start_dataset_registry)
+APP.on_startup.append(start_log_writer)
+APP.on_startup.append(start_session_wal)
+APP.on_startup.append(start_firestore_queue)
+APP.on_startup.append(start_metric_executor)
+APP.on_startup.append(start_participant_store)
+APP.on_startup.append(start_loop_lag_monitor)
+APP.on_shutdown.append(stop_loop_lag_monitor)
+APP.on_shutdown.append(stop_participant_store)
+APP.on_shutdown.append(stop_firestore_queue)
+APP.on_shutdown.append(stop_metric_executor)
+APP.on_shutdown.append(stop_log_writer)
+APP.on_shutdown.append(stop_session_wal)
+APP.on_shutdown.append(stop_dataset_registry)
+
 async def handle_ui_files(request):
     # Extract the requested file name
     fname = request.match_info.get('fname', 'index.html')
@@ -55,35 +471,102 @@ async def handle_ui_files(request):
 # Static file serving
 APP.router.add_static('/static/', path=str(os.path.join(os.path.dirname(__file__), 'public')), name='static')
 
+async def handle_metrics(request):
+    return web.Response(body=METRICS.render().encode("utf-8"), headers={"Content-Type": instrumentation.CONTENT_TYPE})
+
+APP.router.add_get('/metrics', handle_metrics)
+
 # Dynamic routing for all paths, similar to Flask's catch-all routes
 APP.router.add_route('GET', '/{fname:.*}', handle_ui_files)
 
 @SIO.event
 async def connect(sid, environ):
     print(f"Connected: {sid}")
-    attr_dist = {}
-    for filename in bias.DATA_MAP:
-        dataset = bias.DATA_MAP[filename]
-        attr_dist[filename] = dataset["distribution"]
-    await SIO.emit("attribute_distribution", attr_dist, room=sid)
+    # the frontend looks its dataset up in this payload; a client may ask
+    #   for some datasets only with ?datasets=a.csv,b.csv (none if empty) and
+    #   for a compressed payload with &compression=deflate
+    query = parse_qs(environ.get("QUERY_STRING", ""), keep_blank_values=True)
+    if "serialization" in query:
+        # in order of preference, e.g. ?serialization=msgpack,json
+        SERIALIZATIONS.negotiate(sid, [name for value in query["serialization"] for name in value.split(",")])
+    names = None
+    if "datasets" in query:
+        names = [name for value in query["datasets"] for name in value.split(",") if name]
+        if not names:
+            return
+    compression = query.get("compression", [None])[0]
+    if compression not in distribution_payload.COMPRESSIONS:
+        compression = None
+    await DISTRIBUTIONS.send(sid, names, compression)
+
+
+@SIO.event
+async def on_attribute_distribution(sid, data=None):
+    """Send the "attribute_distribution" message again, for the datasets
+    listed in "datasets" (all by default), compressed if "compression" is
+    "deflate".
+    """
+    data = data or {}
+    compression = data.get("compression")
+    if compression not in distribution_payload.COMPRESSIONS:
+        compression = None
+    await DISTRIBUTIONS.send(sid, data.get("datasets"), compression)
 
 
 @SIO.event
 def disconnect(sid):
+    SERIALIZATIONS.forget(sid)
+    LOG_OBSERVERS.unsubscribe(sid)
     if sid in CLIENT_SOCKET_ID_PARTICIPANT_MAPPING:
-        pid = CLIENT_SOCKET_ID_PARTICIPANT_MAPPING[sid]
-        if pid in CLIENTS:
-            CLIENTS[pid]["disconnected_at"] = bias_util.get_current_time()
-            print(f"Disconnected: Participant ID: {pid} | Socket ID: {sid}")
+        pid = CLIENT_SOCKET_ID_PARTICIPANT_MAPPING.pop(sid)
+        if CLIENT_PARTICIPANT_ID_SOCKET_ID_MAPPING.get(pid) == sid:
+            # not reconnected on another socket yet
+            del CLIENT_PARTICIPANT_ID_SOCKET_ID_MAPPING[pid]
+            if CLIENTS.is_resident(pid):
+                CLIENTS[pid]["disconnected_at"] = bias_util.get_current_time()
+                CLIENTS.disconnected(pid)
+        print(f"Disconnected: Participant ID: {pid} | Socket ID: {sid}")
+
+
+@SIO.event
+async def on_memory_usage(sid, data=None):
+    """Report the estimated memory used by each participant session."""
+    usage = CLIENTS.memory_usage()
+    await SIO.emit(
+        "memory_usage",
+        {"sessions": usage, "resident_bytes": CLIENTS.resident_bytes(), "max_bytes": CLIENTS.max_bytes},
+        room=sid,
+    )
+
+
+@SIO.event
+async def on_observe_logs(sid, data):
+    """Subscribe to the "log" stream, optionally filtered by participant,
+    app type and dataset.
+    """
+    data = data or {}
+    LOG_OBSERVERS.subscribe(
+        sid,
+        participant_ids=data.get("participantIds"),
+        app_types=data.get("appTypes"),
+        datasets=data.get("datasets"),
+    )
+    print(f"Observing logs: {sid} | filter: {data}")
+
+
+@SIO.event
+async def on_unobserve_logs(sid, data=None):
+    LOG_OBSERVERS.unsubscribe(sid)
 
 
 @SIO.event
 async def on_session_end_page_level_logs(sid, payload):
     pid = payload["participantId"]
-    if pid in CLIENTS and "data" in payload:
-        dirname = f"output/{CLIENTS[pid]['app_type']}/{pid}"
+    client = await CLIENTS.load(pid)
+    if client is not None and "data" in payload:
+        dirname = f"output/{client['app_type']}/{pid}"
         Path(dirname).mkdir(exist_ok=True) 
-        filename = f"output/{CLIENTS[pid]['app_type']}/{pid}/session_end_page_logs_{pid}_{bias_util.get_current_time()}.tsv"
+        filename = f"output/{client['app_type']}/{pid}/session_end_page_logs_{pid}_{bias_util.get_current_time()}.tsv"
         df_to_save = pd.DataFrame(payload["data"])
 
         # persist to disk
@@ -96,21 +579,17 @@ async def on_session_end_page_level_logs(sid, payload):
 async def on_save_logs(sid, data):
     if sid in CLIENT_SOCKET_ID_PARTICIPANT_MAPPING:
         pid = CLIENT_SOCKET_ID_PARTICIPANT_MAPPING[sid]
-        if pid in CLIENTS:
-            dirname = f"output/{CLIENTS[pid]['app_type']}/{pid}"
-            Path(dirname).mkdir(exist_ok=True)
-            filename = f"output/{CLIENTS[pid]['app_type']}/{pid}/logs_{pid}_{bias_util.get_current_time()}.tsv"
-            df_to_save = pd.DataFrame(CLIENTS[pid]["response_list"])
-
-            # persist to disk
-            df_to_save.to_csv(filename, sep="\t")
+        client = await CLIENTS.load(pid)
+        if client is not None:
+            # responses are already streamed to the session log, just flush it
+            client["session_log"].flush()
 
-            print(f"Saved logs to file: {filename}")
+            print(f"Saved logs to file: {client['session_log'].path}")
 
 @SIO.event
 async def on_insight(sid, data):
     """Handle user insights from the frontend"""
-    print(f"[DEBUG] on_insight received: {data}")
+    logger.debug("on_insight received: %s", data)
     
     # Check if this is a special operation (delete, edit) or regular insight
     operation_type = data.get("type", "create")
@@ -132,15 +611,15 @@ async def on_insight(sid, data):
         }
         
         try:
-            # Store in Firestore
-            db.collection('insights').add(insight)
-            print(f"[DEBUG] Stored insight in Firestore: {insight}")
+            # Queue for Firestore
+            await FIRESTORE_QUEUE.put('insights', insight)
+            logger.debug("Queued insight for Firestore: %s", insight)
             
             # Send confirmation back to client
             await SIO.emit("insight_saved", {"status": "success", "insight": insight}, room=sid)
             
         except Exception as e:
-            print(f"[DEBUG] Error storing insight: {e}")
+            logger.error("Error storing insight: %s", e)
             await SIO.emit("insight_saved", {"status": "error", "message": str(e)}, room=sid)
     
     elif operation_type == "delete_insight":
@@ -157,12 +636,12 @@ async def on_insight(sid, data):
         }
         
         try:
-            # Store deletion record in Firestore
-            db.collection('insight_operations').add(deletion_record)
-            print(f"[DEBUG] Stored insight deletion in Firestore: {deletion_record}")
+            # Queue deletion record for Firestore
+            await FIRESTORE_QUEUE.put('insight_operations', deletion_record)
+            logger.debug("Queued insight deletion for Firestore: %s", deletion_record)
             
         except Exception as e:
-            print(f"[DEBUG] Error storing insight deletion: {e}")
+            logger.error("Error storing insight deletion: %s", e)
     
     elif operation_type == "edit_insight":
         # Handle insight editing
@@ -182,50 +661,65 @@ async def on_insight(sid, data):
         }
         
         try:
-            # Store edit record in Firestore
-            db.collection('insight_operations').add(edit_record)
-            print(f"[DEBUG] Stored insight edit in Firestore: {edit_record}")
+            # Queue edit record for Firestore
+            await FIRESTORE_QUEUE.put('insight_operations', edit_record)
+            logger.debug("Queued insight edit for Firestore: %s", edit_record)
             
         except Exception as e:
-            print(f"[DEBUG] Error storing insight edit: {e}")
+            logger.error("Error storing insight edit: %s", e)
     
     else:
-        print(f"[DEBUG] Unknown insight operation type: {operation_type}")
+        logger.warning("Unknown insight operation type: %s", operation_type)
         await SIO.emit("insight_saved", {"status": "error", "message": f"Unknown operation type: {operation_type}"}, room=sid)
 
 @SIO.event
 async def on_interaction(sid, data):
+    started = time.perf_counter()
+    # MessagePack from sockets that negotiated it, see serialization
+    data = SERIALIZATIONS.decode(data)
     app_mode = data["appMode"]  # The dataset that is being used, e.g. cars.csv
     app_type = data["appType"]  # CONTROL / AWARENESS / ADMIN
     app_level = data["appLevel"]  # live / practice
     pid = data["participantId"]
     interaction_type = data["interactionType"] # Interaction type - eg. hover, click
+    # load the dataset off the event loop on its first use
+    await bias.DATA_MAP.preload([app_mode])
 
     # Let these get updated everytime an interaction occurs, to handle the
     #   worst case scenario of random restart of the server.
     CLIENT_SOCKET_ID_PARTICIPANT_MAPPING[sid] = pid
     CLIENT_PARTICIPANT_ID_SOCKET_ID_MAPPING[pid] = sid
-
-    if pid not in CLIENTS:
-        # new participant => establish data mapping for them!
-        CLIENTS[pid] = {}
-        CLIENTS[pid]["id"] = sid
-        CLIENTS[pid]["participant_id"] = pid
-        CLIENTS[pid]["app_mode"] = app_mode
-        CLIENTS[pid]["app_type"] = app_type
-        CLIENTS[pid]["app_level"] = app_level
-        CLIENTS[pid]["connected_at"] = bias_util.get_current_time()
-        CLIENTS[pid]["bias_logs"] = []
-        CLIENTS[pid]["response_list"] = []
+    CLIENTS.connected(pid)
+
+    if app_type == "ADMIN" and not LOG_OBSERVERS.is_subscribed(sid):
+        # admins observe every participant unless they set a filter
+        LOG_OBSERVERS.subscribe(sid)
+
+    if await CLIENTS.load(pid) is None:
+        # unknown since the server (re)started => recover the session from
+        #   the write-ahead log, if it has one
+        client = await recover_session(pid)
+        if pid not in CLIENTS:
+            if client is None:
+                # new participant => establish data mapping for them!
+                client = new_session(pid, app_mode, app_type, app_level, bias_util.get_current_time())
+                log_session_start(pid, client)
+            client["session_log"] = open_session_log(pid, client["app_type"])
+            CLIENTS[pid] = client
+    attach_socket(CLIENTS[pid], sid)
 
     if app_mode != CLIENTS[pid]["app_mode"] or app_level != CLIENTS[pid]["app_level"]:
         # datasets have been switched => reset the logs array!
         # OR
         # app_level (e.g. practice > live) is changed but same dataset is in use => reset the logs array!
-        CLIENTS[pid]["app_mode"] = app_mode
-        CLIENTS[pid]["app_level"] = app_level
-        CLIENTS[pid]["bias_logs"] = []
-        CLIENTS[pid]["response_list"] = []
+        CLIENTS[pid].update(
+            new_session(pid, app_mode, CLIENTS[pid]["app_type"], app_level, CLIENTS[pid]["connected_at"])
+        )
+        log_session_start(pid, CLIENTS[pid])
+        # ... and continue in a new log file, the previous one is closed once
+        #   the responses still waiting for their metrics are written
+        CLIENTS[pid]["session_log"].close()
+        CLIENTS[pid]["session_log"] = open_session_log(pid, CLIENTS[pid]["app_type"])
 
     # record response to interaction
     response = {}
@@ -237,14 +731,43 @@ async def on_interaction(sid, data):
     response["processed_at"] = bias_util.get_current_time()
     response["interaction_type"] = interaction_type
     response["input_data"] = data
+    response["output_data"] = None
+
+    # the session log keeps the response, in interaction order, once its
+    #   metrics are filled in below
+    log = CLIENTS[pid]["session_log"]
+    log.reserve(response)
+    STAGE_SECONDS.observe(time.perf_counter() - started, "state_lookup")
 
     # check whether to compute bias metrics or not
-    if interaction_type in COMPUTE_BIAS_FOR_TYPES:
-        CLIENTS[pid]["bias_logs"].append(data)
-        metrics = bias.compute_metrics(app_mode, CLIENTS[pid]["bias_logs"])
-        response["output_data"] = metrics
-    else:
-        response["output_data"] = None
+    superseded = False
+    try:
+        if interaction_type in bias_state.COMPUTE_BIAS_FOR_TYPES:
+            # fold the new log into the running metric state instead of
+            #   replaying the entire session through bias.compute_metrics
+            with STAGE_SECONDS.time("state_update"):
+                record = fold_bias_log(CLIENTS[pid], data)
+            # replaced when the interaction changed the metrics window
+            state = CLIENTS[pid]["bias_state"]
+            if SESSION_WAL is not None:
+                # logged before the response goes out
+                with STAGE_SECONDS.time("wal_append"):
+                    SESSION_WAL.append(pid, {"type": "log", "log": bias_state.compact_log(data, record)})
+                    if SESSION_WAL.needs_snapshot(pid):
+                        SESSION_WAL.snapshot(pid, session_snapshot(CLIENTS[pid]))
+            # computed off the event loop and throttled; None if a newer
+            #   interaction of this participant came in while this one was waiting
+            with STAGE_SECONDS.time("compute_metrics"):
+                metrics = await METRIC_SCHEDULER.submit(pid, state)
+            response["output_data"] = metrics
+            superseded = metrics is None
+            if not superseded:
+                # baselines are sent once on connect, later payloads only carry
+                #   what changed since this one
+                state.mark_sent(metrics)
+    finally:
+        # the response is final now, stream it to the session log
+        log.commit(response)
 
     # Store interaction in Firebase
     try:
@@ -257,30 +780,34 @@ async def on_interaction(sid, data):
             "timestamp": datetime.now().isoformat()
         }
         
-        # Store in Firestore
-        db.collection('interactions').add(simplified_data)
-        print(f"[DEBUG] Stored interaction in Firestore: {simplified_data}")
+        # Queue for Firestore
+        with STAGE_SECONDS.time("firestore_enqueue"):
+            await FIRESTORE_QUEUE.put('interactions', simplified_data)
+        logger.debug("Queued interaction for Firestore: %s", simplified_data)
         
     except Exception as e:
-        print(f"[DEBUG] Error storing interaction in Firebase: {e}")
+        logger.error("Error storing interaction in Firebase: %s", e)
 
-    # save response
-    CLIENTS[pid]["response_list"].append(response)
+    if superseded:
+        # the response to the newer interaction carries the current metrics
+        STAGE_SECONDS.observe(time.perf_counter() - started, "total")
+        return
 
-    await SIO.emit("log", response)  # send this to all
-    await SIO.emit("interaction_response", response, room=sid)
+    with STAGE_SECONDS.time("emit"):
+        await LOG_OBSERVERS.broadcast("log", response)  # send this to observers
+        await SIO.emit("interaction_response", SERIALIZATIONS.encode(response, SERIALIZATIONS.get(sid)), room=sid)
+    STAGE_SECONDS.observe(time.perf_counter() - started, "total")
 
 
 @SIO.event
 async def recieve_interaction(sid, data):
     """Handle interactions from the frontend (correct spelling)"""
-    print(f"[DEBUG] recieve_interaction received: {data}")
+    logger.debug("recieve_interaction received: %s", data)
     
     # Forward to the on_interaction handler
     await on_interaction(sid, data)
 
 
 if __name__ == "__main__":
-    bias.precompute_distributions()
     port = int(os.environ.get("PORT", 3000))
     web.run_app(APP, port=port)
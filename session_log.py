@@ -0,0 +1,185 @@
+"""Append-only, streaming session logs.
+
+Responses are appended to the participant's log file as they happen instead
+of dumping the whole response list on every save.
+"""
+import csv
+import io
+import json
+import os
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+
+LOG_FORMATS = ["tsv", "ndjson"]
+
+_FLUSH = object()
+_CLOSE = object()
+_STOP = object()
+
+
+class LogWriter:
+    """Background thread owning buffered, append-mode log file handles."""
+
+    def __init__(self, buffer_size=64 * 1024):
+        self.buffer_size = buffer_size
+        self._queue = queue.SimpleQueue()
+        self._files = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Flush and close every file, then stop the thread. Blocking."""
+        if self._thread is not None:
+            self._queue.put((_STOP, None, None))
+            self._thread.join()
+            self._thread = None
+
+    def qsize(self):
+        """Number of operations waiting for the writer thread."""
+        return self._queue.qsize()
+
+    def write(self, path, format_row):
+        """Append the text returned by `format_row()` to the file at path.
+
+        format_row is called on the writer thread.
+        """
+        self._queue.put((path, format_row, None))
+
+    def flush(self, path, done=None):
+        """Flush the file at path; `done()` is called on the writer thread after."""
+        self._queue.put((path, _FLUSH, done))
+
+    def close(self, path):
+        self._queue.put((path, _CLOSE, None))
+
+    def _run(self):
+        while True:
+            path, op, done = self._queue.get()
+            try:
+                if path is _STOP:
+                    for f in self._files.values():
+                        f.close()
+                    self._files.clear()
+                    return
+                if op is _FLUSH:
+                    if path in self._files:
+                        self._files[path].flush()
+                elif op is _CLOSE:
+                    f = self._files.pop(path, None)
+                    if f is not None:
+                        f.close()
+                else:
+                    f = self._files.get(path)
+                    if f is None:
+                        Path(path).parent.mkdir(parents=True, exist_ok=True)
+                        f = self._files[path] = open(path, "a", encoding="utf-8", buffering=self.buffer_size)
+                    f.write(op())
+            except Exception as e:
+                print(f"Error writing session log {path}: {e}")
+            if done is not None:
+                done()
+
+
+class SessionLog:
+    """Log file of one participant session, in the layout of
+    pd.DataFrame(response_list).to_csv(filename, sep="\\t") for "tsv", or
+    one JSON object per line for "ndjson".
+
+    Responses are reserved in interaction order and written once committed,
+        so a response that waits for its metrics does not get overtaken by
+        later ones. Closing waits for the responses still reserved as well.
+    """
+
+    def __init__(self, writer, path, log_format="tsv"):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"Unknown session log format: {log_format}")
+        self.writer = writer
+        self.path = path
+        self.log_format = log_format
+        self.num_rows = 0
+        self._columns = None
+        self._pending = deque()
+        self._closing = False
+        self._closed = False
+
+    def __getstate__(self):
+        # the writer is shared, whoever unpickles a SessionLog rebinds it
+        state = self.__dict__.copy()
+        state["writer"] = None
+        return state
+
+    @property
+    def in_flight(self):
+        """Number of reserved responses not written yet."""
+        return len(self._pending)
+
+    def reserve(self, response):
+        """Reserve the next row for a response whose data may still change."""
+        self._pending.append([response, False])
+
+    def commit(self, response):
+        """Mark a reserved response final and write every final row in order."""
+        if self._closed:
+            return
+        for entry in self._pending:
+            if entry[0] is response:
+                entry[1] = True
+                break
+        else:
+            self._pending.append([response, True])
+        while self._pending and self._pending[0][1]:
+            self._write(self._pending.popleft()[0])
+        if self._closing and not self._pending:
+            self._close()
+
+    def flush(self, done=None):
+        self.writer.flush(self.path, done)
+
+    def close(self, force=False):
+        """Close the file once every reserved response is committed and
+        written; with `force` (on shutdown), write the reserved responses as
+        they are and close it right away.
+        """
+        if self._closed:
+            return
+        if force:
+            while self._pending:
+                self._write(self._pending.popleft()[0])
+        if self._pending:
+            self._closing = True
+        else:
+            self._close()
+
+    def _close(self):
+        self._closed = True
+        self.writer.close(self.path)
+
+    def _write(self, response):
+        row = self.num_rows
+        self.num_rows += 1
+        if self.log_format == "ndjson":
+            self.writer.write(self.path, lambda: json.dumps(response, default=str) + "\n")
+            return
+        header = self._columns is None
+        if header:
+            self._columns = list(response)
+        columns = self._columns
+        self.writer.write(self.path, lambda: _tsv_row(row, response, columns, header))
+
+
+def _tsv_row(row, response, columns, header):
+    """Format a row the way pandas' to_csv does: object cells via str(),
+    None as an empty cell, minimal csv quoting.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter="\t", quotechar='"', quoting=csv.QUOTE_MINIMAL, lineterminator=os.linesep)
+    if header:
+        writer.writerow([""] + columns)
+    writer.writerow([row] + ["" if response.get(col) is None else str(response[col]) for col in columns])
+    return buf.getvalue()
@@ -0,0 +1,292 @@
+"""Write-ahead log and snapshots of participant sessions, to recover them
+after a restart.
+"""
+import asyncio
+import json
+import os
+import pickle
+import struct
+import time
+import zlib
+from pathlib import Path
+from urllib.parse import quote
+
+# record header: payload length and CRC-32 of the payload
+_HEADER = struct.Struct("<II")
+
+
+class SessionWAL:
+    """Append-only log of the events of each participant session, plus
+    periodic snapshots of the session, below `directory`/<participant id>/.
+
+    Records are JSON-encodable dicts appended to numbered segment files
+        (wal.<n>) with their length and checksum, so a record torn by a crash
+        is recognized and dropped. A snapshot (snapshot.<n>) holds the state
+        after every segment numbered below n, so recovery loads the newest
+        snapshot and replays the segments from n on: at most
+        `snapshot_every` records plus what was appended while the snapshot
+        was written, however long the session. Older snapshots are deleted
+        once a newer one is on disk; the segments are kept until the session
+        restart()s, to replay the whole session if the snapshot cannot be
+        loaded any more (e.g. the dataset version it refers to is gone).
+
+    Each process appends to a segment of its own, opened on its first
+        append for the participant, so it never writes after the torn tail of
+        a previous run. Records reach the operating system on append, which
+        survives the server process crashing; every `fsync_interval` seconds
+        (if > 0) they are also synced to disk by a background task.
+    """
+
+    def __init__(self, directory, snapshot_every=500, fsync_interval=1.0):
+        self.directory = Path(directory)
+        self.snapshot_every = snapshot_every
+        self.fsync_interval = fsync_interval
+        self.appended = 0
+        self.snapshots = 0
+        self.recovered = 0
+        self._files = {}  # pid -> file descriptor of the open segment
+        self._segment = {}  # pid -> number of the segment appended to
+        self._pending = {}  # pid -> records since the last snapshot
+        self._unsynced = set()
+        self._writes = set()
+        self._task = None
+
+    # -- writing
+
+    def append(self, pid, record):
+        """Append a record to the participant's log."""
+        fd = self._files.get(pid)
+        if fd is None:
+            fd = self._open(pid)
+        payload = json.dumps(record, separators=(",", ":"), default=str).encode("utf-8")
+        os.write(fd, _HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._unsynced.add(pid)
+        self._pending[pid] = self._pending.get(pid, 0) + 1
+        self.appended += 1
+
+    def needs_snapshot(self, pid):
+        return self._pending.get(pid, 0) >= self.snapshot_every
+
+    def snapshot(self, pid, state):
+        """Snapshot the participant's state, as of every record appended so far.
+
+        The state is pickled right away, so it may change afterwards; it is
+            compressed and written by a background task.
+        """
+        blob = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        number = self._segment[pid] + 1 if pid in self._segment else self._new_segment(pid)
+        # later records go to a new segment, replayed on top of this snapshot
+        self.close(pid)
+        self._segment[pid] = number
+        self._pending[pid] = 0
+        self.snapshots += 1
+        task = asyncio.ensure_future(
+            asyncio.get_event_loop().run_in_executor(None, self._write_snapshot, pid, number, blob)
+        )
+        self._writes.add(task)
+        task.add_done_callback(self._written)
+
+    def restart(self, pid):
+        """Start the participant's log over, for a new session: its earlier
+        segments and snapshots are deleted by a background task.
+        """
+        number = self._segment[pid] + 1 if pid in self._segment else self._new_segment(pid)
+        self.close(pid)
+        self._segment[pid] = number
+        self._pending[pid] = 0
+        task = asyncio.ensure_future(
+            asyncio.get_event_loop().run_in_executor(None, _remove_before, self._path(pid), number, ("wal", "snapshot"))
+        )
+        self._writes.add(task)
+        task.add_done_callback(self._written)
+
+    def close(self, pid):
+        """Close the participant's segment, e.g. when the session is spilled."""
+        fd = self._files.pop(pid, None)
+        if fd is not None:
+            os.close(fd)
+            self._unsynced.discard(pid)
+
+    def _open(self, pid):
+        number = self._segment.get(pid)
+        if number is None:
+            number = self._new_segment(pid)
+        directory = self._path(pid)
+        directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(directory / f"wal.{number}", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._files[pid] = fd
+        self._segment[pid] = number
+        return fd
+
+    def _new_segment(self, pid):
+        # above every segment and snapshot of previous runs
+        numbers = [number for _, number in _listing(self._path(pid))]
+        return max(numbers) + 1 if numbers else 0
+
+    def _write_snapshot(self, pid, number, blob):
+        directory = self._path(pid)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"snapshot.{number}"
+        tmp = directory / f".snapshot.{number}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(blob))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        _remove_before(directory, number, ("snapshot",))
+
+    def _written(self, task):
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # the records it would have superseded are still there
+            print(f"Writing a session snapshot or deleting old ones failed: {task.exception()}")
+
+    # -- recovery
+
+    def exists(self, pid):
+        return self._path(pid).is_dir()
+
+    def modified_at(self, pid):
+        """Time (a time.time()) the participant's log or snapshots last
+        changed, 0 if there are none.
+        """
+        directory = self._path(pid)
+        times = [0]
+        for kind, number in _listing(directory):
+            try:
+                times.append((directory / f"{kind}.{number}").stat().st_mtime)
+            except FileNotFoundError:
+                pass
+        return max(times)
+
+    async def recover(self, pid):
+        """Read the newest snapshot of the participant and the records
+        appended after it, off the event loop.
+
+        Returns (state, records); state is None without a snapshot, or if
+            the snapshot cannot be unpickled, in which case records are those
+            of every segment kept. Records are empty if nothing was logged.
+            Every call unpickles a state of its own.
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, self.read, pid)
+
+    def read(self, pid):
+        """Blocking version of recover()."""
+        directory = self._path(pid)
+        listing = _listing(directory)
+        state = None
+        start = 0
+        snapshots = [n for kind, n in listing if kind == "snapshot"]
+        if snapshots:
+            # written atomically; the older ones lack the records it superseded
+            start = max(snapshots)
+            try:
+                state = pickle.loads(zlib.decompress((directory / f"snapshot.{start}").read_bytes()))
+            except Exception as e:
+                print(f"Could not load the snapshot of participant {pid}, replaying the whole log: {e}")
+                start = 0
+        records = []
+        for number in sorted(n for kind, n in listing if kind == "wal" and n >= start):
+            records.extend(_read_segment(directory / f"wal.{number}"))
+        if pid not in self._files:
+            self._pending[pid] = len(records)
+        self.recovered += 1
+        return state, records
+
+    def _path(self, pid):
+        return self.directory / quote(str(pid), safe="")
+
+    # -- background syncing
+
+    def start(self):
+        """Start syncing appended records to disk on the running event loop."""
+        if self._task is None and self.fsync_interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writes:
+            await asyncio.wait(list(self._writes))
+        for pid in list(self._files):
+            self.close(pid)
+
+    async def sync(self):
+        """Sync the segments appended to since the last call to disk."""
+        fds = [self._files[pid] for pid in self._unsynced if pid in self._files]
+        self._unsynced.clear()
+        if fds:
+            await asyncio.get_event_loop().run_in_executor(None, _fsync_all, fds)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            started = time.monotonic()
+            try:
+                await self.sync()
+            except OSError as e:
+                # a segment closed while syncing, the others are synced next time
+                print(f"Syncing the session logs failed: {e}")
+            if time.monotonic() - started > self.fsync_interval:
+                print("Syncing the session logs takes longer than SESSION_WAL_FSYNC_INTERVAL")
+
+
+def _fsync_all(fds):
+    for fd in fds:
+        os.fsync(fd)
+
+
+def _remove_before(directory, number, kinds):
+    """Delete the files of the given kinds numbered below `number`."""
+    for kind, other in _listing(directory):
+        if kind in kinds and other < number:
+            (directory / f"{kind}.{other}").unlink(missing_ok=True)
+
+
+def _listing(directory):
+    """(kind, number) of the snapshots and segments in a participant's directory."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    listing = []
+    for name in names:
+        kind, _, number = name.partition(".")
+        if kind in ("wal", "snapshot") and number.isdigit():
+            listing.append((kind, int(number)))
+    return listing
+
+
+def _read_segment(path):
+    """Records of a segment, up to the first torn or corrupt one."""
+    data = path.read_bytes()
+    records = []
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        payload = data[offset + _HEADER.size : offset + _HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append(json.loads(payload))
+        offset += _HEADER.size + length
+    return records
+
+
+def from_env():
+    """Create a SessionWAL configured by SESSION_WAL_DIR,
+    SESSION_WAL_SNAPSHOT_EVERY and SESSION_WAL_FSYNC_INTERVAL, or None if
+    SESSION_WAL_DIR is empty.
+    """
+    directory = os.environ.get("SESSION_WAL_DIR", os.path.join("output", ".wal"))
+    if not directory:
+        return None
+    return SessionWAL(
+        directory,
+        snapshot_every=int(os.environ.get("SESSION_WAL_SNAPSHOT_EVERY", 500)),
+        fsync_interval=float(os.environ.get("SESSION_WAL_FSYNC_INTERVAL", 1)),
+    )
@@ -0,0 +1,22 @@
+"""Sending Socket.IO packets encoded ahead of time.
+"""
+from socketio import packet
+
+
+def encode_event(event, data):
+    """Encode an event the way sio.emit(event, data) does: a string, or a
+    list of the packet followed by its binary attachments.
+    """
+    return packet.Packet(packet.EVENT, data=[event, data]).encode()
+
+
+async def send(sio, sid, encoded_packet):
+    """Send a packet made by encode_event() (or encoded like it) to a socket."""
+    if isinstance(encoded_packet, list):
+        # binary attachments follow the packet itself
+        binary = False
+        for ep in encoded_packet:
+            await sio.eio.send(sid, ep, binary=binary)
+            binary = True
+    else:
+        await sio.eio.send(sid, encoded_packet, binary=False)
@@ -0,0 +1,34 @@
+"""Shared fixtures of the tests.
+"""
+import sys
+import types
+import warnings
+from pathlib import Path
+
+import pytest
+
+# the server's modules live at the top of the repository
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import bias  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def datasets():
+    """bias.DATA_MAP, with the attribute distributions computed."""
+    warnings.simplefilter("ignore")
+    bias.precompute_distributions()
+    return bias.DATA_MAP
+
+
+@pytest.fixture(scope="session")
+def server(datasets):
+    """The server module, skipping the test without firebase_admin."""
+    pytest.importorskip("firebase_admin")
+    # as in benchmarks.stub_server, nothing reaches Firestore
+    firebase_config = types.ModuleType("firebase_config")
+    firebase_config.db = None
+    sys.modules.setdefault("firebase_config", firebase_config)
+    import server
+
+    return server
@@ -0,0 +1,107 @@
+"""Parity of the incremental metric state with bias.compute_metrics.
+"""
+import json
+import math
+import numbers
+
+import pytest
+
+import bias
+import bias_state
+from benchmarks.common import make_logs
+
+NUM_LOGS = 40
+
+
+def differences(expected, got, path=""):
+    """Where two metric payloads differ, None if they are the same."""
+    if isinstance(expected, dict) and isinstance(got, dict):
+        if expected.keys() != got.keys():
+            return f"{path}: keys {set(expected) ^ set(got)}"
+        for key in expected:
+            found = differences(expected[key], got[key], f"{path}.{key}")
+            if found:
+                return found
+        return None
+    if isinstance(expected, (list, tuple)) and isinstance(got, (list, tuple)):
+        if len(expected) != len(got):
+            return f"{path}: length {len(expected)} != {len(got)}"
+        for i, (a, b) in enumerate(zip(expected, got)):
+            found = differences(a, b, f"{path}[{i}]")
+            if found:
+                return found
+        return None
+    if isinstance(expected, numbers.Number) and isinstance(got, numbers.Number) and not isinstance(expected, bool):
+        if math.isnan(expected) and math.isnan(got):
+            return None
+        if got == pytest.approx(expected, rel=1e-12, abs=1e-12):
+            return None
+    elif expected == got:
+        return None
+    return f"{path}: {got!r} != {expected!r}"
+
+
+@pytest.mark.parametrize("filename", list(bias.DATA_MAP))
+def test_metrics_match_replay(datasets, filename):
+    """After every interaction, the state's full metrics equal those of
+    replaying the session so far through bias.compute_metrics.
+    """
+    state = bias_state.MetricState(filename)
+    logs = []
+    for log in make_logs(filename, NUM_LOGS, seed=len(filename)):
+        try:
+            state.update(log)
+        except Exception:
+            # aggregates the metrics cannot be computed for, see
+            #   benchmarks.common.scorable_logs
+            continue
+        logs.append(log)
+        found = differences(bias.compute_metrics(filename, logs), state.metrics("full"))
+        assert found is None, f"after {len(logs)} logs{found}"
+
+
+@pytest.mark.parametrize("filename", list(bias.DATA_MAP))
+def test_compact_logs_fold_the_same(datasets, filename):
+    """Compact logs, as the write-ahead log keeps them, fold into the same
+    metrics as the interaction logs they were made from.
+    """
+    state = bias_state.MetricState(filename)
+    replayed = bias_state.MetricState(filename)
+    for log in make_logs(filename, NUM_LOGS * 5, seed=len(filename)):
+        try:
+            record = state.update(log)
+        except Exception:
+            continue
+        # as read back from the write-ahead log
+        replayed.update(json.loads(json.dumps(bias_state.compact_log(log, record))))
+    assert differences(state.metrics("full"), replayed.metrics("full")) is None
+
+
+@pytest.mark.parametrize("window", [("interactions", 15), ("seconds", 40), ("halfLife", 3), ("halfLifeSeconds", 10)])
+@pytest.mark.parametrize("filename", list(bias.DATA_MAP))
+def test_windows_match_their_tail(datasets, filename, window):
+    """A state limited to a window has the full metrics of a fresh state fed
+    only the logs still in the window, however many were folded out.
+    """
+    state = bias_state.metric_state(filename, window)
+    logs, records = [], []
+    for i, log in enumerate(make_logs(filename, NUM_LOGS * 5, seed=len(filename))):
+        # irregular gaps between interactions, up to 5 seconds
+        log = dict(log, interactionAt=1000 * (i * 2.5 + (i * 7919 % 10) / 4))
+        try:
+            records.append(state.update(log))
+        except Exception:
+            continue
+        logs.append(log)
+        if len(logs) % 50:
+            continue
+        got = state.metrics("full")
+        kept = len(state.tail(records))
+        # a window over the whole session with the same weights
+        fresh = bias_state.metric_state(filename, None if window[0] in ("interactions", "seconds") else window)
+        for kept_log in logs[-kept:]:
+            fresh.update(kept_log)
+        found = differences(fresh.metrics("full"), got)
+        assert found is None, f"after {len(logs)} logs, {kept} in the window{found}"
+    # some were folded out
+    assert kept < len(logs)
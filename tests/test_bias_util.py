@@ -0,0 +1,118 @@
+"""bias_util's fast paths against the computations they replaced.
+"""
+import decimal
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from scipy.stats import chisquare
+
+import bias
+import bias_state
+import bias_util
+from benchmarks.common import make_logs, scorable_logs
+
+# every k up to 1000, then the long sessions
+KS = list(range(0, 1001)) + [2000, 5000, 10000, 50000, 100000, 1000000]
+
+
+def exact_markov_expected_value(N, k):
+    """The previous implementation of get_markov_expected_value, in
+    arbitrary precision.
+
+    Its OverflowError fallback never caught decimal.Overflow, which is not a
+        subclass of it; the intended fallback to N is applied here.
+    """
+    try:
+        num = Decimal(N) ** k - Decimal(N - 1) ** k
+        denom = Decimal(N) ** (k - 1)
+        return float(num / denom)
+    except (OverflowError, decimal.Overflow):
+        return float(N)
+
+
+def used_sizes(datasets):
+    """Get every N get_markov_expected_value is called with: the dataset
+    sizes (data point coverage) and the quantile / category counts of every
+    attribute (attribute coverage).
+    """
+    sizes = set()
+    for dataset in datasets.values():
+        sizes.add(len(dataset["data"]))
+        for attr in dataset["attributes"]:
+            sizes.add(len(dataset["index"].quantiles[attr]))
+    return sorted(sizes)
+
+
+def test_markov_expected_value_matches_exact(datasets):
+    """The closed form is within 1e-12 of the exact formula for every N the
+    metrics use.
+    """
+    for N in used_sizes(datasets):
+        for k in KS:
+            exact = exact_markov_expected_value(N, k)
+            assert bias_util.get_markov_expected_value(N, k) == pytest.approx(exact, rel=1e-12, abs=1e-12), (N, k)
+
+
+def ks_samples(filename):
+    """Rows and weights of samples to test the k-s statistic on: none, a
+    single row, and those of a session with aggregates.
+    """
+    state = bias_state.MetricState(filename)
+    for log in scorable_logs(filename, make_logs(filename, 100, seed=3)):
+        state.update(log)
+    session = state._samples()[:2]
+    return [
+        (np.zeros(0, dtype=np.int64), np.zeros(0)),
+        (np.array([0]), np.array([1.0])),
+        (np.array([len(state.index.row_ids) - 1]), np.array([0.25])),
+        (session[0].copy(), session[1].copy()),
+    ]
+
+
+@pytest.mark.parametrize("filename", list(bias.DATA_MAP))
+def test_batched_ks_matches_ks_w2(datasets, filename):
+    """BaselineECDF has the weighted k-s statistic of ks_w2 for every
+    numerical attribute, batched and for one attribute.
+    """
+    dataset = datasets[filename]
+    index = dataset["index"]
+    ks = index.ks
+    for rows, weights in ks_samples(filename):
+        sample = ks.empty_sample()
+        ks.add(sample, rows, weights)
+        batched = ks.statistics(sample).tolist()
+        for attr in ks.attributes:
+            baseline = dataset["distribution"][attr]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                expected = bias_util.ks_w2(baseline, index.columns[attr][rows], [1.0] * len(baseline), weights)
+            assert batched[ks.position[attr]] == pytest.approx(expected, rel=1e-12, abs=1e-12), (attr, len(rows))
+            assert ks.statistic(attr, rows, weights) == pytest.approx(expected, rel=1e-12, abs=1e-12), (attr, len(rows))
+
+
+@pytest.mark.parametrize(
+    "counts",
+    [
+        # some rows visited, with fractional counts of aggregates
+        {0: 1.0, 3: 2.5, 7: 0.5},
+        # every row visited
+        {row: row % 3 + 1.0 for row in range(10)},
+        # no interactions yet
+        {},
+        {0: 0.0, 4: 0.0},
+    ],
+)
+def test_uniform_chisquare_matches_scipy(counts):
+    """uniform_chisquare over the visited rows has the result of
+    scipy.stats.chisquare over every row.
+    """
+    num_rows = 10
+    total = sum(counts.values())
+    dense = np.zeros(num_rows)
+    for row, count in counts.items():
+        dense[row] = count
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected = chisquare(dense, f_exp=np.full(num_rows, total / num_rows))
+    got = bias_util.uniform_chisquare(list(counts.values()), num_rows, total)
+    for a, b in zip(got, expected):
+        assert (np.isnan(a) and np.isnan(b)) or a == pytest.approx(b, rel=1e-12, abs=1e-12)
@@ -0,0 +1,61 @@
+"""Versions of the datasets kept by the registry across reloads.
+"""
+import json
+import os
+import pickle
+
+import pytest
+
+import bias
+import bias_state
+import dataset_registry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    (tmp_path / "a.csv").write_text("id\n1\n")
+    (tmp_path / "datasets.json").write_text(json.dumps({"datasets": {"a": {"file": "a.csv"}}}))
+    return dataset_registry.DatasetRegistry(
+        tmp_path / "datasets.json", lambda path, entry: {"content": open(path).read()}, reload_interval=0
+    )
+
+
+def rewrite(path, content):
+    path.write_text(content)
+    # a new modification time, however coarse the file system's clock
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_superseded_versions_are_kept(registry, tmp_path):
+    first = registry["a"]
+    rewrite(tmp_path / "a.csv", "id\n2\n")
+    assert registry.check() == ["a"]
+    second = registry["a"]
+    assert second["content"] == "id\n2\n"
+    assert registry.get_version("a", first["version"]) is first
+    assert registry.get_version("a", second["version"]) is second
+    assert registry.num_superseded() == 1
+    with pytest.raises(LookupError):
+        registry.get_version("a", "unknown")
+
+
+def test_version_not_checked_yet_is_loaded(registry, tmp_path):
+    first = registry["a"]
+    rewrite(tmp_path / "a.csv", "id\n3\n")
+    version = dataset_registry._content_hash(tmp_path / "a.csv", {"file": "a.csv"})
+    assert registry.get_version("a", version)["content"] == "id\n3\n"
+    assert registry.get_version("a", first["version"]) is first
+
+
+def test_states_pickle_without_looking_at_the_files(datasets, monkeypatch):
+    state = bias_state.MetricState("cars.csv")
+    state.update({"interactionType": "mouseover_item", "data": {"id": next(iter(state.dataset["data"]))}})
+
+    def version(name):
+        raise AssertionError(f"{name} was looked at")
+
+    monkeypatch.setattr(bias.DATA_MAP, "_version", version)
+    copy = pickle.loads(pickle.dumps(state))
+    assert copy.dataset is state.dataset
+    assert copy.metrics("full") == state.metrics("full")
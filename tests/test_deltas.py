@@ -0,0 +1,76 @@
+"""Rebuilding the "full" metrics payload from "deltas" payloads, as a
+receiver merging them does.
+"""
+from benchmarks.common import make_logs, scorable_logs
+
+FILENAME = "cars.csv"
+
+
+def merge(received, metrics):
+    """Merge a "deltas" payload into what a receiver rebuilt so far."""
+    dpc_details = metrics["data_point_coverage"][1]
+    dpd_details = metrics["data_point_distribution"][1]
+    if dpd_details["delta_since"] == 0:
+        # every sample again
+        received.clear()
+    received.setdefault("visited", set()).update(dpc_details["visited_changed"])
+    received.setdefault("counts", {}).update(dpd_details["counts_changed"])
+    for attr, details in metrics["attribute_coverage"][1].items():
+        received.setdefault(("coverage", attr), set()).update(details["coverage_added"])
+    for attr, details in metrics["attribute_distribution"][1].items():
+        received.setdefault(("interaction_distr", attr), []).extend(details["interaction_distr_added"])
+        if "user_distr_weights_added" in details:
+            received.setdefault(("user_distr_weights", attr), []).extend(details["user_distr_weights_added"])
+        if "interaction_distr_dict_changed" in details:
+            received.setdefault(("interaction_distr_dict", attr), {}).update(details["interaction_distr_dict_changed"])
+
+
+def rebuilt(metrics):
+    """Get what merge() rebuilds of a "full" payload."""
+    full = {}
+    full["visited"] = set(metrics["data_point_coverage"][1]["visited"])
+    full["counts"] = {pid: count for pid, count in metrics["data_point_distribution"][1]["counts"].items() if count}
+    for attr, details in metrics["attribute_coverage"][1].items():
+        full[("coverage", attr)] = {q for q, covered in details["coverage"].items() if covered}
+    for attr, details in metrics["attribute_distribution"][1].items():
+        full[("interaction_distr", attr)] = details["interaction_distr"]
+        if "user_distr_weights" in details:
+            full[("user_distr_weights", attr)] = details["user_distr_weights"]
+        if "interaction_distr_dict" in details:
+            full[("interaction_distr_dict", attr)] = details["interaction_distr_dict"]
+    return full
+
+
+def sort_values(values):
+    """Sort categorical values as the "full" payload does."""
+    try:
+        return sorted(float(value) for value in values)
+    except (TypeError, ValueError):
+        return sorted(str(value) for value in values)
+
+
+def test_deltas_rebuild_the_full_payload_across_a_reconnect(server):
+    """A receiver on a new socket gets every sample again, and each one
+    merging the payloads it got has the "full" payload.
+    """
+    client = server.new_session("p1", FILENAME, "AWARENESS", "live", "0")
+    server.attach_socket(client, "sid1")
+    received = {}
+    for i, log in enumerate(scorable_logs(FILENAME, make_logs(FILENAME, 60, seed=2))):
+        if i == 30:
+            # the page was reloaded, the new page starts from nothing
+            server.attach_socket(client, "sid2")
+            received = {}
+        server.fold_bias_log(client, dict(log, detailLevel="deltas"))
+        state = client["bias_state"]
+        metrics = state.metrics()
+        state.mark_sent(metrics)
+        merge(received, metrics)
+
+        full = rebuilt(state.metrics("full"))
+        for key in full:
+            got = received[key]
+            if key[0] == "interaction_distr" and ("user_distr_weights", key[1]) not in full:
+                # categorical values, which the "full" payload sorts
+                got = sort_values(got)
+            assert got == full[key], f"{key} after {i + 1} logs"
@@ -0,0 +1,142 @@
+"""Batching, retries and backpressure of the Firestore write-behind queue.
+"""
+import asyncio
+import threading
+
+import pytest
+
+import firestore_queue
+from firestore_queue import MemorySink, WriteBehindQueue
+
+
+class FailingSink:
+    """Sink whose every write raises."""
+
+    def __init__(self):
+        self.attempts = 0
+
+    def write(self, docs):
+        self.attempts += 1
+        raise RuntimeError("FailingSink: write failure")
+
+
+class BlockingSink(MemorySink):
+    """MemorySink whose writes wait until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, docs):
+        self.release.wait(5)
+        super().write(docs)
+
+
+def run(queue, main):
+    async def started():
+        queue.start()
+        return await main()
+
+    return asyncio.run(started())
+
+
+def test_documents_are_written_in_batches():
+    sink = MemorySink()
+    queue = WriteBehindQueue(sink, batch_size=3, flush_interval=60)
+
+    async def main():
+        for i in range(7):
+            await queue.put("interactions", {"i": i})
+        await queue.stop()
+
+    run(queue, main)
+    assert [len(batch) for batch in sink.batches] == [3, 3, 1]
+    assert sink.collections["interactions"] == [{"i": i} for i in range(7)]
+    assert queue.written == 7
+
+
+def test_batch_size_is_capped():
+    assert WriteBehindQueue(MemorySink(), batch_size=10000).batch_size == firestore_queue.MAX_BATCH_SIZE
+
+
+def test_waiting_documents_are_flushed_after_the_interval():
+    sink = MemorySink()
+    queue = WriteBehindQueue(sink, batch_size=100, flush_interval=0.05)
+
+    async def main():
+        await queue.put("interactions", {"i": 0})
+        await queue.put("interactions", {"i": 1})
+        await asyncio.sleep(0.5)
+        # written before the queue stops
+        batches = list(sink.batches)
+        await queue.stop()
+        return batches
+
+    assert [len(batch) for batch in run(queue, main)] == [2]
+
+
+def test_failed_writes_are_retried():
+    sink = MemorySink()
+    sink.fail_next = 2
+    queue = WriteBehindQueue(sink, max_retries=3, retry_backoff=0)
+
+    async def main():
+        await queue.put("interactions", {"i": 0})
+        await queue.stop()
+
+    run(queue, main)
+    assert sink.collections["interactions"] == [{"i": 0}]
+    assert (queue.written, queue.dropped) == (1, 0)
+
+
+def test_documents_are_dropped_after_the_last_retry(capsys):
+    sink = FailingSink()
+    queue = WriteBehindQueue(sink, batch_size=2, flush_interval=60, max_retries=2, retry_backoff=0)
+
+    async def main():
+        for i in range(3):
+            await queue.put("interactions", {"i": i})
+        await queue.stop()
+
+    run(queue, main)
+    # two batches, each tried once and retried twice
+    assert sink.attempts == 6
+    assert (queue.written, queue.dropped) == (0, 3)
+    assert "dropping them" in capsys.readouterr().out
+
+
+def test_put_waits_while_the_queue_is_full():
+    sink = BlockingSink()
+    queue = WriteBehindQueue(sink, batch_size=1, flush_interval=60, max_size=2)
+
+    async def main():
+        # the first one is being written, the next two fill the queue
+        for i in range(3):
+            await queue.put("interactions", {"i": i})
+            await asyncio.sleep(0.01)
+        assert queue.qsize() == 2
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.put("interactions", {"i": 3}), 0.1)
+        sink.release.set()
+        await asyncio.wait_for(queue.put("interactions", {"i": 3}), 5)
+        await queue.stop()
+
+    run(queue, main)
+    assert sink.collections["interactions"] == [{"i": i} for i in range(4)]
+
+
+def test_stop_flushes_everything_queued():
+    sink = MemorySink()
+    queue = WriteBehindQueue(sink, batch_size=10, flush_interval=60)
+
+    async def main():
+        for i in range(25):
+            await queue.put("interactions", {"i": i})
+        await queue.stop()
+        with pytest.raises(RuntimeError):
+            await queue.put("interactions", {"i": 25})
+
+    run(queue, main)
+    assert sink.collections["interactions"] == [{"i": i} for i in range(25)]
+    assert all(len(batch) <= 10 for batch in sink.batches)
+    assert queue.qsize() == 0
@@ -0,0 +1,69 @@
+"""Filtering and sending the admin "log" stream to its observers.
+"""
+import asyncio
+import types
+
+import serialization
+from log_observers import LogObservers
+
+
+class FakeEngine:
+    """Records the packets sent instead of sending them."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, sid, encoded_packet, binary=False):
+        self.sent.append((sid, encoded_packet, binary))
+
+
+def response(pid, app_type="AWARENESS", app_mode="cars.csv"):
+    return {"participant_id": pid, "app_type": app_type, "app_mode": app_mode, "output_data": None}
+
+
+def receivers(observers, sent, response):
+    sent.clear()
+    asyncio.run(observers.broadcast("log", response))
+    return sorted({sid for sid, _, _ in sent})
+
+
+def test_filters_select_the_observers():
+    sio = types.SimpleNamespace(eio=FakeEngine())
+    observers = LogObservers(sio)
+    observers.subscribe("all")
+    observers.subscribe("p1", participant_ids="p1")
+    observers.subscribe("control", app_types=["CONTROL"])
+    observers.subscribe("cars p2", participant_ids=["p2"], datasets=["cars.csv"])
+    observers.subscribe("empty", participant_ids=[])
+    sent = sio.eio.sent
+
+    assert receivers(observers, sent, response("p1")) == ["all", "empty", "p1"]
+    assert receivers(observers, sent, response("p2")) == ["all", "cars p2", "empty"]
+    assert receivers(observers, sent, response("p2", app_mode="movies.csv")) == ["all", "empty"]
+    assert receivers(observers, sent, response("p3", app_type="CONTROL")) == ["all", "control", "empty"]
+
+    observers.unsubscribe("all")
+    # resubscribing replaces the filter
+    observers.subscribe("p1", participant_ids="p3")
+    assert receivers(observers, sent, response("p1")) == ["empty"]
+    assert receivers(observers, sent, response("p3")) == ["empty", "p1"]
+
+
+def test_response_is_encoded_once_per_serialization():
+    sio = types.SimpleNamespace(eio=FakeEngine())
+    serializations = serialization.Serializations()
+    observers = LogObservers(sio, serializations)
+    for sid in ("json 1", "json 2", "msgpack 1", "msgpack 2"):
+        serializations.negotiate(sid, [sid.split()[0]])
+        observers.subscribe(sid)
+    asyncio.run(observers.broadcast("log", response("p1")))
+
+    assert serializations.encoded == 1
+    packets = {sid: [] for sid in ("json 1", "json 2", "msgpack 1", "msgpack 2")}
+    for sid, encoded_packet, binary in sio.eio.sent:
+        packets[sid].append((encoded_packet, binary))
+    assert packets["json 1"] == packets["json 2"] and len(packets["json 1"]) == 1
+    # the MessagePack data follows the packet as a binary attachment
+    assert packets["msgpack 1"] == packets["msgpack 2"]
+    assert [binary for _, binary in packets["msgpack 1"]] == [False, True]
+    assert serialization.decode(packets["msgpack 1"][1][0]) == response("p1")
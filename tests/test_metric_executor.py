@@ -0,0 +1,60 @@
+"""Computing the metrics of participants in the worker pools.
+"""
+import asyncio
+
+import pytest
+
+import bias_state
+from benchmarks.common import make_logs, scorable_logs
+from metric_executor import MetricExecutor
+
+FILENAME = "cars.csv"
+
+
+def num_logs(metrics):
+    return metrics["data_point_distribution"][1]["total_num_logs"]
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_results_are_delivered_in_order(datasets, mode):
+    """The computations of a participant run one at a time: each result is
+    of the state as it was when its computation started, later than the one
+    before, and the latest state is always computed.
+    """
+    executor = MetricExecutor(mode, max_workers=1)
+    state = bias_state.MetricState(FILENAME)
+    logs = scorable_logs(FILENAME, make_logs(FILENAME, 30, seed=4))
+
+    async def main():
+        executor.start()
+        try:
+            submitted = []
+            for log in logs:
+                state.update(log)
+                submitted.append(asyncio.ensure_future(executor.compute("p1", state)))
+                await asyncio.sleep(0)
+            return await asyncio.gather(*submitted)
+        finally:
+            await executor.stop()
+
+    results = asyncio.run(main())
+    computed = [(i + 1, num_logs(metrics)) for i, metrics in enumerate(results) if metrics is not None]
+    # never older than the state submitted, nor than the previous result
+    assert all(got >= submitted for submitted, got in computed)
+    assert [got for _, got in computed] == sorted(got for _, got in computed)
+    assert computed[-1] == (len(logs), len(logs))
+    assert executor.coalesced == len(logs) - len(computed)
+    assert executor.pending() == 0
+
+
+def test_snapshot_is_left_alone_by_updates(datasets):
+    state = bias_state.metric_state(FILENAME, ("interactions", 10))
+    logs = scorable_logs(FILENAME, make_logs(FILENAME, 40, seed=5))
+    for log in logs[:20]:
+        state.update(log)
+    snapshot = state.snapshot()
+    expected = state.metrics("full")
+    for log in logs[20:]:
+        state.update(log)
+    assert snapshot.dataset is state.dataset
+    assert snapshot.metrics("full") == expected
@@ -0,0 +1,96 @@
+"""Throttling and coalescing of the metric computations of participants.
+"""
+import asyncio
+
+from metric_scheduler import MetricScheduler
+
+
+class EchoExecutor:
+    """Executor whose metrics of a state are the state itself."""
+
+    def __init__(self):
+        self.computed = []
+
+    async def compute(self, key, state):
+        self.computed.append((key, state))
+        await asyncio.sleep(0)
+        return state
+
+
+def test_every_interaction_is_computed_by_default():
+    executor = EchoExecutor()
+    scheduler = MetricScheduler(executor)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit("p1", i) for i in range(5)))
+
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+    assert (scheduler.computed, scheduler.skipped) == (5, 0)
+
+
+def test_first_interaction_is_computed_right_away():
+    scheduler = MetricScheduler(EchoExecutor(), window=60)
+
+    async def main():
+        return await asyncio.wait_for(scheduler.submit("p1", 0), 1)
+
+    assert asyncio.run(main()) == 0
+
+
+def test_interactions_in_the_window_are_coalesced():
+    executor = EchoExecutor()
+    scheduler = MetricScheduler(executor, window=0.1)
+
+    async def main():
+        first = await scheduler.submit("p1", 0)
+        # a burst inside the window, and another participant meanwhile
+        burst = asyncio.gather(*(scheduler.submit("p1", i) for i in range(1, 5)))
+        other = await scheduler.submit("p2", 0)
+        return first, await burst, other
+
+    first, burst, other = asyncio.run(main())
+    assert first == 0 and other == 0
+    # only the latest of the burst is computed, at the end of the window
+    assert burst == [None, None, None, 4]
+    assert executor.computed == [("p1", 0), ("p2", 0), ("p1", 4)]
+    assert (scheduler.computed, scheduler.skipped) == (3, 3)
+
+
+def test_every_n_interactions_are_computed():
+    executor = EchoExecutor()
+    scheduler = MetricScheduler(executor, window=60, every_n=2)
+
+    async def main():
+        await scheduler.submit("p1", 0)
+        return await asyncio.wait_for(asyncio.gather(scheduler.submit("p1", 1), scheduler.submit("p1", 2)), 1)
+
+    assert asyncio.run(main()) == [None, 2]
+    assert executor.computed == [("p1", 0), ("p1", 2)]
+
+
+def test_forget_resolves_the_waiting_interaction():
+    executor = EchoExecutor()
+    scheduler = MetricScheduler(executor, window=60)
+
+    async def main():
+        await scheduler.submit("p1", 0)
+        waiting = asyncio.ensure_future(scheduler.submit("p1", 1))
+        await asyncio.sleep(0)
+        scheduler.forget("p1")
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(main()) is None
+    assert executor.computed == [("p1", 0)]
+    assert scheduler._slots == {}
+
+
+def test_slots_are_dropped_after_the_window():
+    scheduler = MetricScheduler(EchoExecutor(), window=0.05)
+
+    async def main():
+        await asyncio.gather(*(scheduler.submit(f"p{i}", i) for i in range(3)))
+        await scheduler.submit("p0", 1)
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert scheduler._slots == {}
@@ -0,0 +1,62 @@
+"""Spilling participant sessions to disk and loading them back.
+"""
+import asyncio
+import zlib
+
+from participant_store import ParticipantStore
+
+
+def spill(store, pid):
+    store._spill(pid, store._sessions[pid])
+    asyncio.run(store._write_spilled([pid]))
+
+
+def test_spilled_session_is_loaded_back(tmp_path):
+    store = ParticipantStore(tmp_path)
+    store["p1"] = {"n": 1}
+    spill(store, "p1")
+    # only load() brings it back
+    assert "p1" not in store and store.is_spilled("p1")
+    assert asyncio.run(store.load("p2")) is None
+    assert asyncio.run(store.load("p1")) == {"n": 1}
+    assert store.is_resident("p1") and not store.is_spilled("p1")
+    assert store["p1"] == {"n": 1}
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_concurrent_loads_share_one(tmp_path):
+    loaded = []
+    store = ParticipantStore(tmp_path, on_load=lambda pid, session: loaded.append(pid))
+    store["p1"] = {"n": 1}
+    spill(store, "p1")
+
+    async def main():
+        return await asyncio.gather(store.load("p1"), store.load("p1"))
+
+    first, second = asyncio.run(main())
+    assert first is second
+    assert loaded == ["p1"]
+
+
+def test_corrupt_spilled_session_is_missing_and_kept(tmp_path):
+    store = ParticipantStore(tmp_path)
+    store["p1"] = {"n": 1}
+    spill(store, "p1")
+    (tmp_path / "p1.pickle.z").write_bytes(zlib.compress(b"garbage"))
+    assert asyncio.run(store.load("p1")) is None
+    assert store.num_spilled() == 0
+    assert [path.name for path in tmp_path.iterdir()] == ["p1.pickle.bad"]
+
+
+def test_sessions_of_an_earlier_run(tmp_path):
+    earlier = ParticipantStore(tmp_path)
+    for pid in ("p1", "p2"):
+        earlier[pid] = {"pid": pid}
+        spill(earlier, pid)
+
+    store = ParticipantStore(tmp_path, is_stale=lambda pid, spilled_at: pid == "p2")
+    store._scan()
+    assert store.num_spilled() == 1
+    assert asyncio.run(store.load("p2")) is None
+    assert not (tmp_path / "p2.pickle.z").exists()
+    assert asyncio.run(store.load("p1")) == {"pid": "p1"}
@@ -0,0 +1,42 @@
+"""Recovery of participant sessions from the write-ahead log.
+"""
+import asyncio
+import json
+
+import bias_state
+import session_wal
+from benchmarks.common import make_logs, scorable_logs
+
+FILENAME = "cars.csv"
+
+
+def digest(client):
+    return json.dumps(client["bias_state"].metrics("full"), sort_keys=True, default=str)
+
+
+def test_concurrent_recoveries_replay_once(server, tmp_path, monkeypatch):
+    """Interactions of a participant arriving together after a restart all
+    get one session, with the metrics of the session that was logged.
+    """
+
+    async def run():
+        wal = session_wal.SessionWAL(tmp_path, snapshot_every=10, fsync_interval=0)
+        monkeypatch.setattr(server, "SESSION_WAL", wal)
+        # logged the way on_interaction does
+        logged = server.new_session("p1", FILENAME, "AWARENESS", "live", "0")
+        server.log_session_start("p1", logged)
+        for log in scorable_logs(FILENAME, make_logs(FILENAME, 35, seed=1)):
+            record = server.fold_bias_log(logged, log)
+            wal.append("p1", {"type": "log", "log": bias_state.compact_log(log, record)})
+            if wal.needs_snapshot("p1"):
+                wal.snapshot("p1", server.session_snapshot(logged))
+        await wal.stop()
+
+        # the server restarted
+        monkeypatch.setattr(server, "SESSION_WAL", session_wal.SessionWAL(tmp_path, fsync_interval=0))
+        recovered = await asyncio.gather(server.recover_session("p1"), server.recover_session("p1"))
+        return logged, recovered
+
+    logged, (first, second) = asyncio.run(run())
+    assert first is second
+    assert digest(first) == digest(logged)
@@ -0,0 +1,46 @@
+"""Reading archived session logs back in rescore.
+"""
+import math
+
+import rescore
+import session_log
+from benchmarks.common import make_logs, scorable_logs
+
+COLUMNS = ["participant_id", "app_mode", "app_type", "app_level", "processed_at", "interaction_type", "input_data"]
+
+
+def write_tsv(path, responses):
+    with open(path, "w", newline="") as f:
+        for i, response in enumerate(responses):
+            f.write(session_log._tsv_row(i, response, COLUMNS, i == 0))
+
+
+def test_literal_eval_reads_non_finite_floats():
+    data = rescore.literal_eval("{'a': nan, 'b': [-inf, inf, 1], 'c': None}")
+    assert math.isnan(data["a"])
+    assert data["b"] == [-math.inf, math.inf, 1]
+    assert data["c"] is None
+
+
+def test_cumulative_dumps_are_scored_once(datasets, tmp_path):
+    logs = scorable_logs("cars.csv", make_logs("cars.csv", 30))
+    logs[3]["extra"] = float("nan")
+    responses = [
+        {
+            "participant_id": "p1",
+            "app_mode": "cars.csv",
+            "app_type": "AWARENESS",
+            "app_level": "live",
+            "processed_at": 1000 + i,
+            "interaction_type": log["interactionType"],
+            "input_data": log,
+        }
+        for i, log in enumerate(logs)
+    ]
+    # every save of an older server dumped the whole session so far
+    for saved_at, count in [(1, 10), (2, 20), (3, 20), (4, 30)]:
+        write_tsv(tmp_path / f"logs_p1_{saved_at}.tsv", responses[:count])
+    frame = rescore.rescore(rescore.find_logs([tmp_path]), workers=1)
+    assert len(frame) == len(logs)
+    assert set(frame["file"]) == {str(tmp_path / "logs_p1_4.tsv")}
+    assert frame["error"].isna().all()
@@ -0,0 +1,80 @@
+"""MessagePack serialization of interaction events, and the JSON fallback.
+"""
+import json
+import math
+
+import pytest
+
+import bias
+import bias_state
+import serialization
+from benchmarks.common import make_logs, scorable_logs
+
+
+def same(a, b):
+    """True if JSON-like data is equal, NaN equal to itself and integers to
+    the same floats.
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a):
+        return math.isnan(b)
+    if type(a) in (int, float) and type(b) in (int, float):
+        return a == b
+    return type(a) is type(b) and a == b
+
+
+def as_json(data):
+    # what the JSON serialization delivers
+    return json.loads(json.dumps(data))
+
+
+@pytest.mark.parametrize("filename", list(bias.DATA_MAP))
+def test_events_round_trip(datasets, filename):
+    """Interactions and responses with their metrics decode to what JSON
+    would have delivered.
+    """
+    state = bias_state.MetricState(filename)
+    for i, log in enumerate(scorable_logs(filename, make_logs(filename, 60, seed=6))):
+        interaction = dict(log, appMode=filename, participantId="p1", interactionAt=1000 * i)
+        decoded = serialization.decode(serialization.encode(interaction))
+        assert same(decoded, as_json(interaction)), interaction
+        state.update(decoded)
+        level = "full" if i % 2 else "deltas"
+        response = {"participant_id": "p1", "input_data": interaction, "output_data": state.metrics(level)}
+        state.mark_sent(response["output_data"])
+        assert same(serialization.decode(serialization.encode(response)), as_json(response)), level
+
+
+def test_float_arrays_are_packed():
+    values = [0.5, 1.0, 2.0, 3.25, 4.0, 5.0, 6.0, 7.0]
+    precise = [value + 0.1 for value in values]
+    for data in (values, precise, dict(zip("abcdefgh", values)), {1: 0.1, 2: "x"}):
+        assert serialization.decode(serialization.encode(data)) == as_json(data)
+    # float32 where that is exact
+    assert len(serialization.encode(values)) < len(serialization.encode(precise))
+    # too short, or not all floats
+    for data in (values[:3], [0.5] * 7 + ["x"], [True] * 8, [2**60] + values):
+        assert serialization.decode(serialization.encode(data)) == data
+
+
+def test_json_fallback():
+    serializations = serialization.Serializations()
+    assert serializations.negotiate("a", ["cbor", "msgpack"]) == "msgpack"
+    assert serializations.negotiate("b", ["cbor"]) == "json"
+    assert serializations.negotiate("c", []) == "json"
+    assert serializations.get("unknown") == "json"
+
+    data = {"participant_id": "p1", "output_data": [0.5] * 10}
+    # JSON sockets get the data as it is, for socket.io to serialize
+    assert serializations.encode(data, serializations.get("b")) is data
+    assert serializations.decode(data) is data
+    blob = serializations.encode(data, serializations.get("a"))
+    assert isinstance(blob, bytes)
+    assert serializations.decode(blob) == data
+    assert (serializations.encoded, serializations.decoded) == (1, 1)
+
+    serializations.forget("a")
+    assert serializations.get("a") == "json"
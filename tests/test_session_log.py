@@ -0,0 +1,54 @@
+"""Ordering and closing of the streamed session logs.
+"""
+import session_log
+
+
+class Writer:
+    """Records the operations of a SessionLog in place of a LogWriter."""
+
+    def __init__(self):
+        self.ops = []
+
+    def write(self, path, format_row):
+        self.ops.append(("write", format_row()))
+
+    def close(self, path):
+        self.ops.append(("close", None))
+
+
+def response(n):
+    return {"n": n, "output_data": None}
+
+
+def test_rows_are_written_in_reserved_order():
+    writer = Writer()
+    log = session_log.SessionLog(writer, "logs.ndjson", "ndjson")
+    first, second = response(1), response(2)
+    log.reserve(first)
+    log.reserve(second)
+    log.commit(second)
+    assert writer.ops == []
+    log.commit(first)
+    assert [row for _, row in writer.ops] == ['{"n": 1, "output_data": null}\n', '{"n": 2, "output_data": null}\n']
+
+
+def test_close_waits_for_reserved_rows():
+    writer = Writer()
+    log = session_log.SessionLog(writer, "logs.ndjson", "ndjson")
+    pending = response(1)
+    log.reserve(pending)
+    log.close()
+    assert writer.ops == []
+    pending["output_data"] = {"metric": 1}
+    log.commit(pending)
+    assert writer.ops == [("write", '{"n": 1, "output_data": {"metric": 1}}\n'), ("close", None)]
+    log.commit(response(2))
+    assert len(writer.ops) == 2
+
+
+def test_forced_close_writes_reserved_rows():
+    writer = Writer()
+    log = session_log.SessionLog(writer, "logs.ndjson", "ndjson")
+    log.reserve(response(1))
+    log.close(force=True)
+    assert writer.ops == [("write", '{"n": 1, "output_data": null}\n'), ("close", None)]